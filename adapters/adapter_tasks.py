@@ -1,12 +1,13 @@
 from adapters.scraper_adapter import ScraperAdapter
-from adapters.costa_rica_adapter import CostaRicaAdapter
-from adapters.mexico_adapter import MexicoAdapter
-from adapters.nicaragua_adapter import NicaraguaAdapter
-from adapters.el_salvador_adapter import ElSalvadorAdapter
-from queue import Queue
+from pipeline.upload_queue import UploadQueue
+from metrics import track_scrape
+from scrapers import rate_limit
+from scheduler import REALTIME, BACKFILL
+from concurrent.futures import CancelledError
 from datetime import datetime
 from enum import Enum
-import time
+import importlib
+import sys
 import threading
 
 class AdapterTypes(Enum):
@@ -18,28 +19,68 @@ class AdapterTypes(Enum):
     Nicaragua=3,
     Mexico=4
 
+
+# module/class of each adapter, imported on first use since every
+# adapter drags in selenium, bs4 and pandas through its scraper
+ADAPTER_PATHS = {
+    AdapterTypes.Costa_Rica: ('adapters.costa_rica_adapter', 'CostaRicaAdapter'),
+    AdapterTypes.El_Salvador: ('adapters.el_salvador_adapter', 'ElSalvadorAdapter'),
+    AdapterTypes.Mexico: ('adapters.mexico_adapter', 'MexicoAdapter'),
+    AdapterTypes.Nicaragua: ('adapters.nicaragua_adapter', 'NicaraguaAdapter')
+}
+
+
+def adapter_class(adapter_type: AdapterTypes) -> type:
+    '''
+    Imports and returns the adapter class for a type
+    '''
+    module, name = ADAPTER_PATHS[adapter_type]
+    return getattr(importlib.import_module(module), name)
+
+
+def new_adapter(adapter_type: AdapterTypes) -> ScraperAdapter:
+    '''
+    Builds a fresh adapter of the given type
+    '''
+    return adapter_class(adapter_type)()
+
+
+def adapter_type_of(adapter: ScraperAdapter) -> AdapterTypes:
+    '''
+    Figures out the type of an adapter instance
+
+    Only looks at adapter modules that were already imported; an
+    instance can't exist without its module being loaded. Adapters run
+    on a ProcessPool say what type they are
+    '''
+    if isinstance(getattr(adapter, 'adapter_type', None), AdapterTypes):
+        return adapter.adapter_type
+    for adapter_type, (module, name) in ADAPTER_PATHS.items():
+        loaded = sys.modules.get(module)
+        if loaded is not None and isinstance(adapter, getattr(loaded, name)):
+            return adapter_type
+    return None
+
+
 class AdapterThread(threading.Thread):
     '''
     Automatically handle tasks for simultanious scraping
 
     Make use of multi-threading
     '''
-    __kill = False
     __running = False
     bad_adapter = False
-    __bypass = False
     __adapter_type = None
-    __new_adapter_switcher = {
-        AdapterTypes.Costa_Rica: CostaRicaAdapter,
-        AdapterTypes.El_Salvador: ElSalvadorAdapter,
-        AdapterTypes.Mexico: MexicoAdapter,
-        AdapterTypes.Nicaragua: NicaraguaAdapter
-    }
-
-    # in seconds
-    __watchdog_time = 5
-
-    def __init__(self, adapter: ScraperAdapter, upload_data: list):
+    # Supervisor told about failures and successes, if any
+    supervisor = None
+    # PriorityScheduler running the scrapes, if any (otherwise they run here)
+    scheduler = None
+    # PublishSchedule timing the scrapes, if any (otherwise every frequency())
+    schedule = None
+    # builds fresh adapters (ProcessPool.adapter in process mode)
+    adapter_factory = staticmethod(new_adapter)
+
+    def __init__(self, adapter: ScraperAdapter, upload_data: UploadQueue):
         super(AdapterThread, self).__init__()
         if not isinstance(adapter, ScraperAdapter):
             raise TypeError(
@@ -47,27 +88,20 @@ class AdapterThread(threading.Thread):
                 type(adapter))
         self.adapter = adapter
         self.upload_queue = upload_data
-        if isinstance(adapter, MexicoAdapter):
-            self.__adapter_type = AdapterTypes.Mexico
-        elif isinstance(adapter, NicaraguaAdapter):
-            self.__adapter_type = AdapterTypes.Nicaragua
-        elif isinstance(adapter, ElSalvadorAdapter):
-            self.__adapter_type = AdapterTypes.El_Salvador
-        elif isinstance(adapter, CostaRicaAdapter):
-            self.__adapter_type = AdapterTypes.Costa_Rica
+        self.__adapter_type = adapter_type_of(adapter)
+        # set to cut the sleep short: a scrape was requested or we're stopping
+        self.__wakeup = threading.Event()
+        self.__kill = False
     
     def __scrape_intermittent(self, startdate, enddate):
         try:
-            self.upload_queue.append(
-                (
-                    self.__adapter_type,
-                    self.__new_adapter_switcher[self.__adapter_type]().scrape_history(
-                        start_day=startdate.day, start_month=startdate.month,
-                        start_year=startdate.year, end_day=enddate.day,
-                        end_month=enddate.month, end_year=enddate.year
-                    )
-                )
-            )
+            with track_scrape(self.__adapter_type.name, 'history') as scrape:
+                data = scrape.returned(self.adapter_factory(self.__adapter_type).scrape_history(
+                    start_day=startdate.day, start_month=startdate.month,
+                    start_year=startdate.year, end_day=enddate.day,
+                    end_month=enddate.month, end_year=enddate.year
+                ))
+            self.upload_queue.put((self.__adapter_type, data))
         except Exception as e:
             print("FAILED", startdate, "ADAPTER:", self.__adapter_type)
 
@@ -75,8 +109,12 @@ class AdapterThread(threading.Thread):
         '''
         Gets historical data and throws it into queue
 
-        This is a seperate task and will be threaded
+        This is a seperate task and will be threaded, or queued as a
+        backfill on the scheduler
         '''
+        if self.scheduler:
+            return self.scheduler.submit(
+                self.__adapter_type, BACKFILL, self.__scrape_intermittent, startdate, enddate)
         threading.Thread(
             target=self.__scrape_intermittent,
             kwargs={
@@ -97,9 +135,16 @@ class AdapterThread(threading.Thread):
         '''
         Reset to a new adapter
         '''
-        self.adapter = self.__new_adapter_switcher[self.__adapter_type]()
+        self.adapter = self.adapter_factory(self.__adapter_type)
         self.bad_adapter = False
 
+    def recover(self):
+        '''
+        Resets the adapter and retries the scrape that failed right away
+        '''
+        self.reset_adapter()
+        self.schedule_todays_data_now()
+
     def set_adapter(self, adapter: ScraperAdapter):
         '''
         Set adapter to new adapter
@@ -119,20 +164,39 @@ class AdapterThread(threading.Thread):
         '''
         This will let the running thread know to reattempt a scrape now
         '''
-        self.__bypass = True
-
+        self.__wakeup.set()
 
-    def attempt_to_queue_todays_data(self):
+    def attempt_to_queue_todays_data(self) -> dict:
         '''
         This will attempt to get todays data
+
+        returns what was queued, if anything
         '''
+        if not self.scheduler:
+            return self.__queue_todays_data()
+        future = self.scheduler.submit(self.__adapter_type, REALTIME, self.__queue_todays_data)
+        try:
+            if future:
+                return future.result()
+        except CancelledError:
+            pass
+        return None
+
+    def __queue_todays_data(self):
         try:
-            data = self.adapter.scrape_new_data()
+            with track_scrape(self.__adapter_type.name) as scrape, rate_limit.realtime():
+                data = scrape.returned(self.adapter.scrape_new_data())
             if data:
-                self.upload_queue.append((self.__adapter_type, data))
+                self.upload_queue.put((self.__adapter_type, data))
         except Exception as e:
             print(e)
             self.bad_adapter = True
+            if self.supervisor:
+                self.supervisor.failed(self.__adapter_type, e)
+            return None
+        if self.supervisor:
+            self.supervisor.succeeded(self.__adapter_type)
+        return data
 
     def is_alive(self):
         return self.__running
@@ -145,29 +209,34 @@ class AdapterThread(threading.Thread):
         '''
         Runs the adapter for realtime data gathering
 
-        Sleeps a majority of its time
-
-        This also has a fake watchdog so that we can kill the process
-        in a reasonable amount of time
+        Sleeps a majority of its time, until its next scrape or until
+        schedule_todays_data_now/stop wake it up
         '''
         self.__running = True
-        freq = self.adapter.frequency()
-        # equals freq so it scrapes once before waiting
-        total_sleep = freq
         while not self.__kill:
-            if total_sleep < freq and not self.__bypass:
-                total_sleep += self.__watchdog_time
-                time.sleep(self.__watchdog_time)
+            # cleared before scraping so a request made meanwhile isn't lost
+            self.__wakeup.clear()
+            data = self.attempt_to_queue_todays_data()
+            if self.schedule:
+                self.__wakeup.wait(self.schedule.wait(data))
             else:
-                total_sleep = 0
-                self.__bypass = False
-                self.attempt_to_queue_todays_data()
+                self.__wakeup.wait(self.adapter.frequency())
         self.__running = False
         return super().run()
 
-    def join(self, timeout=30):
+    def stop(self):
+        '''
+        Tells the thread to exit without waiting for it
+
+        It exits right away when sleeping, or once the scrape it's on returns
+        '''
         self.__kill = True
-        super().join(timeout)
+        self.__wakeup.set()
+
+    def join(self, timeout=30):
+        self.stop()
+        if self.ident is not None:
+            super().join(timeout)
 
     def __del__(self):
         self.join()
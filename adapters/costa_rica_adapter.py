@@ -2,6 +2,7 @@ import datetime
 import pandas as pd
 from scrapers.costa_rica import CostaRica
 from adapters.scraper_adapter import ScraperAdapter
+from forecast.timekeys import epoch_hour
 
 """
 This class has the scraper_adaptor interface which need to be implemented here.
@@ -177,7 +178,7 @@ class CostaRicaAdapter(ScraperAdapter):
     def __filter_data(self, data) -> dict:
         buffer = dict()
         for i in range(0, len(data) - 1):
-            time = data.iat[i, 0].strftime("%H-%d/%m/%Y")
+            time = epoch_hour(data.iat[i, 0], 'America/Costa_Rica')
             if time in buffer:
                 continue
             entries = list()
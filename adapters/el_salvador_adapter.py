@@ -1,5 +1,6 @@
 from adapters.scraper_adapter import ScraperAdapter
 from scrapers.el_salvador import ElSalvador
+from forecast.timekeys import epoch_hour
 import copy
 import pytz
 import datetime
@@ -88,14 +89,14 @@ class ElSalvadorAdapter(ScraperAdapter):
         this just strips BA and creates a dict:
             keys are time : value is list[dict{value, type}, ...]
 
-        Time is str adjusted to match the format IN THAT TZ: 'HH-DD/MM/YYYY'
+        Time is the epoch hour (see forecast.timekeys)
         '''
         if not data:
             return dict()
         buffer = dict()
         for i in range(0, len(data)):
             entries = list()
-            formatted_time = data[i]['ts'].strftime("%H-%d/%m/%Y")
+            formatted_time = epoch_hour(data[i]['ts'], 'America/El_Salvador')
             if formatted_time in buffer:
                 continue
             for j in range(i, len(data)):
@@ -118,14 +119,8 @@ class ElSalvadorAdapter(ScraperAdapter):
         '''
         if not start_time:
             return data
-        ordered = sorted(data.keys())
-        time_stamp = start_time
-        for entry in ordered:
-            entry_time = datetime.datetime.strptime(entry, "%H-%d/%m/%Y")
-            entry_time = entry_time.replace(tzinfo=pytz.timezone('America/El_Salvador'))
-            if entry_time < time_stamp:
-                data.pop(entry)
-        return data
+        start = epoch_hour(start_time, 'America/El_Salvador')
+        return {hour: entries for hour, entries in data.items() if hour >= start}
 
     def frequency(self):
         '''
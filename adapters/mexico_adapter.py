@@ -1,5 +1,6 @@
 from adapters.scraper_adapter import ScraperAdapter
 from scrapers.mexico import Mexico
+from forecast.timekeys import epoch_hour
 import copy
 import pytz
 import datetime
@@ -68,13 +69,11 @@ class MexicoAdapter(ScraperAdapter):
         '''
         Returns formated data for the specified range
         '''
-        end_time = datetime.datetime(
-            year=end_year, month=end_month,
-            day=end_day, tzinfo=pytz.timezone('Mexico/General'))
-        
-        start_time = datetime.datetime(
-            year=start_year, month=start_month,
-            day=start_day, tzinfo=pytz.timezone('Mexico/General'))
+        end_time = pytz.timezone('Mexico/General').localize(datetime.datetime(
+            year=end_year, month=end_month, day=end_day))
+
+        start_time = pytz.timezone('Mexico/General').localize(datetime.datetime(
+            year=start_year, month=start_month, day=start_day))
 
         data = []
         if (end_month != start_month):
@@ -99,12 +98,12 @@ class MexicoAdapter(ScraperAdapter):
         this just strips BA and creates a dict:
             keys are time : value is list[dict{value, type}, ...]
 
-        Time is str adjusted to match the format IN THAT TZ: 'HH-DD/MM/YYYY'
+        Time is the epoch hour (see forecast.timekeys)
         '''
         buffer = dict()
         for i in range(0, len(data)):
             entries = list()
-            formatted_time = data[i]['ts'].strftime("%H-%d/%m/%Y")
+            formatted_time = epoch_hour(data[i]['ts'], 'Mexico/General')
             if formatted_time in buffer:
                 continue
             for j in range(i, len(data)):
@@ -126,15 +125,12 @@ class MexicoAdapter(ScraperAdapter):
         '''
         if not end_time:
             return data
-        ordered = sorted(data.keys())
-        for entry in ordered:
-            entry_time = datetime.datetime.strptime(entry, "%H-%d/%m/%Y")
-            entry_time = entry_time.replace(tzinfo=pytz.timezone('Mexico/General'))
-            if end_time and entry_time >= (end_time + datetime.timedelta(days=1)):
-                data.pop(entry)
-            if start_time and entry_time < start_time:
-                data.pop(entry)
-        return data
+        end = epoch_hour(end_time + datetime.timedelta(days=1), 'Mexico/General')
+        start = epoch_hour(start_time, 'Mexico/General') if start_time else None
+        return {
+            hour: entries for hour, entries in data.items()
+            if hour < end and (start is None or hour >= start)
+        }
 
     def frequency(self):
         '''
@@ -1,4 +1,5 @@
 from adapters.scraper_adapter import ScraperAdapter
+from forecast.timekeys import epoch_hour
 from scrapers.nicaragua import Nicaragua
 import datetime
 import pandas as pd
@@ -124,7 +125,7 @@ class NicaraguaAdapter(ScraperAdapter):
 
         buffer = dict()
         for i in range(0, len(data) - 1, 6):
-            time = data.iat[i, 0].strftime("%H-%d/%m/%Y")
+            time = epoch_hour(data.iat[i, 0], 'America/Managua')
             entries = list()
             for j in range(6):
                 dict_val = dict()
@@ -54,6 +54,8 @@ class ScraperAdapter(ABC):
     # and combine production types in both functions
     # We want: TIME, VALUE, PRODUCTION TYPE
     # Thermal, Nuclear, Hydro, Wind, Solar
+    # Adapters return {epoch hour: [{'value', 'type'}, ...]}, the uploader
+    # turns epoch hours into 'HH-DD/MM/YYYY' keys (see forecast.timekeys)
 
     '''
         scraper data : [{date, value, meta, ba}, ... ],
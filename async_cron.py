@@ -0,0 +1,213 @@
+'''
+asyncio version of cron, used by the manager's asyncio runtime
+
+Every adapter/forecaster is a coroutine that sleeps until its next run
+instead of an OS thread ticking a watchdog. Scrapes (Selenium),
+forecasts (Prophet worker) and historical requests still block, so they
+run on the same PriorityScheduler as cron's (per source pools, realtime
+before forecasts before backfills, backfill admission), and failures
+are backed off and counted like cron's Supervisor does.
+'''
+from adapters.adapter_tasks import AdapterTypes
+from forecast.forecast_tasks import ForecasterTypes
+from pipeline.async_queue import AsyncUploadQueue
+from startup import startup_timer
+from metrics import track_scrape
+from scrapers import rate_limit
+from cron import default_builders
+from publish_schedule import PublishSchedule
+from database.leases import run_leased
+from scheduler import PriorityScheduler, REALTIME, FORECAST, BACKFILL
+from supervisor import Supervisor
+from datetime import datetime
+import asyncio
+
+
+class AsyncCron:
+    '''
+    Schedules the adapters and forecasters on the running event loop
+
+    Same controls as cron (request_historical, scrape_todays_data_now,
+    set_last_scrape_date), but they must be called from the loop
+    '''
+
+    def __init__(self, queue: AsyncUploadQueue, main_job_queue: list, builders=None,
+                 workers_per_source=2, max_queued_backfills=None, schedules=None, leases=None,
+                 processes=None, supervisor=None):
+        self.manager_queue = queue
+        self.main_job_queue = main_job_queue
+        self.cron_alive = False
+        # type -> its current adapter/forecaster
+        self.sources = dict()
+        # type -> PublishSchedule, for sources run on their publication times
+        self.schedules = {
+            kind: PublishSchedule(**arguments) for kind, arguments in (schedules or {}).items()
+        }
+        # LeaseKeeper shared with other nodes, if any: one node forecasts a country per run
+        self.leases = leases
+        # ProcessPool the adapters run on, if any (otherwise on the executor)
+        self.processes = processes
+        self.__builders = builders or default_builders(processes)
+        self.scheduler = PriorityScheduler(workers_per_source, {BACKFILL: max_queued_backfills})
+        # only used for its backoff and restart counts, the sources rebuild themselves
+        self.supervisor = supervisor or Supervisor()
+        # type -> consecutive failures
+        self.__failures = dict()
+        self.__wakeups = dict()
+        self.__tasks = []
+        # historical requests in flight, referenced so they aren't collected
+        self.__requests = set()
+
+    async def start(self):
+        '''
+        Builds every source in parallel, then starts a coroutine for each
+        '''
+        kinds = list(self.__builders)
+        built = await asyncio.gather(*(self.__build(kind) for kind in kinds))
+        self.sources = dict(zip(kinds, built))
+        self.cron_alive = True
+        for kind in kinds:
+            self.__wakeups[kind] = asyncio.Event()
+            self.__tasks.append(asyncio.create_task(self.__run_source(kind), name=kind.name))
+
+    async def stop(self):
+        '''
+        Cancels the source coroutines and historical requests
+
+        A scrape that's already running finishes on its thread,
+        its result is dropped
+        '''
+        self.cron_alive = False
+        tasks = self.__tasks + list(self.__requests)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__tasks.clear()
+        self.scheduler.shutdown(0)
+        if self.leases:
+            self.leases.stop()
+        if self.processes:
+            self.processes.shutdown(wait=False)
+
+    def get_tasks(self) -> list:
+        return list(self.__tasks)
+
+    def get_restarts(self) -> dict:
+        return self.supervisor.restarts()
+
+    def set_last_scrape_date(self, adapter_type: AdapterTypes, date: datetime):
+        '''
+        Set the last scraped date for the adapters
+        '''
+        self.sources[adapter_type].set_last_scraped_date(date)
+
+    def scrape_todays_data_now(self, source_type):
+        '''
+        Wakes a source up to run right away instead of at its next slot
+        '''
+        self.__wakeups[source_type].set()
+
+    def request_historical(self, adapter_type: AdapterTypes, start_date: datetime, end_date: datetime):
+        '''
+        Queues historical data from a fresh adapter, in the background
+        '''
+        task = asyncio.create_task(self.__scrape_history(adapter_type, start_date, end_date))
+        self.__requests.add(task)
+        task.add_done_callback(self.__requests.discard)
+        return task
+
+    async def __on_scheduler(self, kind, priority: int, function, *args, **kwargs):
+        '''
+        Runs function on the scheduler pool of kind's source
+
+        returns its result, raises asyncio.CancelledError if it was turned down
+        '''
+        future = self.scheduler.submit(kind, priority, function, *args, **kwargs)
+        if future is None:
+            raise asyncio.CancelledError()
+        return await asyncio.wrap_future(future)
+
+    async def __build(self, kind):
+        with startup_timer.phase('warm up %s' % kind):
+            return await self.__on_scheduler(kind, REALTIME, self.__builders[kind])
+
+    async def __scrape_history(self, adapter_type, startdate, enddate):
+        try:
+            adapter = await self.__on_scheduler(adapter_type, BACKFILL, self.__builders[adapter_type])
+            data = await self.__on_scheduler(
+                adapter_type, BACKFILL, self.__scrape_history_blocking, adapter_type, adapter,
+                start_day=startdate.day, start_month=startdate.month,
+                start_year=startdate.year, end_day=enddate.day,
+                end_month=enddate.month, end_year=enddate.year)
+            await self.manager_queue.put_async((adapter_type, data))
+        except asyncio.CancelledError:
+            if not self.cron_alive:
+                raise
+            print("Too many backfills queued for", adapter_type, "skipping", startdate)
+        except Exception as e:
+            print("FAILED", startdate, "ADAPTER:", adapter_type)
+
+    @staticmethod
+    def __scrape_history_blocking(adapter_type, adapter, **dates):
+        with track_scrape(adapter_type.name, 'history') as scrape:
+            return scrape.returned(adapter.scrape_history(**dates))
+
+    def __collect(self, kind, source):
+        if isinstance(kind, AdapterTypes):
+            with track_scrape(kind.name) as scrape, rate_limit.realtime():
+                return scrape.returned(source.scrape_new_data())
+        if self.leases:
+            return run_leased(
+                self.leases, 'forecast/%s' % kind.name, source.frequency(),
+                lambda: source.get_exported_data(worker=True))
+        return source.get_exported_data(worker=True)
+
+    async def __run_source(self, kind):
+        '''
+        Runs a source once, then sleeps for its frequency (or until its
+        next publication) or until woken up
+
+        A failed run is retried with a fresh adapter after the supervisor's
+        backoff, forecasters are rebuilt after every run (same as cron)
+        '''
+        wakeup = self.__wakeups[kind]
+        priority = REALTIME if isinstance(kind, AdapterTypes) else FORECAST
+        while self.cron_alive:
+            wakeup.clear()
+            data = None
+            try:
+                data = await self.__on_scheduler(kind, priority, self.__collect, kind, self.sources[kind])
+                if data:
+                    await self.manager_queue.put_async((kind, data))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.__failures[kind] = self.__failures.get(kind, 0) + 1
+                delay = self.supervisor.backoff(self.__failures[kind])
+                print(kind, "failed:", e, "- restarting in", delay, "s")
+                await asyncio.sleep(delay)
+                await self.__rebuild(kind, 'failure')
+                continue
+            self.__failures[kind] = 0
+            if isinstance(kind, ForecasterTypes):
+                await self.__rebuild(kind, 'refresh')
+            if kind in self.schedules:
+                delay = self.schedules[kind].wait(data)
+            else:
+                delay = self.sources[kind].frequency()
+            try:
+                await asyncio.wait_for(wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __rebuild(self, kind, reason: str):
+        try:
+            self.sources[kind] = await self.__on_scheduler(kind, REALTIME, self.__builders[kind])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # keeps the old one, the next failure backs off further
+            self.__failures[kind] = self.__failures.get(kind, 0) + 1
+            print("Couldn't rebuild", kind, ":", e)
+            return
+        self.supervisor.record_restart(kind, reason)
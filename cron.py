@@ -1,13 +1,33 @@
-from scrapers.nicaragua import Nicaragua
-from adapters.el_salvador_adapter import ElSalvadorAdapter
-from adapters.mexico_adapter import MexicoAdapter
-from adapters.nicaragua_adapter import NicaraguaAdapter
-from adapters.costa_rica_adapter import CostaRicaAdapter
 from adapters.scraper_adapter import ScraperAdapter
-from adapters.adapter_tasks import AdapterThread, AdapterTypes
+from adapters.adapter_tasks import AdapterThread, AdapterTypes, new_adapter
 from forecast.forecast_tasks import ForecasterTypes, ForecasterThread, ForecastFactory
-from threading import Thread
+from pipeline.upload_queue import UploadQueue
+from startup import startup_timer
+from supervisor import Supervisor
+from scheduler import PriorityScheduler, BACKFILL
+from publish_schedule import PublishSchedule
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import time
+
+def default_builders(processes=None) -> dict:
+    '''
+    {type: function building its adapter/forecaster} for every source cron runs
+
+    With a ProcessPool (see pipeline.processes) the adapters run on it
+    '''
+    factory = processes.adapter if processes else new_adapter
+    return {
+        AdapterTypes.El_Salvador: lambda: factory(AdapterTypes.El_Salvador),
+        AdapterTypes.Mexico: lambda: factory(AdapterTypes.Mexico),
+        AdapterTypes.Nicaragua: lambda: factory(AdapterTypes.Nicaragua),
+        AdapterTypes.Costa_Rica: lambda: factory(AdapterTypes.Costa_Rica),
+        ForecasterTypes.El_Salvador: ForecastFactory.el_salvador_forecaster,
+        ForecasterTypes.Nicaragua: ForecastFactory.nicaragua_forecaster,
+        ForecasterTypes.Costa_Rica: ForecastFactory.costa_rica_forecaster,
+        # ForecasterTypes.Mexico: ForecastFactory.mexico_forecaster,
+    }
+
 
 class cron:
     '''
@@ -17,29 +37,42 @@ class cron:
     manager_queue = None
     main_job_queue = None
     cron_alive = True
-    __cron_thread = None
+    supervisor = None
+    scheduler = None
+    leases = None
+    processes = None
     __switcher = dict()
 
-    def __init__(self, queue: list, main_job_queue: list):
+    def __init__(self, queue: UploadQueue, main_job_queue: list,
+                 workers_per_source=2, max_queued_backfills=None, schedules=None, leases=None,
+                 processes=None):
         self.manager_queue = queue
         self.main_job_queue = main_job_queue
-        esa = ElSalvadorAdapter()
-        ma = MexicoAdapter()
-        na = NicaraguaAdapter()
-        cra = CostaRicaAdapter()
-        esf = ForecastFactory.el_salvador_forecaster()
-        nf = ForecastFactory.nicaragua_forecaster()
-        crf = ForecastFactory.costa_rica_forecaster()
-        # mf = ForecastFactory.mexico_forecaster()
-
-        esat = AdapterThread(esa, queue)
-        mat = AdapterThread(ma, queue)
-        nat = AdapterThread(na, queue)
-        crat = AdapterThread(cra, queue)
-        esft = ForecasterThread(esf, queue)
-        nft = ForecasterThread(nf, queue)
-        crft = ForecasterThread(crf, queue)
-        # mft = ForecasterThread(mf, queue)
+        self.supervisor = Supervisor()
+        # scrapes, forecasts and backfills of a source share its workers,
+        # most urgent first (see scheduler)
+        self.scheduler = PriorityScheduler(
+            workers_per_source, max_queued={BACKFILL: max_queued_backfills})
+        # {adapter type: PublishSchedule arguments} for adapters scraped on
+        # their publication times instead of every frequency()
+        self.__schedules = schedules or dict()
+        # LeaseKeeper shared with other nodes, if any
+        self.leases = leases
+        # ProcessPool the adapters run on, if any (otherwise in threads)
+        self.processes = processes
+        # adapters and forecasters are independent of each other and mostly
+        # wait on imports/drivers/the db, so warm them up side by side
+        builders = default_builders(processes)
+        built = self.__warm_up(builders)
+
+        esat = AdapterThread(built[AdapterTypes.El_Salvador], queue)
+        mat = AdapterThread(built[AdapterTypes.Mexico], queue)
+        nat = AdapterThread(built[AdapterTypes.Nicaragua], queue)
+        crat = AdapterThread(built[AdapterTypes.Costa_Rica], queue)
+        esft = ForecasterThread(built[ForecasterTypes.El_Salvador], queue)
+        nft = ForecasterThread(built[ForecasterTypes.Nicaragua], queue)
+        crft = ForecasterThread(built[ForecasterTypes.Costa_Rica], queue)
+        # mft = ForecasterThread(built[ForecasterTypes.Mexico], queue)
 
         self.__switcher = {
             AdapterTypes.El_Salvador: esat,
@@ -66,6 +99,24 @@ class cron:
         )
         self.__set_up_health_check()
 
+    @staticmethod
+    def __warm_up(builders: dict) -> dict:
+        '''
+        Runs every builder concurrently, each timed as its own startup phase
+
+        Returns {type: built object}, re-raises the first failure
+        '''
+        def build(kind, builder):
+            with startup_timer.phase('warm up %s' % kind):
+                return builder()
+
+        with ThreadPoolExecutor(max_workers=len(builders)) as pool:
+            futures = {
+                kind: pool.submit(build, kind, builder)
+                for kind, builder in builders.items()
+            }
+            return {kind: future.result() for kind, future in futures.items()}
+
     def get_threads(self) -> list:
         return self.created_threads
 
@@ -102,22 +153,39 @@ class cron:
 
     def __set_up_health_check(self):
         '''
-        New thread w/ loop to constantly check health of adapters
+        Starts the threads, with the supervisor restarting the ones that fail
         '''
         self.cron_alive = True
+        for kind, t in self.__switcher.items():
+            if isinstance(t, AdapterThread):
+                self.supervisor.watch(kind, t.recover)
+            elif isinstance(t, ForecasterThread):
+                self.supervisor.watch(kind, t.reset_forecaster)
+            t.supervisor = self.supervisor
+            t.scheduler = self.scheduler
+            if isinstance(t, AdapterThread) and kind in self.__schedules:
+                t.schedule = PublishSchedule(**self.__schedules[kind])
+            if isinstance(t, AdapterThread) and self.processes:
+                t.adapter_factory = self.processes.adapter
+            if isinstance(t, ForecasterThread):
+                t.leases = self.leases
+        self.supervisor.start()
         for t in self.created_threads:
             if isinstance(t, AdapterThread):
                 t.start()
             elif isinstance(t, ForecasterThread):
                 t.start()
-        self.__cron_thread = Thread(target=self.__health_loop)
-        self.__cron_thread.start()
 
-    def __health_loop(self):
-        while self.cron_alive:
-            self.check_threads()
+    def get_restarts(self) -> dict:
+        '''
+        {type: times its adapter/forecaster was rebuilt}
+        '''
+        return self.supervisor.restarts()
 
     def check_threads(self):
+        '''
+        Resets every failed adapter/forecaster now, without the supervisor's backoff
+        '''
         if not self.created_threads:
             return
         for t in self.created_threads:
@@ -126,12 +194,32 @@ class cron:
             elif isinstance(t, ForecasterThread) and t.bad_forecaster:
                 t.reset_forecaster()
 
-    def __del__(self):
+    def stop(self, timeout=30) -> float:
+        '''
+        Stops every thread, waiting up to timeout seconds in total
+
+        All of them are told to stop first and then joined, so the wait is
+        the slowest thread (one that's mid scrape), not the sum of them
+
+        returns how long it took
+        '''
+        began = time.perf_counter()
         self.cron_alive = False
-        self.__cron_thread.join()
-        # TODO join forecaster threads
         for t in self.created_threads:
-            if isinstance(t, AdapterThread):
-                t.join()
-            elif isinstance(t, ForecasterThread):
-                t.join()
+            t.stop()
+        deadline = began + timeout
+        self.supervisor.stop(max(0, deadline - time.perf_counter()))
+        self.scheduler.shutdown(max(0, deadline - time.perf_counter()))
+        if self.leases:
+            self.leases.stop()
+        if self.processes:
+            self.processes.shutdown(wait=False)
+        for t in self.created_threads:
+            t.join(max(0, deadline - time.perf_counter()))
+        elapsed = time.perf_counter() - began
+        print("cron stopped in", round(elapsed, 3), "s")
+        return elapsed
+
+    def __del__(self):
+        if self.cron_alive:
+            self.stop()
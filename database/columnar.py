@@ -0,0 +1,252 @@
+'''
+Columnar layout for week docs
+
+Legacy docs hold one key per hour:
+    {'_id': 'DD/MM/YYYY', 'HH-DD/MM/YYYY': [{'value': x, 'type': y}, ...], ...}
+
+Columnar docs hold one fixed order array of the week's 168 hours per
+type plus a validity mask of which hours exist:
+    {
+        '_id': 'DD/MM/YYYY',
+        'schema': 'columnar',
+        'hours': <number of valid hours>,
+        'mask': <168 bits>,
+        'columns': {type: <168 little endian float64, NaN if missing>, ...}
+    }
+
+Uploads still $set hour keys, so a migrated doc can pick up new legacy
+keys (forecasts, and historic hours its mask doesn't have yet). decode
+reads both (legacy keys win, they were written later) and running the
+migration again folds them into the columns.
+
+Migrate with:
+    python -m database.columnar <country> [Historic|Forecast] [--dry-run]
+'''
+from database.coverage import COLUMNAR_FIELDS, DOC_FORMAT, HOURS_PER_DOC
+from bson.binary import Binary
+import bson
+from pymongo import ReplaceOne
+import numpy as np
+import datetime
+import sys
+
+SCHEMA = 'columnar'
+DTYPE = '<f8'
+
+
+def is_columnar(doc: dict) -> bool:
+    return doc.get('schema') == SCHEMA
+
+
+def week_start(doc_id: str) -> datetime.datetime:
+    return datetime.datetime.strptime(doc_id, DOC_FORMAT)
+
+
+def hour_slot(key: str, start: datetime.datetime) -> int:
+    '''
+    Position of an 'HH-DD/MM/YYYY' key within the week starting at start
+    '''
+    hour, date = key.split('-')
+    day, month, year = date.split('/')
+    days = (datetime.datetime(int(year), int(month), int(day)) - start).days
+    return days * 24 + int(hour)
+
+
+def slot_key(start: datetime.datetime, slot: int) -> str:
+    return (start + datetime.timedelta(hours=int(slot))).strftime("%H-%d/%m/%Y")
+
+
+def decode_mask(mask: bytes) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(mask, dtype=np.uint8))[:HOURS_PER_DOC].astype(bool)
+
+
+def stored_hours(doc: dict) -> list:
+    '''
+    The hour keys set in a columnar doc's mask (only needs '_id' and 'mask')
+    '''
+    start = week_start(doc['_id'])
+    return [slot_key(start, slot) for slot in np.flatnonzero(decode_mask(doc['mask']))]
+
+
+def hour_keys(doc: dict) -> list:
+    '''
+    The hour keys a doc holds in either layout
+
+    Only needs '_id', 'mask' and the keys, not the values
+    (works on the output of database.coverage_index.KEYS_PIPELINE too)
+    '''
+    keys = doc.get('keys', doc.keys())
+    found = [key for key in keys if key not in COLUMNAR_FIELDS]
+    if doc.get('mask') is not None:
+        found.extend(stored_hours(doc))
+    return found
+
+
+def decode(doc: dict) -> tuple:
+    '''
+    Reads a week doc in either layout
+
+    returns (types, values, mask):
+        types: list of generation types
+        values: float array, one row per hour of the week, one column per type
+        mask: bool array of which hours exist
+    '''
+    start = week_start(doc['_id'])
+    columns = dict()
+    mask = np.zeros(HOURS_PER_DOC, dtype=bool)
+    if is_columnar(doc):
+        mask = decode_mask(doc['mask'])
+        for meta, blob in doc['columns'].items():
+            columns[meta] = np.frombuffer(blob, dtype=DTYPE).copy()
+    for key, items in doc.items():
+        if key in COLUMNAR_FIELDS:
+            continue
+        slot = hour_slot(key, start)
+        if not 0 <= slot < HOURS_PER_DOC:
+            continue
+        mask[slot] = True
+        # a legacy hour replaces the whole hour
+        for column in columns.values():
+            column[slot] = np.nan
+        for item in items:
+            column = columns.get(item['type'])
+            if column is None:
+                column = columns[item['type']] = np.full(HOURS_PER_DOC, np.nan)
+            column[slot] = item['value']
+    types = list(columns)
+    if types:
+        values = np.column_stack([columns[meta] for meta in types])
+    else:
+        values = np.empty((HOURS_PER_DOC, 0))
+    return types, values, mask
+
+
+def encode(doc: dict) -> dict:
+    '''
+    Converts a week doc (either layout) to the columnar layout
+    '''
+    types, values, mask = decode(doc)
+    return {
+        '_id': doc['_id'],
+        'schema': SCHEMA,
+        'hours': int(mask.sum()),
+        'mask': Binary(np.packbits(mask).tobytes()),
+        'columns': {
+            meta: Binary(np.ascontiguousarray(values[:, i], dtype=DTYPE).tobytes())
+            for i, meta in enumerate(types)
+        }
+    }
+
+
+def doc_types(doc: dict) -> list:
+    '''
+    Generation types found in a week doc
+    '''
+    types = list(doc['columns']) if is_columnar(doc) else []
+    for key, items in doc.items():
+        if key in COLUMNAR_FIELDS:
+            continue
+        for item in items:
+            if item['type'] not in types:
+                types.append(item['type'])
+    return types
+
+
+def read_frame(docs, energy=None) -> 'pd.DataFrame':
+    '''
+    Turns week docs (either layout) into a frame of 'ds' + one column per type
+
+    energy fixes the type columns and their order, other types are
+    dropped. Otherwise every type found is used.
+    Only hours that exist are included, like the old readers did
+    '''
+    import pandas as pd
+    blocks = []
+    for doc in docs:
+        types, values, mask = decode(doc)
+        if not mask.any():
+            continue
+        start = np.datetime64(week_start(doc['_id']), 'h')
+        blocks.append((start + np.flatnonzero(mask), types, values[mask]))
+    if energy is None:
+        energy = []
+        for _, types, _ in blocks:
+            energy.extend(meta for meta in types if meta not in energy)
+    if not blocks:
+        return pd.DataFrame(columns=['ds'] + list(energy))
+    hours = sum(len(block[0]) for block in blocks)
+    table = np.full((hours, len(energy)), np.nan)
+    row = 0
+    positions = {meta: i for i, meta in enumerate(energy)}
+    for ds, types, values in blocks:
+        for i, meta in enumerate(types):
+            if meta in positions:
+                table[row:row + len(ds), positions[meta]] = values[:, i]
+        row += len(ds)
+    data = pd.DataFrame(table, columns=list(energy))
+    data.insert(0, 'ds', pd.to_datetime(np.concatenate([block[0] for block in blocks])))
+    return data
+
+
+def migrate_collection(collection, batch_size=100, before=None, dry_run=False) -> dict:
+    '''
+    Streams every doc of a collection and rewrites it in the columnar layout
+
+    before: only weeks starting before this datetime are migrated
+            (defaults to the current week, which still gets hourly writes)
+
+    A doc that changed since it was read (different number of fields)
+    is left alone and picked up on the next run
+
+    returns counts and BSON sizes before/after
+    '''
+    if before is None:
+        before = datetime.datetime.now() - datetime.timedelta(days=7)
+    stats = {'migrated': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+    requests = []
+    cursor = collection.find({}, batch_size=batch_size)
+    for doc in cursor:
+        legacy_keys = [key for key in doc if key not in COLUMNAR_FIELDS]
+        if (is_columnar(doc) and not legacy_keys) or week_start(doc['_id']) >= before:
+            stats['skipped'] += 1
+            continue
+        columnar = encode(doc)
+        stats['migrated'] += 1
+        stats['bytes_before'] += len(bson.encode(doc))
+        stats['bytes_after'] += len(bson.encode(columnar))
+        guard = {
+            '_id': doc['_id'],
+            '$expr': {'$eq': [{'$size': {'$objectToArray': '$$ROOT'}}, len(doc)]}
+        }
+        requests.append(ReplaceOne(guard, columnar))
+        if len(requests) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(requests, ordered=False)
+            requests = []
+    if requests and not dry_run:
+        collection.bulk_write(requests, ordered=False)
+    return stats
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python -m database.columnar <country> [Historic|Forecast] [--dry-run]")
+        return
+    from database.storage import get_storage, MongoStorage
+    storage = get_storage()
+    if not isinstance(storage, MongoStorage):
+        print("Columnar docs are only used with the mongo backend")
+        return
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    dry_run = '--dry-run' in sys.argv
+    collections = args[1:] or ['Historic', 'Forecast']
+    for collection in collections:
+        print('Migrating', args[0], collection, '(dry run)' if dry_run else '')
+        stats = migrate_collection(storage.collection(args[0], collection), dry_run=dry_run)
+        print('\t', stats)
+        if stats['bytes_after']:
+            print('\t', round(stats['bytes_before'] / stats['bytes_after'], 1), 'x smaller')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+'''
+One MongoClient per process, created the first time it's needed
+
+Importing modules that talk to the DB used to open a client (SRV lookup,
+TLS pools) right away, even in processes that never queried anything.
+All pool, timeout and compression settings live here now.
+
+Settings can be overridden in .env:
+    MONGO_SRV                   connection string
+    MONGO_MAX_POOL_SIZE         default 20
+    MONGO_MIN_POOL_SIZE         default 0
+    MONGO_CONNECT_TIMEOUT_MS    default 10000
+    MONGO_SELECTION_TIMEOUT_MS  default 15000
+    MONGO_SOCKET_TIMEOUT_MS     default 120000
+    MONGO_COMPRESSORS           default zlib (snappy/zstd need extra packages)
+
+Measure client creation and the first round trip with:
+    python -m database.connection
+'''
+from dotenv import load_dotenv
+import os
+import threading
+import time
+
+load_dotenv()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_stats = {'created': 0, 'create_seconds': None, 'first_query_seconds': None}
+
+
+def client_options() -> dict:
+    '''
+    Keyword arguments every MongoClient gets
+    '''
+    return {
+        'maxPoolSize': int(os.getenv("MONGO_MAX_POOL_SIZE", 20)),
+        'minPoolSize': int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        'connectTimeoutMS': int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000)),
+        'serverSelectionTimeoutMS': int(os.getenv("MONGO_SELECTION_TIMEOUT_MS", 15000)),
+        'socketTimeoutMS': int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 120000)),
+        'compressors': os.getenv("MONGO_COMPRESSORS", "zlib"),
+        'retryWrites': True,
+        'appname': 'Collect-Forecast-Visualize'
+    }
+
+
+def get_client():
+    '''
+    The MongoClient of this process
+
+    A forked child gets its own, clients aren't safe to share across a fork
+    '''
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            import pymongo
+            started = time.perf_counter()
+            _client = pymongo.MongoClient(os.getenv("MONGO_SRV"), **client_options())
+            _stats['create_seconds'] = time.perf_counter() - started
+            _stats['first_query_seconds'] = None
+            _stats['created'] += 1
+            _client_pid = os.getpid()
+        return _client
+
+
+def ping() -> float:
+    '''
+    Round trip to the server, in seconds
+
+    The first one is recorded since it includes server selection and the handshake
+    '''
+    client = get_client()
+    started = time.perf_counter()
+    client.admin.command('ping')
+    elapsed = time.perf_counter() - started
+    with _client_lock:
+        if _stats['first_query_seconds'] is None:
+            _stats['first_query_seconds'] = elapsed
+    return elapsed
+
+
+def connection_stats() -> dict:
+    '''
+    Clients created by this process, and how long creation and the first query took
+    '''
+    with _client_lock:
+        return dict(_stats)
+
+
+def close():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def main():
+    started = time.perf_counter()
+    import pymongo
+    print('import pymongo:', round(time.perf_counter() - started, 4), 's')
+    get_client()
+    print('create client:', round(connection_stats()['create_seconds'], 4), 's')
+    print('first query:', round(ping(), 4), 's')
+    print('second query:', round(ping(), 4), 's')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+'''
+Layout constants of the weekly Historic/Forecast docs
+
+A week doc holds one key per hour ('HH-DD/MM/YYYY') plus its '_id',
+so a complete week has 168 hour keys
+'''
+# doc string format for mongodb
+DOC_FORMAT = "%d/%m/%Y"
+
+# 24 * 7 hour keys in a full week doc (excludes ID)
+HOURS_PER_DOC = 24 * 7
+
+# fields that aren't hour keys ('_id' and the columnar layout, see database.columnar)
+COLUMNAR_FIELDS = ['_id', 'schema', 'hours', 'mask', 'columns']
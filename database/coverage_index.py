@@ -0,0 +1,207 @@
+'''
+Persistent per-country index of which hours are in the Historic collection
+
+Bit n of the bitmap is the hour n hours after doc_start_time in the
+country's local time, the same clock the 'HH-DD/MM/YYYY' keys use.
+The uploader marks hours as it writes them, so check_db and backfills
+can ask what's missing without reading any week docs
+'''
+from forecast.utils import doc_start_time
+import numpy as np
+import datetime
+import threading
+import os
+
+# pulls only the keys of every doc (and the mask of columnar docs), never the values
+KEYS_PIPELINE = [
+    {
+        '$project': {
+            'keys': {
+                '$map': {
+                    'input': {'$objectToArray': '$$ROOT'},
+                    'in': '$$this.k'
+                }
+            },
+            'mask': 1
+        }
+    }
+]
+
+
+def key_to_hour(key: str) -> int:
+    '''
+    'HH-DD/MM/YYYY' -> hours since doc_start_time
+    '''
+    hour, date = key.split('-')
+    day, month, year = date.split('/')
+    day_start = datetime.datetime(int(year), int(month), int(day))
+    return (day_start - doc_start_time).days * 24 + int(hour)
+
+
+def parse_hour_keys(keys) -> np.ndarray:
+    '''
+    key_to_hour for a whole list of keys at once, as an int64 array
+
+    Falls back to key_to_hour if any key isn't exactly 'HH-DD/MM/YYYY'
+    '''
+    keys = list(keys)
+    if not keys:
+        return np.zeros(0, dtype=np.int64)
+    try:
+        raw = np.array(keys, dtype='S13')
+    except UnicodeEncodeError:
+        raw = None
+    if raw is None or any(len(key) != 13 for key in keys):
+        return np.array([key_to_hour(key) for key in keys], dtype=np.int64)
+    digits = raw.view(np.uint8).reshape(-1, 13).astype(np.int64) - ord('0')
+    hour = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 3] * 10 + digits[:, 4]
+    month = digits[:, 6] * 10 + digits[:, 7]
+    year = digits[:, 9] * 1000 + digits[:, 10] * 100 + digits[:, 11] * 10 + digits[:, 12]
+    months = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1).astype('timedelta64[M]')
+    days = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    start = np.datetime64(doc_start_time, 'D')
+    return (days - start).astype(np.int64) * 24 + hour
+
+
+def hour_to_datetime(hour: int) -> datetime.datetime:
+    '''
+    hours since doc_start_time -> naive local datetime
+    '''
+    return doc_start_time + datetime.timedelta(hours=int(hour))
+
+
+def datetime_to_hour(date: datetime.datetime) -> int:
+    '''
+    naive local datetime -> hours since doc_start_time (rounded down)
+    '''
+    date = date.replace(tzinfo=None)
+    return int((date - doc_start_time).total_seconds() // 3600)
+
+
+class CoverageIndex:
+    '''
+    Bitmap of the hours one country has in the DB
+
+    Kept in memory as a bool array and saved packed to 1 bit per hour,
+    so ten years of hours is roughly 11KB on disk
+    '''
+
+    def __init__(self, name: str, path=None):
+        self.name = name
+        self.path = path
+        self.__bits = np.zeros(0, dtype=bool)
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls, name: str, path: str):
+        '''
+        Loads the index saved at path, or an empty one if there isn't any
+        '''
+        index = cls(name, path)
+        if os.path.isfile(path):
+            with np.load(path) as saved:
+                index.__set_bits(saved['bits'], int(saved['hours']))
+        return index
+
+    def save(self, path=None):
+        '''
+        Saves the packed bitmap to path (defaults to the path it loaded from)
+        '''
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.__lock:
+            packed = np.packbits(self.__bits)
+            hours = len(self.__bits)
+        # write then swap so a crash never leaves half a file behind
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, bits=packed, hours=hours)
+        os.replace(tmp_path, path)
+
+    def rebuild_from_keys(self, keys):
+        '''
+        Rebuilds the bitmap from every stored 'HH-DD/MM/YYYY' key
+        (see StorageBackend.hour_keys)
+        '''
+        hours = [key_to_hour(key) for key in keys]
+        with self.__lock:
+            self.__bits = np.zeros(0, dtype=bool)
+        self.mark_hours(hours)
+
+    def is_empty(self) -> bool:
+        with self.__lock:
+            return not self.__bits.any()
+
+    def mark(self, keys):
+        '''
+        Marks 'HH-DD/MM/YYYY' keys as present
+        '''
+        self.mark_hours([key_to_hour(key) for key in keys])
+
+    def mark_hours(self, hours):
+        '''
+        Marks hours since doc_start_time as present
+        '''
+        hours = np.asarray(hours, dtype=np.int64)
+        hours = hours[hours >= 0]
+        if not len(hours):
+            return
+        with self.__lock:
+            self.__grow(int(hours.max()) + 1)
+            self.__bits[hours] = True
+
+    def has(self, key: str) -> bool:
+        hour = key_to_hour(key)
+        with self.__lock:
+            return 0 <= hour < len(self.__bits) and bool(self.__bits[hour])
+
+    def missing_hours(
+            self,
+            start: datetime.datetime,
+            end: datetime.datetime) -> np.ndarray:
+        '''
+        Hours since doc_start_time that are missing in [start, end)
+        '''
+        first = max(datetime_to_hour(start), 0)
+        last = max(datetime_to_hour(end), first)
+        with self.__lock:
+            window = np.zeros(last - first, dtype=bool)
+            known = self.__bits[first:last]
+            window[:len(known)] = known
+        return np.flatnonzero(~window) + first
+
+    def missing_ranges(
+            self,
+            start: datetime.datetime,
+            end: datetime.datetime) -> list:
+        '''
+        Missing hours in [start, end) merged into contiguous gaps
+
+        returns [(first missing datetime, last missing datetime), ...]
+        '''
+        hours = self.missing_hours(start, end)
+        if not len(hours):
+            return []
+        breaks = np.flatnonzero(np.diff(hours) != 1)
+        firsts = np.concatenate(([hours[0]], hours[breaks + 1]))
+        lasts = np.concatenate((hours[breaks], [hours[-1]]))
+        return [
+            (hour_to_datetime(first), hour_to_datetime(last))
+            for first, last in zip(firsts, lasts)
+        ]
+
+    def __grow(self, hours: int):
+        if hours > len(self.__bits):
+            # grow by at least a year to keep resizes rare
+            size = max(hours, len(self.__bits) + 24 * 365)
+            bits = np.zeros(size, dtype=bool)
+            bits[:len(self.__bits)] = self.__bits
+            self.__bits = bits
+
+    def __set_bits(self, packed, hours: int):
+        bits = np.unpackbits(np.asarray(packed, dtype=np.uint8))[:hours].astype(bool)
+        with self.__lock:
+            self.__bits = bits
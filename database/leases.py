@@ -0,0 +1,357 @@
+'''
+Leases that let several manager nodes share backfills and forecasts
+
+A lease is held on a key ('fill/Nicaragua/2019-08-29', 'forecast/Mexico')
+by one owner (node) until it expires. Holders keep it alive with
+heartbeats (LeaseKeeper renews every ttl / 3), a node that dies simply
+stops renewing and its keys are free again after ttl.
+
+Every acquisition bumps the key's token. A holder that stalled past
+its ttl may have lost the key to a newer token, so results are only
+queued after check() confirms the token is still the current one.
+
+Leases only cut down on duplicate scraping, they don't fence writes:
+the uploads don't carry the token, so whatever a node queued before
+losing the key (still waiting in the upload queue, or replayed from its
+spool after a restart) is written anyway. That's fine for historic
+hours (the first write wins) and forecasts (rewritten by the next run).
+
+LEASE_BACKEND in .env picks where leases live:
+    - none: single node, no leases (default)
+    - mongo: a collection every node can reach
+    - file: a JSON file guarded by a file lock (LEASE_DIR), for nodes on
+      one machine and for tests (flock, or msvcrt's locking on Windows)
+'''
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from database.connection import get_client
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import json
+import os
+import socket
+import threading
+import time
+
+DATABASE = 'Coordination'
+COLLECTION = 'Leases'
+
+Lease = namedtuple('Lease', ['key', 'owner', 'token', 'expires'])
+
+
+def node_id() -> str:
+    '''
+    Owner name of this process, unique across machines
+    '''
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class LeaseBackend(ABC):
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> Lease:
+        '''
+        The lease on key, if it's free or expired (or already owner's), else None
+        '''
+
+    @abstractmethod
+    def renew(self, lease: Lease, ttl: float) -> Lease:
+        '''
+        The lease extended to ttl from now, None if it was lost
+        '''
+
+    @abstractmethod
+    def release(self, lease: Lease, linger=0.0):
+        '''
+        Frees the key, or keeps others off it for linger more seconds
+        '''
+
+    @abstractmethod
+    def current(self, key: str) -> Lease:
+        '''
+        Who holds key right now, None if nobody
+        '''
+
+    def check(self, lease: Lease) -> bool:
+        '''
+        True if lease is still the live one on its key (same token)
+        '''
+        current = self.current(lease.key)
+        return current is not None and current.owner == lease.owner and current.token == lease.token
+
+
+def _lock_file(file):
+    '''
+    Blocks until this process holds the exclusive lock of an open file
+    '''
+    if os.name == 'nt':
+        import msvcrt
+        file.seek(0)
+        while True:
+            try:
+                # gives up after 10 seconds, keep waiting like flock does
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+    else:
+        import fcntl
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+
+def _unlock_file(file):
+    if os.name == 'nt':
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class FileLeaseBackend(LeaseBackend):
+    '''
+    Leases in one JSON file, every change made under an exclusive file lock
+    '''
+
+    def __init__(self, directory: str, clock=time.time):
+        super().__init__(clock)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'leases.json')
+        self.__lock_path = os.path.join(directory, 'leases.lock')
+        # the file lock is per open file, threads of this process take turns first
+        self.__thread_lock = threading.Lock()
+
+    def acquire(self, key, owner, ttl):
+        with self.__locked() as leases:
+            now = self.clock()
+            record = leases.get(key)
+            if record and record['owner'] != owner and record['expires'] > now:
+                return None
+            token = (record['token'] if record else 0) + 1
+            leases[key] = {'owner': owner, 'token': token, 'expires': now + ttl}
+            return Lease(key, owner, token, now + ttl)
+
+    def renew(self, lease, ttl):
+        with self.__locked() as leases:
+            now = self.clock()
+            record = leases.get(lease.key)
+            if not self.__holds(record, lease, now):
+                return None
+            record['expires'] = now + ttl
+            return lease._replace(expires=now + ttl)
+
+    def release(self, lease, linger=0.0):
+        with self.__locked() as leases:
+            record = leases.get(lease.key)
+            if self.__holds(record, lease, self.clock()):
+                record['expires'] = self.clock() + linger
+
+    def current(self, key):
+        with self.__locked(write=False) as leases:
+            record = leases.get(key)
+            if not record or record['expires'] <= self.clock():
+                return None
+            return Lease(key, record['owner'], record['token'], record['expires'])
+
+    @staticmethod
+    def __holds(record, lease, now) -> bool:
+        return (record is not None and record['owner'] == lease.owner
+                and record['token'] == lease.token and record['expires'] > now)
+
+    @contextmanager
+    def __locked(self, write=True):
+        '''
+        The leases {key: record}, saved back on the way out if write
+        '''
+        with self.__thread_lock, open(self.__lock_path, 'a') as lock:
+            _lock_file(lock)
+            try:
+                leases = dict()
+                if os.path.isfile(self.path):
+                    with open(self.path) as file:
+                        leases = json.load(file)
+                yield leases
+                if write:
+                    temp = self.path + '.tmp'
+                    with open(temp, 'w') as file:
+                        json.dump(leases, file)
+                    os.replace(temp, self.path)
+            finally:
+                _unlock_file(lock)
+
+
+class MongoLeaseBackend(LeaseBackend):
+    '''
+    One doc per key: {'_id': key, 'owner', 'token', 'expires'}
+    '''
+
+    def __init__(self, client=None, clock=time.time):
+        super().__init__(clock)
+        self.__client = client
+
+    @property
+    def collection(self):
+        return (self.__client or get_client())[DATABASE][COLLECTION]
+
+    def acquire(self, key, owner, ttl):
+        now = self.clock()
+        try:
+            doc = self.collection.find_one_and_update(
+                {'_id': key, '$or': [{'expires': {'$lte': now}}, {'owner': owner}]},
+                {'$set': {'owner': owner, 'expires': now + ttl}, '$inc': {'token': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # someone else holds it, the upsert tried to create a second doc
+            return None
+        return Lease(key, owner, doc['token'], doc['expires'])
+
+    def renew(self, lease, ttl):
+        now = self.clock()
+        result = self.collection.update_one(
+            {'_id': lease.key, 'owner': lease.owner, 'token': lease.token, 'expires': {'$gt': now}},
+            {'$set': {'expires': now + ttl}})
+        return lease._replace(expires=now + ttl) if result.modified_count else None
+
+    def release(self, lease, linger=0.0):
+        self.collection.update_one(
+            {'_id': lease.key, 'owner': lease.owner, 'token': lease.token},
+            {'$set': {'expires': self.clock() + linger}})
+
+    def current(self, key):
+        doc = self.collection.find_one({'_id': key, 'expires': {'$gt': self.clock()}})
+        if doc is None:
+            return None
+        return Lease(key, doc['owner'], doc['token'], doc['expires'])
+
+
+class LeaseKeeper:
+    '''
+    Acquires groups of keys for this node and heartbeats them until released
+
+    A lease that fails to renew is dropped, valid() then turns False
+    for every group it was part of
+    '''
+
+    def __init__(self, backend: LeaseBackend, owner=None, ttl=60.0):
+        self.backend = backend
+        self.owner = owner or node_id()
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        # key -> Lease for every lease being renewed
+        self.__held = dict()
+        self.__stopping = threading.Event()
+        self.__thread = None
+
+    def acquire(self, keys, ttl=None, heartbeat=True) -> list:
+        '''
+        Leases on every key or on none of them
+
+        returns the leases, or None if any key is taken
+        '''
+        ttl = ttl or self.ttl
+        leases = []
+        for key in keys:
+            lease = self.backend.acquire(key, self.owner, ttl)
+            if lease is None:
+                for taken in leases:
+                    self.backend.release(taken)
+                return None
+            leases.append(lease)
+        if heartbeat:
+            with self.__lock:
+                self.__held.update((lease.key, lease) for lease in leases)
+            self.__start()
+        return leases
+
+    def valid(self, leases: list) -> bool:
+        '''
+        True if this node still holds every lease (checked against the backend)
+        '''
+        with self.__lock:
+            held = [self.__held.get(lease.key, lease) for lease in leases]
+        return all(self.backend.check(lease) for lease in held)
+
+    def release(self, leases: list, linger=0.0):
+        with self.__lock:
+            for lease in leases:
+                self.__held.pop(lease.key, None)
+        for lease in leases:
+            self.backend.release(lease, linger)
+
+    def held(self) -> list:
+        with self.__lock:
+            return sorted(self.__held)
+
+    def stop(self):
+        self.__stopping.set()
+        with self.__lock:
+            leases = list(self.__held.values())
+            self.__held.clear()
+        for lease in leases:
+            self.backend.release(lease)
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__heartbeat, name='leases', daemon=True)
+        self.__thread.start()
+
+    def __heartbeat(self):
+        while not self.__stopping.wait(self.ttl / 3):
+            with self.__lock:
+                leases = list(self.__held.values())
+            for lease in leases:
+                try:
+                    renewed = self.backend.renew(lease, self.ttl)
+                except Exception as e:
+                    print("Lease heartbeat failed:", e)
+                    continue
+                with self.__lock:
+                    if lease.key not in self.__held:
+                        continue
+                    if renewed is None:
+                        print("Lost lease on", lease.key)
+                        self.__held.pop(lease.key)
+                    else:
+                        self.__held[lease.key] = renewed
+
+
+def run_leased(keeper: LeaseKeeper, key: str, ttl: float, function):
+    '''
+    function() if this node gets key, None if another node has it
+
+    The lease isn't released, it runs out after ttl: with ttl about the
+    job's period, one node runs it per period. The result is dropped if
+    the lease was lost while running
+    '''
+    leases = keeper.acquire([key], ttl=ttl, heartbeat=False)
+    if leases is None:
+        print(key, "is leased by another node, skipping")
+        return None
+    result = function()
+    if not keeper.valid(leases):
+        print("Lost lease on", key, "while running, dropping the result")
+        return None
+    return result
+
+
+def get_lease_keeper(ttl=60.0) -> LeaseKeeper:
+    '''
+    A LeaseKeeper on LEASE_BACKEND, None when running as a single node
+    '''
+    backend = os.getenv("LEASE_BACKEND", "none").lower()
+    if backend == "none":
+        return None
+    if backend == "mongo":
+        return LeaseKeeper(MongoLeaseBackend(), ttl=ttl)
+    if backend == "file":
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leases')
+        return LeaseKeeper(FileLeaseBackend(os.getenv("LEASE_DIR", default_dir)), ttl=ttl)
+    raise ValueError("Unknown LEASE_BACKEND: %s" % backend)
@@ -0,0 +1,327 @@
+'''
+Storage backends for the weekly Historic/Forecast docs
+
+Everything that reads or writes week docs goes through a StorageBackend:
+    - MongoStorage: the Atlas cluster at MONGO_SRV (default)
+    - SQLiteStorage: an embedded local file, no network needed
+
+Pick one with STORAGE_BACKEND=mongo|sqlite in .env
+(SQLITE_PATH sets the file for sqlite)
+'''
+from abc import ABC, abstractmethod
+from forecast.utils import doc_start_time
+from forecast.timekeys import get_doc
+from database.coverage import DOC_FORMAT
+from database.coverage_index import KEYS_PIPELINE
+from database.columnar import hour_keys
+from database.connection import get_client
+from pymongo import UpdateOne
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+
+def group_by_doc(marked_entries) -> dict:
+    '''
+    Groups marked entries by their doc ID
+
+    returns {doc_id: {entry: value, ...}, ...}
+    '''
+    docs = dict()
+    for marked in marked_entries:
+        doc_id = marked['_id']
+        fields = docs.setdefault(doc_id, dict())
+        for key in marked:
+            if key != '_id':
+                fields[key] = marked[key]
+    return docs
+
+
+def bulk_requests(docs: dict) -> list:
+    '''
+    One UpdateOne upsert per week doc of group_by_doc's output,
+    setting every hour it holds
+
+    Hours that shouldn't be overwritten are taken out first (drop_stored)
+    '''
+    return [
+        UpdateOne({'_id': doc_id}, {'$set': fields}, upsert=True)
+        for doc_id, fields in docs.items()
+    ]
+
+
+def stored_keys_pipeline(docs: dict) -> list:
+    '''
+    KEYS_PIPELINE for just the docs of group_by_doc's output
+    '''
+    return [{'$match': {'_id': {'$in': list(docs)}}}] + KEYS_PIPELINE
+
+
+def drop_stored(docs: dict, stored_docs) -> int:
+    '''
+    Drops the hours the docs already hold from group_by_doc's output
+
+    stored_docs are the docs' keys (and masks) from stored_keys_pipeline.
+    This read is what keeps stored hours, rather than a server side check
+    ($ifNull) on each key: that only sees hour keys, a columnar doc has
+    none, so its hours would be added back as keys that win over the
+    columns. It also gives counts in hours, like the other backends'.
+    A write landing between the read and the bulk write can be replaced
+
+    returns how many hours were dropped
+    '''
+    dropped = 0
+    for doc in stored_docs:
+        fields = docs[doc['_id']]
+        for key in hour_keys(doc):
+            if key in fields:
+                del fields[key]
+                dropped += 1
+        if not fields:
+            del docs[doc['_id']]
+    return dropped
+
+
+def bulk_upsert(db_collection, marked_entries, overwrite=False) -> tuple:
+    '''
+    Entries are grouped by week doc and sent as a single
+    unordered bulk write with one upsert per doc (see bulk_requests)
+
+    Without overwrite the hours already stored are looked up first (key
+    names only) and left out
+
+    returns (written hours, skipped hours)
+    '''
+    docs = group_by_doc(marked_entries)
+    if not docs:
+        return (0, 0)
+    print("Checking", len(marked_entries), "entries in", len(docs), "docs for upload...")
+    skipped = 0
+    if not overwrite:
+        skipped = drop_stored(docs, db_collection.aggregate(stored_keys_pipeline(docs)))
+    if docs:
+        db_collection.bulk_write(bulk_requests(docs), ordered=False)
+    return bulk_result(docs, skipped)
+
+
+def bulk_result(docs: dict, skipped: int) -> tuple:
+    written = sum(len(fields) for fields in docs.values())
+    print("Wrote", written, "hours, skipped", skipped, "hours already stored")
+    return (written, skipped)
+
+
+def week_ids(start: datetime.datetime, end: datetime.datetime) -> list:
+    '''
+    IDs of every week doc from the one holding start to the one holding end
+    '''
+    first = datetime.datetime.strptime(get_doc(start), DOC_FORMAT)
+    last = datetime.datetime.strptime(get_doc(end), DOC_FORMAT)
+    ids = []
+    while first <= last:
+        ids.append(first.strftime(DOC_FORMAT))
+        first += datetime.timedelta(days=7)
+    return ids
+
+
+class StorageBackend(ABC):
+    '''
+    Interface for where the week docs live
+
+    A week doc is {'_id': 'DD/MM/YYYY', 'HH-DD/MM/YYYY': [{'value', 'type'}, ...], ...}
+    and lives in a (country, collection) pair, e.g. ('El_Salvador', 'Historic')
+    '''
+
+    @abstractmethod
+    def upsert(self, country: str, collection: str, marked_entries: list, overwrite=False) -> tuple:
+        '''
+        Writes [{'_id': doc_id, hour_key: value}, ...] into their week docs
+
+        overwrite replaces hours that already exist, otherwise they're kept
+
+        returns (written hours, skipped hours)
+        '''
+        pass
+
+    @abstractmethod
+    def find_docs(self, country: str, collection: str, query=None):
+        '''
+        Iterates over week docs
+
+        query is a filter on '_id' only:
+            None/{}, {'_id': doc_id} or {'_id': {'$in': [doc_id, ...]}}
+        '''
+        pass
+
+    @abstractmethod
+    def hour_keys(self, country: str, collection: str):
+        '''
+        Iterates over every hour key that's stored, without values
+        '''
+        pass
+
+    def read_range(self, country: str, collection: str, start: datetime.datetime, end: datetime.datetime):
+        '''
+        Iterates over the week docs covering start to end
+        '''
+        return self.find_docs(country, collection, {'_id': {'$in': week_ids(start, end)}})
+
+    def insert_doc(self, country: str, collection: str, doc: dict) -> tuple:
+        '''
+        Adds a whole week doc, keeping any hours that already exist
+        '''
+        doc_id = doc['_id']
+        return self.upsert(
+            country, collection,
+            [{'_id': doc_id, key: doc[key]} for key in doc if key != '_id'])
+
+
+class MongoStorage(StorageBackend):
+    '''
+    Week docs in MongoDB: a database per country, a collection per kind
+
+    Without a client, the shared one from database.connection is
+    created on first use
+    '''
+
+    def __init__(self, client=None):
+        self.__client = client
+
+    @property
+    def client(self):
+        if self.__client is None:
+            self.__client = get_client()
+        return self.__client
+
+    def collection(self, country: str, collection: str):
+        return self.client.get_database(country)[collection]
+
+    def upsert(self, country, collection, marked_entries, overwrite=False) -> tuple:
+        return bulk_upsert(self.collection(country, collection), marked_entries, overwrite)
+
+    def find_docs(self, country, collection, query=None):
+        return self.collection(country, collection).find(query or {})
+
+    def hour_keys(self, country, collection):
+        for doc in self.collection(country, collection).aggregate(KEYS_PIPELINE):
+            for key in hour_keys(doc):
+                yield key
+
+
+class SQLiteStorage(StorageBackend):
+    '''
+    Week docs in a local SQLite file, one row per hour
+
+    Rows keep their week doc ID so docs can be put back together,
+    and the primary key on the hour makes first/last writer wins
+    a plain INSERT OR IGNORE / upsert
+    '''
+
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS hours (
+            country TEXT NOT NULL,
+            collection TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            week INTEGER NOT NULL,
+            hour_key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (country, collection, hour_key)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS hours_doc ON hours (country, collection, doc_id)'
+    ]
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        with self.__connection:
+            for statement in self.SCHEMA:
+                self.__connection.execute(statement)
+
+    def upsert(self, country, collection, marked_entries, overwrite=False) -> tuple:
+        rows = [
+            (country, collection, doc_id, self.__week(doc_id), key, json.dumps(value, default=float))
+            for doc_id, fields in group_by_doc(marked_entries).items()
+            for key, value in fields.items()
+        ]
+        if overwrite:
+            statement = (
+                'INSERT INTO hours VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (country, collection, hour_key) DO UPDATE SET value = excluded.value')
+        else:
+            statement = 'INSERT OR IGNORE INTO hours VALUES (?, ?, ?, ?, ?, ?)'
+        with self.__lock, self.__connection:
+            written = self.__connection.executemany(statement, rows).rowcount
+        return (written, len(rows) - written)
+
+    def find_docs(self, country, collection, query=None):
+        statement = 'SELECT doc_id, hour_key, value FROM hours WHERE country = ? AND collection = ?'
+        params = [country, collection]
+        doc_ids = (query or {}).get('_id')
+        if isinstance(doc_ids, dict):
+            doc_ids = list(doc_ids['$in'])
+        elif doc_ids is not None:
+            doc_ids = [doc_ids]
+        if doc_ids is not None:
+            if not doc_ids:
+                return
+            statement += ' AND doc_id IN (%s)' % ', '.join('?' * len(doc_ids))
+            params.extend(doc_ids)
+        statement += ' ORDER BY week, hour_key'
+        with self.__lock:
+            rows = self.__connection.execute(statement, params).fetchall()
+        doc = None
+        for doc_id, key, value in rows:
+            if not doc or doc['_id'] != doc_id:
+                if doc:
+                    yield doc
+                doc = {'_id': doc_id}
+            doc[key] = json.loads(value)
+        if doc:
+            yield doc
+
+    def hour_keys(self, country, collection):
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT hour_key FROM hours WHERE country = ? AND collection = ?',
+                (country, collection)).fetchall()
+        for row in rows:
+            yield row[0]
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def __week(self, doc_id: str) -> int:
+        return (datetime.datetime.strptime(doc_id, DOC_FORMAT) - doc_start_time).days // 7
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    '''
+    The storage backend for this process, created on first use
+
+    Doesn't connect to anything until the first read or write
+    '''
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            backend = os.getenv("STORAGE_BACKEND", "mongo").lower()
+            if backend == "sqlite":
+                default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local.sqlite3')
+                _storage = SQLiteStorage(os.getenv("SQLITE_PATH", default_path))
+            elif backend == "mongo":
+                _storage = MongoStorage()
+            else:
+                raise ValueError("Unknown STORAGE_BACKEND: %s" % backend)
+        return _storage
@@ -0,0 +1,207 @@
+'''
+Historic data in a MongoDB time series collection
+
+One measurement per (country, type, hour):
+    {'ts': <UTC hour>, 'meta': {'country': ..., 'type': ...}, 'value': x}
+
+The server takes care of bucketing, compression and range scans, so
+there's no week doc or 169 key heuristic involved.
+
+HISTORIC_MODE in .env picks how Historic data is stored:
+    - weekly: week docs only (default)
+    - dual: writes go to both, reads come from the week docs
+    - timeseries: writes and reads only use the time series
+
+Copy existing week docs over (to start a dual write period) with:
+    python -m database.timeseries <country>
+'''
+from forecast.utils import COUNTRY_TZ
+from forecast.timekeys import localize, epoch_keys, epoch_datetime
+from database.columnar import decode, week_start
+import numpy as np
+import datetime
+import os
+import pytz
+import sys
+import threading
+
+HISTORIC_MODE = os.getenv("HISTORIC_MODE", "weekly").lower()
+
+DATABASE = 'Timeseries'
+COLLECTION = 'Historic'
+
+
+def local_to_utc(key: str, tz: str) -> datetime.datetime:
+    '''
+    'HH-DD/MM/YYYY' in the country's local time -> naive UTC datetime
+
+    Ambiguous hours are resolved like the other keys (timekeys.localize)
+    '''
+    local = datetime.datetime.strptime(key, "%H-%d/%m/%Y")
+    return localize(local, tz).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def to_measurements(country: str, entries: dict) -> list:
+    '''
+    {hour key or epoch hour: [{'value', 'type'}, ...]} -> one measurement per type and hour
+    '''
+    measurements = []
+    for hour, items in epoch_keys(entries, COUNTRY_TZ[country]).items():
+        ts = epoch_datetime(hour).replace(tzinfo=None)
+        for item in items:
+            measurements.append({
+                'ts': ts,
+                'meta': {'country': country, 'type': item['type']},
+                'value': float(item['value'])
+            })
+    return measurements
+
+
+def measurements_to_frame(rows, country: str, energy=None) -> 'pd.DataFrame':
+    '''
+    [{'ts', 'type', 'value'}, ...] -> frame of 'ds' (local, naive) + one column per type
+    '''
+    import pandas as pd
+    frame = pd.DataFrame(list(rows), columns=['ts', 'type', 'value'])
+    if frame.empty:
+        return pd.DataFrame(columns=['ds'] + list(energy or []))
+    frame = frame.pivot_table(index='ts', columns='type', values='value', aggfunc='first')
+    if energy is not None:
+        frame = frame.reindex(columns=list(energy))
+    local = pd.DatetimeIndex(frame.index).tz_localize('UTC').tz_convert(COUNTRY_TZ[country])
+    frame.index = local.tz_localize(None)
+    frame.columns.name = None
+    return frame.rename_axis('ds').reset_index()
+
+
+class TimeseriesHistoric:
+    '''
+    Historic data of every country in one time series collection
+    '''
+
+    def __init__(self, client, database=DATABASE, collection=COLLECTION):
+        self.db = client.get_database(database)
+        self.name = collection
+        self.collection = self.db[collection]
+        self.__ensured = False
+
+    def ensure_collection(self):
+        '''
+        Creates the time series collection if it isn't there (MongoDB 5.0+)
+        '''
+        if self.__ensured:
+            return
+        if self.name not in self.db.list_collection_names(filter={'name': self.name}):
+            self.db.create_collection(
+                self.name,
+                timeseries={'timeField': 'ts', 'metaField': 'meta', 'granularity': 'hours'})
+        self.__ensured = True
+
+    def insert(self, country: str, entries: dict) -> int:
+        '''
+        Writes hourly entries as measurements
+
+        Time series collections can't upsert, so only pass hours that
+        aren't stored yet (the reader keeps the first one if they are)
+
+        returns the number of measurements written
+        '''
+        measurements = to_measurements(country, entries)
+        if not measurements:
+            return 0
+        self.ensure_collection()
+        self.collection.insert_many(measurements, ordered=False)
+        return len(measurements)
+
+    def read_frame(self, country: str, start: datetime.datetime, end: datetime.datetime, energy=None) -> 'pd.DataFrame':
+        '''
+        Hourly frame for country from start to end (naive local times, inclusive)
+        '''
+        tz = COUNTRY_TZ[country]
+        pipeline = [
+            {
+                '$match': {
+                    'meta.country': country,
+                    'ts': {
+                        '$gte': localize(start, tz).astimezone(pytz.utc).replace(tzinfo=None),
+                        '$lte': localize(end, tz).astimezone(pytz.utc).replace(tzinfo=None)
+                    }
+                }
+            },
+            # one value per hour and type, duplicates are dropped server side
+            {
+                '$group': {
+                    '_id': {'ts': '$ts', 'type': '$meta.type'},
+                    'value': {'$first': '$value'}
+                }
+            },
+            {'$project': {'_id': 0, 'ts': '$_id.ts', 'type': '$_id.type', 'value': 1}},
+            {'$sort': {'ts': 1}}
+        ]
+        return measurements_to_frame(self.collection.aggregate(pipeline), country, energy)
+
+    def hour_keys(self, country: str):
+        '''
+        Every stored hour of country as local 'HH-DD/MM/YYYY' keys
+        '''
+        pipeline = [
+            {'$match': {'meta.country': country}},
+            {'$group': {'_id': '$ts'}}
+        ]
+        tz = pytz.timezone(COUNTRY_TZ[country])
+        for doc in self.collection.aggregate(pipeline):
+            yield pytz.utc.localize(doc['_id']).astimezone(tz).strftime("%H-%d/%m/%Y")
+
+    def copy_week_docs(self, country: str, docs) -> int:
+        '''
+        Copies week docs (either layout) into the time series
+
+        returns the number of measurements written
+        '''
+        written = 0
+        for doc in docs:
+            types, values, mask = decode(doc)
+            start = week_start(doc['_id'])
+            entries = dict()
+            for slot in np.flatnonzero(mask):
+                key = (start + datetime.timedelta(hours=int(slot))).strftime("%H-%d/%m/%Y")
+                entries[key] = [
+                    {'value': values[slot, i], 'type': meta}
+                    for i, meta in enumerate(types)
+                    if not np.isnan(values[slot, i])
+                ]
+            written += self.insert(country, entries)
+        return written
+
+
+_timeseries = None
+_timeseries_lock = threading.Lock()
+
+
+def get_timeseries() -> TimeseriesHistoric:
+    '''
+    The time series store for this process (needs the mongo storage backend)
+    '''
+    global _timeseries
+    from database.storage import get_storage, MongoStorage
+    with _timeseries_lock:
+        if _timeseries is None:
+            storage = get_storage()
+            if not isinstance(storage, MongoStorage):
+                raise RuntimeError("Time series collections need STORAGE_BACKEND=mongo")
+            _timeseries = TimeseriesHistoric(storage.client)
+        return _timeseries
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python -m database.timeseries <country>")
+        return
+    from database.storage import get_storage
+    country = sys.argv[1]
+    written = get_timeseries().copy_week_docs(country, get_storage().find_docs(country, 'Historic'))
+    print('Copied', written, 'measurements for', country)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,22 @@ from numpy.core.numeric import False_, full
 import pandas as pd
 from pandas.core.frame import DataFrame
 import pymongo
-import matplotlib.pyplot as plt
 from datetime import datetime
 from datetime import timedelta
-from fbprophet import Prophet
 from pymongo.common import TIMEOUT_OPTIONS
-import arrow
 import subprocess
 import sys
 import time
 import pickle
+import json
 import os
 from dotenv import load_dotenv
+from database.storage import get_storage
+from database.columnar import read_frame, doc_types
+from database.timeseries import HISTORIC_MODE, get_timeseries
+from metrics import forecast_seconds
+from forecast.timekeys import get_doc, epoch_hour
+from forecast.utils import COUNTRY_TZ
 
 load_dotenv()
 
@@ -49,9 +53,8 @@ load_dotenv()
                 -> deactivate env (don't forget this line before exiting)
 '''
 
-doc_start_time = datetime(year=2016, month=12, day=27)
-
 # PYTHON_EXE = "C:\\Users\\Naoki\\anaconda3\\python.exe"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 TIMEOUT = 3000
 
 class Forecast:
@@ -70,8 +73,7 @@ class Forecast:
     * pystan 2.19.1.1 (for fbpprophet)
     * properly installed C++ compiler (for fbprophet)
     '''
-    client = pymongo.MongoClient(os.getenv("MONGO_SRV"))
-    
+
     # TODO replace this dicitonary with one that gets dynamically built
     metas = {'El_Salvador' : ['Biomass','Geothermal','HydroElectric','Interconnection','Thermal','Solar', 'Wind'], #
              'Costa_Rica' : ['Hydroelectric','Interchange','Other','Solar','Thermal','Wind', 'Geothermal'], # 'Geothermal' has been temp removed 
@@ -87,7 +89,7 @@ class Forecast:
                  print_statements=False,
                  test=False):
         '''
-        Initializes mongoDB cursor
+        Initializes the cursor over the storage backend (see database.storage)
 
         Parameters
         ----------
@@ -101,10 +103,11 @@ class Forecast:
         '''
         self.country = db
         self.energy = self.metas[db]
-        self.db = self.client[db]
-        self.col = self.db[col]
+        self.storage = get_storage()
+        self.db = db
+        self.col = col
         self.__frequency = frequency
-        self.cursor = self.col.find(fltr)
+        self.cursor = self.storage.find_docs(db, col, fltr)
         self.test = None
         self.t = test
         if worker:
@@ -112,6 +115,8 @@ class Forecast:
         self.model = {}
         self.results = {}
         self.prediction = {}
+        # seconds the last fit/predict took
+        self.timings = {}
         self.periods = 168
         self.first = None
         self.print_statements = print_statements
@@ -129,9 +134,14 @@ class Forecast:
             * data is in consecutive order
             * data contains no missing values within range
         '''
-        data = []
-
-        if incremental:
+        if self.col == 'Historic' and HISTORIC_MODE == 'timeseries':
+            stop = datetime.now()
+            start = datetime(year=stop.year, month=stop.month, day=stop.day) - timedelta(weeks=105)
+            data = get_timeseries().read_frame(self.country, start, stop)
+            if incremental:
+                self.energy = list(data.columns[1:]) or self.metas[self.country]
+            data = data.reindex(columns=['ds'] + self.energy)
+        elif incremental:
             start = datetime.now()
             start = datetime(year=start.year, month=start.month, day=start.day)
             delta = timedelta(days=7)
@@ -140,46 +150,22 @@ class Forecast:
 
             # preliminary run to build typs first
             self.energy = []
+            docs = []
             for week_index in range(0, 105):
-                tmp_cursor = self.col.find(query(start))
-                for doc in tmp_cursor:
-                    doc.pop('_id')
-                    for key in doc:
-                        for item in doc[key]:
-                            if item['type'] not in self.energy:
-                                self.energy.append(item['type'])
+                for doc in self.storage.find_docs(self.country, self.col, query(start)):
+                    docs.append(doc)
+                    for meta in doc_types(doc):
+                        if meta not in self.energy:
+                            self.energy.append(meta)
                 start = start - delta
             if not self.energy:
                 self.energy = self.metas[self.country]
-            
-            for week_index in range(0, 105):
-                tmp_cursor = self.col.find(query(start))
-                for doc in tmp_cursor:
-                    doc.pop('_id')
-                    for key in doc:
-                        hour = [np.nan for x in range(len(self.energy) + 1)]
-                        dt = datetime.strptime(key, '%H-%d/%m/%Y')
-                        hour[0] = dt
-                        for item in doc[key]:
-                            i = self.energy.index(item['type']) + 1
-                            hour[i] = item['value']
-                        data.append(hour)
-                start = start - delta
+
+            # understands both legacy and columnar docs (see database.columnar)
+            data = read_frame(docs, self.energy)
         else:
-            data = []
-            for doc in self.cursor:
-                doc.pop('_id')
-                for key in doc:
-                    hour = [np.nan for x in range(len(self.energy) + 1)]
-                    dt = datetime.strptime(key, '%H-%d/%m/%Y')
-                    hour[0] = dt
-                    for item in doc[key]:
-                        i = self.energy.index(item['type']) + 1
-                        hour[i] = item['value']
-                    data.append(hour)
-        
-        # reformat data into dataframe
-        data = pd.DataFrame(data, columns = ['ds'] + self.energy)
+            data = read_frame(self.cursor, self.energy)
+
         # drop duplicates
         data = data.drop_duplicates('ds')
         # resample data to fill missing dates
@@ -219,6 +205,9 @@ class Forecast:
         pass
 
     def fit(self):
+        # heavy, only imported once a model is actually fit
+        from fbprophet import Prophet
+        began = time.perf_counter()
         self.model = {}
         for meta in self.energy:
             if self.print_statements:
@@ -229,8 +218,10 @@ class Forecast:
             df = self.data[['ds', meta]].rename(columns={'ds': 'ds', meta: 'y'})
             self.model[meta] = Prophet()
             self.model[meta].fit(df)
+        self.__record_timing('fit', began)
 
     def predict(self, per=168):
+        began = time.perf_counter()
         for meta in self.model:
             if self.print_statements:
                 print("------------------------------")
@@ -245,6 +236,11 @@ class Forecast:
             # replace negatives with zero
             if self.energy.index(meta) != 0:
                 self.prediction[meta].loc[self.prediction[meta]['yhat'] < 0] = 0
+        self.__record_timing('predict', began)
+
+    def __record_timing(self, stage: str, began: float):
+        self.timings[stage] = time.perf_counter() - began
+        forecast_seconds.observe(self.timings[stage], country=self.country, stage=stage)
 
     def get_exported_data(self, worker=False)-> dict:
         """
@@ -266,12 +262,12 @@ class Forecast:
             class_path = os.path.join(class_path, 'forecast')
         file_path = copy.deepcopy(class_path)
         file_path = os.path.join(file_path, self.country + 'prediciton')
-        class_path = os.path.join(class_path, 'forecast.py')
         if worker:
-            command = [sys.executable, class_path, self.country, file_path]
+            # run as a module from the project root so it can import database
+            command = [sys.executable, '-m', 'forecast.forecast', self.country, file_path]
             if self.print_statements:
                 print(command)
-            subprocess.Popen(command)
+            subprocess.Popen(command, cwd=PROJECT_ROOT)
             count = 0
             while not os.path.isfile(file_path):
                 count += 1
@@ -280,6 +276,9 @@ class Forecast:
                 time.sleep(1)
         self.prediction = pickle.load(open(file_path, 'rb'))
         os.remove(file_path)
+        if worker:
+            # the worker's fit/predict times, its own metrics died with it
+            self.__load_worker_timings(file_path + '.timings')
         meta_types = self.metas[self.country]
         full_frame = copy.deepcopy(meta_types)
         full_frame.extend(['ds'])
@@ -305,6 +304,15 @@ class Forecast:
             )
         return output
 
+    def __load_worker_timings(self, path: str):
+        if not os.path.isfile(path):
+            return
+        with open(path) as file:
+            self.timings = json.load(file)
+        os.remove(path)
+        for stage, seconds in self.timings.items():
+            forecast_seconds.observe(seconds, country=self.country, stage=stage)
+
     def __format_helper(self, hour: datetime, values: list) -> dict:
         """
         Simple function that helps format data since it's a little complicated to make out of a lambda
@@ -316,10 +324,10 @@ class Forecast:
             values (list): the rest of the columns values in tuple form (type, value)
 
         Returns:
-            dict: Single entry in the DB format
+            dict: Single entry in the DB format, keyed by its epoch hour
         """ 
         return {
-            hour.strftime("%H-%d/%m/%Y"):[
+            epoch_hour(hour, COUNTRY_TZ[self.country]):[
                 {'value': val[1], 'type': val[0]}
                 for val in values
             ]
@@ -349,6 +357,7 @@ class Forecast:
             If set to True, uses historical data for plots. Otherwise, it
             will default to plotting the predicted data.
         '''
+        import matplotlib.pyplot as plt
         if hist:
             for meta in self.data:
                 self.data[meta].plot()
@@ -375,27 +384,6 @@ class Forecast:
             elif year % 100 == 0 and year % 400 == 0:
                 return True
 
-# the basis to check the db
-
-def str2datetime(string: str, tzinfo=None) -> datetime:
-    '''
-    This str to datetime is for the hourly format we're using
-    '''
-    return arrow.get(string, "HH-DD/MM/YYYY", tzinfo=tzinfo)
-
-def get_doc(date: datetime) -> str:
-    '''
-    Helper function to get the doc for x/y/z date
-
-    returns the str that should be the ID of the doc
-    '''
-    # yes this is a bit redundant, but I wanna have JUST days, not hours
-    end = datetime(date.year, date.month, date.day)
-    diff = (end - doc_start_time).days % 7
-    week = end - timedelta(days=diff)
-    week_date = arrow.Arrow.strptime(str(week), "%Y-%m-%d %H:%M:%S").datetime
-    return week_date.strftime("%d/%m/%Y")
-
 def main():
     if len(sys.argv) > 1:
         try:
@@ -403,6 +391,9 @@ def main():
             model = Forecast(sys.argv[1], worker=True, incremental=True)
             model.fit()
             model.predict()
+            # written first, the parent picks it up once the prediction shows up
+            with open(sys.argv[2] + '.timings', 'w') as file:
+                json.dump(model.timings, file)
             pickle.dump(model.prediction, open(sys.argv[2], 'wb'))
             print('successfully dumped prediction')
         except Exception as e:
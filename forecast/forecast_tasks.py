@@ -1,15 +1,30 @@
-from numpy.lib.arraysetops import isin
-from forecast.forecast import Forecast
+from pipeline.upload_queue import UploadQueue
+from scheduler import FORECAST
+from database.leases import run_leased
+from concurrent.futures import CancelledError
+from typing import TYPE_CHECKING
 from datetime import datetime, timedelta
 import pytz
 from enum import Enum
 import warnings
-import time
 import threading
 import subprocess
 
+if TYPE_CHECKING:
+    from forecast.forecast import Forecast
+
 LOCAL_TZ = "America/Los_Angeles"
 
+
+def forecast_class():
+    '''
+    forecast.forecast pulls in pandas/pymongo, so it's only imported
+    once a forecaster is actually built
+    '''
+    from forecast.forecast import Forecast
+    return Forecast
+
+
 class ForecasterTypes(Enum):
     '''
     Used to identify what type of forecaster
@@ -41,27 +56,27 @@ class ForecastFactory:
         return (start, end)
 
     @staticmethod
-    def el_salvador_forecaster() -> Forecast:
+    def el_salvador_forecaster() -> 'Forecast':
         # TODO dial back start/end a few more days/hours, where ever start actually needs to begin
         # for example, if data lags one day:
         # start, end = self.get_datetimes(offset=timedelta(days=1))
         # start, end = ForecastFactory.get_datetimes(as_tz='America/El_Salvador')
-        return Forecast("El_Salvador", incremental=True)
+        return forecast_class()("El_Salvador", incremental=True)
 
     @staticmethod
-    def costa_rica_forecaster() -> Forecast:
+    def costa_rica_forecaster() -> 'Forecast':
         # TODO dial back start/end a few more days/hours
         # start, end = ForecastFactory.get_datetimes(as_tz='America/Costa_Rica')
-        return Forecast("Costa_Rica", incremental=True)
+        return forecast_class()("Costa_Rica", incremental=True)
 
     @staticmethod
-    def nicaragua_forecaster() -> Forecast:
+    def nicaragua_forecaster() -> 'Forecast':
         # TODO dial back start/end a few more days/hours
         # start, end = ForecastFactory.get_datetimes(as_tz='America/Managua')
-        return Forecast("Nicaragua", incremental=True)
+        return forecast_class()("Nicaragua", incremental=True)
 
     @staticmethod
-    def mexico_forecaster() -> Forecast:
+    def mexico_forecaster() -> 'Forecast':
         """
         NOT IMPLEMENTED
         """
@@ -73,38 +88,41 @@ class ForecasterThread(threading.Thread):
 
     Make use of multi-threading
     '''
-    __kill = False
     __running = False
     bad_forecaster = False
-    __bypass = False
     __forecaster_type = None
     __new_forecaster_switcher = {}
-    
-
-    # in seconds
-    __watchdog_time = 5
-
-    def __init__(self, forecaster: Forecast, upload_data: list):
+    # Supervisor told about failures and successes, if any
+    supervisor = None
+    # PriorityScheduler running the forecasts, if any (otherwise they run here)
+    scheduler = None
+    # LeaseKeeper shared with other nodes, if any: one node forecasts a country per run
+    leases = None
+
+    def __init__(self, forecaster: 'Forecast', upload_data: UploadQueue):
         super(ForecasterThread, self).__init__()
-        if not isinstance(forecaster, Forecast):
+        if not isinstance(forecaster, forecast_class()):
             raise TypeError(
                 "Expected a Forecast object. Recieved a %s",
                 type(forecaster))
         self.forecaster = forecaster
         self.upload_queue = upload_data
+        # set to cut the sleep short: a forecast was requested or we're stopping
+        self.__wakeup = threading.Event()
+        self.__kill = False
         self.__new_forecaster_switcher = {
             ForecasterTypes.Costa_Rica: ForecastFactory.costa_rica_forecaster,
             ForecasterTypes.El_Salvador: ForecastFactory.el_salvador_forecaster,
             ForecasterTypes.Mexico: ForecastFactory.mexico_forecaster,
             ForecasterTypes.Nicaragua: ForecastFactory.nicaragua_forecaster
         }
-        if forecaster.db.name == 'Mexico':
+        if forecaster.country == 'Mexico':
             self.__forecaster_type = ForecasterTypes.Mexico
-        elif forecaster.db.name == 'Nicaragua':
+        elif forecaster.country == 'Nicaragua':
             self.__forecaster_type = ForecasterTypes.Nicaragua
-        elif forecaster.db.name == 'El_Salvador':
+        elif forecaster.country == 'El_Salvador':
             self.__forecaster_type = ForecasterTypes.El_Salvador
-        elif forecaster.db.name == 'Costa_Rica':
+        elif forecaster.country == 'Costa_Rica':
             self.__forecaster_type = ForecasterTypes.Costa_Rica
         
     def get_forecaster_failure(self) -> bool:
@@ -122,7 +140,7 @@ class ForecasterThread(threading.Thread):
         self.forecaster = self.__new_forecaster_switcher[self.__forecaster_type]()
         self.bad_forecaster = False
 
-    def set_forecaster(self, forecaster: Forecast):
+    def set_forecaster(self, forecaster: 'Forecast'):
         '''
         Set forecaster to new forecaster
         '''
@@ -141,21 +159,42 @@ class ForecasterThread(threading.Thread):
         '''
         This will let the running thread know to reattempt a scrape now
         '''
-        self.__bypass = True
+        self.__wakeup.set()
 
     def attempt_to_queue_data(self):
         '''
         This will attempt to get todays data
         '''
+        if not self.scheduler:
+            return self.__queue_data()
+        future = self.scheduler.submit(self.__forecaster_type, FORECAST, self.__queue_data)
+        try:
+            if future:
+                future.result()
+        except CancelledError:
+            pass
+
+    def __queue_data(self):
         try:
-            data = self.forecaster.get_exported_data(worker=True)
+            if self.leases:
+                data = run_leased(
+                    self.leases, 'forecast/%s' % self.__forecaster_type.name,
+                    self.forecaster.frequency(), lambda: self.forecaster.get_exported_data(worker=True))
+            else:
+                data = self.forecaster.get_exported_data(worker=True)
             if data:
-                self.upload_queue.append((self.__forecaster_type, data))
+                self.upload_queue.put((self.__forecaster_type, data))
                 self.bad_forecaster = True
         except Exception as e:
             print(e)
             print(self.__forecaster_type, "failed")
             self.bad_forecaster = True
+            if self.supervisor:
+                self.supervisor.failed(self.__forecaster_type, e)
+            return
+        if self.supervisor:
+            # rebuilt after every run so the next one reads fresh data
+            self.supervisor.succeeded(self.__forecaster_type, refresh=True)
 
     def is_alive(self):
         return self.__running
@@ -168,29 +207,31 @@ class ForecasterThread(threading.Thread):
         '''
         Runs the forecaster for realtime data gathering
 
-        Sleeps a majority of its time
-
-        This also has a fake watchdog so that we can kill the process
-        in a reasonable amount of time
+        Sleeps a majority of its time, until its next forecast or until
+        schedule_todays_data_now/stop wake it up
         '''
         self.__running = True
-        freq = self.forecaster.frequency()
-        # equals freq so it scrapes once before waiting
-        total_sleep = freq
         while not self.__kill:
-            if total_sleep < freq and not self.__bypass:
-                total_sleep += self.__watchdog_time
-                time.sleep(self.__watchdog_time)
-            else:
-                total_sleep = 0
-                self.__bypass = False
-                self.attempt_to_queue_data()
+            # cleared before forecasting so a request made meanwhile isn't lost
+            self.__wakeup.clear()
+            self.attempt_to_queue_data()
+            self.__wakeup.wait(self.forecaster.frequency())
         self.__running = False
         return super().run()
 
-    def join(self, timeout=30):
+    def stop(self):
+        '''
+        Tells the thread to exit without waiting for it
+
+        It exits right away when sleeping, or once the forecast it's on returns
+        '''
         self.__kill = True
-        super().join(timeout)
+        self.__wakeup.set()
+
+    def join(self, timeout=30):
+        self.stop()
+        if self.ident is not None:
+            super().join(timeout)
 
     def __del__(self):
         self.join()
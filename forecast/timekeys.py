@@ -0,0 +1,273 @@
+'''
+Hour key ('HH-DD/MM/YYYY') and week doc conversions, one key or many at once
+
+Week doc IDs ('DD/MM/YYYY') are the first day of the 7 day block the
+hour falls in, counting from doc_start_time. Lists of keys are parsed
+with NumPy (database.coverage_index.parse_hour_keys), and each week ID
+and time zone is only formatted/looked up once.
+
+Keys are wall clock time of the country, so the week of a key doesn't
+depend on the time zone. Time zones can be names, pytz zones or tzinfos.
+Wall clock times are attached to a zone with localize(), never replace().
+
+Inside the pipeline (adapters, queue, validation, forecasts) hours are
+epoch hours instead: ints counting UTC hours since doc_start_time, so
+they sort and compare as numbers. They become legacy keys, in the
+country's time zone, only when they're stored (storage_keys).
+
+Compare against the old arrow round trip with:
+    python -m forecast.timekeys
+'''
+from forecast.utils import doc_start_time
+from database.coverage_index import parse_hour_keys
+from functools import lru_cache
+import numpy as np
+import datetime
+import pytz
+import time
+
+KEY_FORMAT = "%H-%d/%m/%Y"
+DOC_FORMAT = "%d/%m/%Y"
+
+START_HOUR = np.datetime64(doc_start_time, 'h')
+
+# epoch hour 0, doc_start_time in UTC
+EPOCH = doc_start_time.replace(tzinfo=datetime.timezone.utc)
+
+
+@lru_cache(maxsize=None)
+def week_id(week: int) -> str:
+    '''
+    weeks since doc_start_time -> ID of that week's doc
+    '''
+    return (doc_start_time + datetime.timedelta(weeks=week)).strftime(DOC_FORMAT)
+
+
+@lru_cache(maxsize=64)
+def zone(tz) -> datetime.tzinfo:
+    '''
+    Name, pytz zone or tzinfo -> a tzinfo (pytz for names)
+    '''
+    if isinstance(tz, str):
+        return pytz.timezone(tz)
+    return tz
+
+
+def localize(date: datetime.datetime, tz) -> datetime.datetime:
+    '''
+    Naive wall clock time in tz -> aware datetime
+
+    Hours that happen twice on a DST change get the first (DST) offset,
+    hours skipped by one get the offset from before the change
+    '''
+    tzinfo = zone(tz)
+    if not hasattr(tzinfo, 'localize'):
+        return date.replace(tzinfo=tzinfo)
+    try:
+        return tzinfo.localize(date, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        return tzinfo.localize(date, is_dst=True)
+    except pytz.NonExistentTimeError:
+        return tzinfo.localize(date, is_dst=False)
+
+
+def get_doc(date: datetime.datetime) -> str:
+    '''
+    Helper function to get the doc for x/y/z date
+
+    returns the str that should be the ID of the doc
+    '''
+    day = datetime.datetime(date.year, date.month, date.day)
+    return week_id((day - doc_start_time).days // 7)
+
+
+def str2datetime(string: str, tzinfo=None) -> datetime.datetime:
+    '''
+    This str to datetime is for the hourly format we're using
+    '''
+    date = datetime.datetime.strptime(string, KEY_FORMAT)
+    return localize(date, tzinfo) if tzinfo else date
+
+
+def week_numbers(keys) -> np.ndarray:
+    '''
+    weeks since doc_start_time of every key, as an int64 array
+    '''
+    return parse_hour_keys(keys) // (24 * 7)
+
+
+def week_ids(keys) -> list:
+    '''
+    get_doc(str2datetime(key)) for every key
+    '''
+    weeks = week_numbers(keys)
+    if not len(weeks):
+        return []
+    unique, inverse = np.unique(weeks, return_inverse=True)
+    ids = [week_id(int(week)) for week in unique]
+    return [ids[i] for i in inverse.tolist()]
+
+
+def naive_datetimes(keys) -> list:
+    '''
+    Keys -> naive local datetimes
+    '''
+    hours = START_HOUR + parse_hour_keys(keys)
+    return hours.astype('datetime64[us]').astype(datetime.datetime).tolist()
+
+
+def aware_datetimes(keys, tz) -> list:
+    '''
+    Keys -> datetimes in the tz they were written in
+
+    Wall clock hours that happen twice on a DST change get the first offset
+    '''
+    return [localize(date, tz) for date in naive_datetimes(keys)]
+
+
+def epoch_hour(date: datetime.datetime, tz=None) -> int:
+    '''
+    datetime -> epoch hour (rounded down)
+
+    Naive datetimes are wall clock time in tz, or UTC without one
+    '''
+    if date.tzinfo is None:
+        date = localize(date, tz or datetime.timezone.utc)
+    return int((date - EPOCH).total_seconds() // 3600)
+
+
+def epoch_datetime(hour: int, tz=None) -> datetime.datetime:
+    '''
+    epoch hour -> aware datetime, in tz if there's one
+    '''
+    date = EPOCH + datetime.timedelta(hours=int(hour))
+    return date.astimezone(zone(tz)) if tz else date
+
+
+@lru_cache(maxsize=4096)
+def utc_offset(tzinfo: datetime.tzinfo, hour: int, local: bool) -> int:
+    '''
+    Offset in hours of tzinfo at an hour since doc_start_time, that hour
+    being wall clock time if local, UTC otherwise
+    '''
+    if local:
+        date = localize(doc_start_time + datetime.timedelta(hours=hour), tzinfo)
+    else:
+        date = (EPOCH + datetime.timedelta(hours=hour)).astimezone(tzinfo)
+    return int(date.utcoffset().total_seconds() // 3600)
+
+
+def offsets(hours: np.ndarray, tz, local: bool) -> np.ndarray:
+    '''
+    utc_offset of every hour. Looked up at both ends of each day, and
+    hour by hour only on days the offset changes (DST)
+    '''
+    tzinfo = zone(tz)
+    result = np.zeros(len(hours), dtype=np.int64)
+    days = hours // 24
+    for day in np.unique(days).tolist():
+        first = utc_offset(tzinfo, day * 24, local)
+        rows = np.flatnonzero(days == day)
+        if first == utc_offset(tzinfo, day * 24 + 23, local):
+            result[rows] = first
+        else:
+            result[rows] = [utc_offset(tzinfo, hour, local) for hour in hours[rows].tolist()]
+    return result
+
+
+def is_epoch(key) -> bool:
+    return isinstance(key, (int, np.integer))
+
+
+def epoch_hours(keys, tz) -> np.ndarray:
+    '''
+    Legacy keys in tz (or epoch hours, passed through) -> int64 array of epoch hours
+    '''
+    keys = list(keys)
+    result = np.zeros(len(keys), dtype=np.int64)
+    legacy = [i for i, key in enumerate(keys) if not is_epoch(key)]
+    if len(legacy) < len(keys):
+        result[:] = [key if is_epoch(key) else 0 for key in keys]
+    if legacy:
+        local = parse_hour_keys([keys[i] for i in legacy])
+        result[legacy] = local - offsets(local, tz, local=True)
+    return result
+
+
+def legacy_keys(hours, tz) -> list:
+    '''
+    Epoch hours -> 'HH-DD/MM/YYYY' keys in tz
+    '''
+    hours = np.asarray(hours, dtype=np.int64)
+    local = START_HOUR + (hours + offsets(hours, tz, local=False))
+    # 'YYYY-MM-DDTHH' -> 'HH-DD/MM/YYYY'
+    return [
+        '%s-%s/%s/%s' % (text[11:13], text[8:10], text[5:7], text[:4])
+        for text in np.datetime_as_string(local, unit='h').tolist()
+    ]
+
+
+def epoch_keys(entries: dict, tz) -> dict:
+    '''
+    {legacy key or epoch hour: value} -> {epoch hour: value}
+    '''
+    keys = list(entries)
+    return dict(zip(epoch_hours(keys, tz).tolist(), (entries[key] for key in keys)))
+
+
+def storage_keys(entries: dict, tz) -> dict:
+    '''
+    {epoch hour or legacy key: value} -> {legacy key: value}, sorted by hour
+
+    The two hours a DST fall back repeats share a legacy key, the first one
+    keeps it (like the adapters did before epoch hours)
+    '''
+    entries = epoch_keys(entries, tz)
+    hours = sorted(entries)
+    stored = dict()
+    for key, hour in zip(legacy_keys(hours, tz), hours):
+        stored.setdefault(key, entries[hour])
+    return stored
+
+
+def legacy_week_id(key: str, tzinfo='UTC') -> str:
+    '''
+    The arrow based conversion these replace, kept for the benchmark
+    '''
+    import arrow
+    date = arrow.get(key, "HH-DD/MM/YYYY", tzinfo=tzinfo)
+    end = datetime.datetime(date.year, date.month, date.day)
+    diff = (end - doc_start_time).days % 7
+    week = end - datetime.timedelta(days=diff)
+    week_date = arrow.Arrow.strptime(str(week), "%Y-%m-%d %H:%M:%S").datetime
+    return week_date.strftime(DOC_FORMAT)
+
+
+def main():
+    # a year of hourly keys, what one backfill uploads
+    start = datetime.datetime(2019, 1, 1)
+    keys = [(start + datetime.timedelta(hours=hour)).strftime(KEY_FORMAT) for hour in range(24 * 365)]
+    tz = 'America/Managua'
+
+    began = time.perf_counter()
+    legacy = [legacy_week_id(key, tz) for key in keys]
+    legacy_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    bulk = week_ids(keys)
+    bulk_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    aware_datetimes(keys, tz)
+    aware_time = time.perf_counter() - began
+
+    assert bulk == legacy
+    print(len(keys), 'keys')
+    print('arrow get_doc(str2datetime()):', round(legacy_time / len(keys) * 1e6, 2), 'us per key')
+    print('week_ids:                     ', round(bulk_time / len(keys) * 1e6, 2), 'us per key')
+    print('aware_datetimes:              ', round(aware_time / len(keys) * 1e6, 2), 'us per key')
+    print(round(legacy_time / bulk_time, 1), 'times faster')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,35 @@
+from startup import startup_timer
+import metrics
 from operator import truediv
-from adapters.nicaragua_adapter import NicaraguaAdapter
-from adapters.el_salvador_adapter import ElSalvadorAdapter
-from adapters.mexico_adapter import MexicoAdapter
-from adapters.costa_rica_adapter import CostaRicaAdapter
-from adapters.adapter_tasks import AdapterTypes
+from adapters.adapter_tasks import AdapterTypes, new_adapter
 from forecast.forecast_tasks import ForecasterThread, ForecasterTypes
 from cron import cron
+from async_cron import AsyncCron
 from arrow import Arrow
-from threading import Thread
+from threading import Thread, Event
 from dotenv import load_dotenv
-from forecast.forecast import str2datetime, get_doc
+from forecast.timekeys import week_ids, epoch_keys, storage_keys, legacy_keys
+from forecast.utils import COUNTRY_TZ
+from database.coverage_index import CoverageIndex
+from pipeline.upload_queue import UploadQueue
+from pipeline.async_queue import AsyncUploadQueue
+from pipeline.coalescer import UploadCoalescer
+from pipeline.spool import UploadSpool
+from pipeline.gap_fill import GapFiller, FillRequest, plan, units
+from pipeline.request_registry import RequestRegistry
+from pipeline.validation import BatchValidator, CHECKS
+from pipeline.processes import ProcessPool
+from scrapers import rate_limit
+from database.storage import get_storage, MongoStorage
+from database.leases import get_lease_keeper
+from database.connection import ping, connection_stats
+from database.timeseries import HISTORIC_MODE, get_timeseries
+from queue import Empty
+import asyncio
 import os
 import datetime
 import pytz
 import arrow
-import pymongo
 import time
 import subprocess
 
@@ -22,24 +37,117 @@ load_dotenv()
 
 # TO CHANGE START REF. go to forecast.forecast.py
 
+# 'threads' keeps one thread per adapter/forecaster (see cron), 'asyncio' runs
+# every source as a coroutine on one event loop (see async_cron)
+manager_runtime = 'threads'
+
+# where adapters scrape and parse: 'threads' of this process, or 'processes'
+# so parsing isn't held up by the GIL (see pipeline.processes)
+adapter_execution = 'threads'
+# worker processes in 'processes' mode, each keeps a browser per country it scraped
+adapter_processes = 4
+
+# changes to the requests per second (bursts of up to burst) and browsers at
+# once each site gets from all our scrapers together, e.g.
+# {'Mexico': {'rate': 0.2}} (defaults in scrapers.rate_limit.DEFAULT_LIMITS)
+scrape_limits = {}
+
+# local port the Prometheus metrics are served on (None to disable)
+metrics_port = 9108
+
+# historical ranges that failed or were quarantined, kept across restarts
+gap_fill_registry_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline', 'gap_fill.json')
+
+# ranges the sources serve broken data for, never requested (first day, last day)
+known_bad_ranges = {
+    AdapterTypes.Nicaragua: [
+        # weeks of 30/05/2017, 06/06/2017, 13/06/2017, 20/06/2017, 27/06/2017
+        (datetime.date(2017, 5, 30), datetime.date(2017, 7, 3)),
+        # weeks of 17/07/2018, 24/07/2018
+        (datetime.date(2018, 7, 17), datetime.date(2018, 7, 30)),
+        # extra columns on the 29th and 30th
+        (datetime.date(2019, 8, 29), datetime.date(2019, 8, 30))
+    ]
+}
+
+# worker threads per source: caps its open browsers
+# (realtime scrapes go first, then forecasts, then backfills, and one of
+# them is kept for realtime scrapes)
+source_workers = 2
+# backfills allowed to wait per source, the rest are asked for on the next check
+max_queued_backfills = 64
+
+# when each source publishes (local time), scrapes are lined up with it instead
+# of running every frequency() from start up (see publish_schedule):
+#   period/offset: a new batch every period, out offset seconds after its start
+#   jitter: up to this many seconds are added so we don't hit them on the dot
+#   retry_every/retry_window: how often to look again, and for how long after
+#   the slot, while nothing new shows up
+publish_schedules = {
+    # last hour is up a few minutes past the hour
+    AdapterTypes.El_Salvador: dict(
+        period=60 * 60, offset=5 * 60, jitter=60,
+        retry_every=5 * 60, retry_window=45 * 60, tz='America/El_Salvador'),
+    # yesterday's data, sometime in the early morning
+    AdapterTypes.Costa_Rica: dict(
+        period=24 * 60 * 60, offset=60 * 60, jitter=5 * 60,
+        retry_every=30 * 60, retry_window=12 * 60 * 60, tz='America/Costa_Rica'),
+    # the day before yesterday, sometime in the morning
+    AdapterTypes.Nicaragua: dict(
+        period=24 * 60 * 60, offset=2 * 60 * 60, jitter=5 * 60,
+        retry_every=60 * 60, retry_window=12 * 60 * 60, tz='America/Managua'),
+}
+
+# seconds a lease lives without a heartbeat when sharing work with other
+# nodes (LEASE_BACKEND in .env, see database.leases)
+lease_ttl = 60
+
+# drop scraped values that fail pipeline.validation's checks before writing them
+validate_uploads = True
+validator = BatchValidator()
+
 # hours between checking the DB
 db_checking_frequency = 8
 
 # doc string format for mongodb
 doc_format = "%d/%m/%Y"
 
-# client
-client = pymongo.MongoClient(os.getenv("MONGO_SRV"))
+# payloads held in memory before producers have to wait
+upload_queue_size = 50
+
+# set to a directory to spill payloads to disk instead of making producers wait
+upload_spill_dir = None
+
+# payloads are journaled here until uploaded and replayed after a crash (None to disable)
+upload_spool_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline', 'spool')
+
+# seconds and hour entries to merge payloads for before writing them
+coalesce_window = 30
+coalesce_max_entries = 2000
+
+# where docs are stored, see database.storage (STORAGE_BACKEND in .env)
+storage = get_storage()
 
+# (database, collection) for each type
 db_switcher = {
-    AdapterTypes.El_Salvador: client.get_database('El_Salvador')['Historic'],
-    AdapterTypes.Nicaragua: client.get_database('Nicaragua')['Historic'],
-    AdapterTypes.Costa_Rica: client.get_database('Costa_Rica')['Historic'],
-    AdapterTypes.Mexico: client.get_database('Mexico')['Historic'],
-    ForecasterTypes.El_Salvador : client.get_database('El_Salvador')['Forecast'],
-    ForecasterTypes.Nicaragua : client.get_database('Nicaragua')['Forecast'],
-    ForecasterTypes.Costa_Rica : client.get_database('Costa_Rica')['Forecast'],
-    ForecasterTypes.Mexico : client.get_database('Mexico')['Forecast']
+    AdapterTypes.El_Salvador: ('El_Salvador', 'Historic'),
+    AdapterTypes.Nicaragua: ('Nicaragua', 'Historic'),
+    AdapterTypes.Costa_Rica: ('Costa_Rica', 'Historic'),
+    AdapterTypes.Mexico: ('Mexico', 'Historic'),
+    ForecasterTypes.El_Salvador : ('El_Salvador', 'Forecast'),
+    ForecasterTypes.Nicaragua : ('Nicaragua', 'Forecast'),
+    ForecasterTypes.Costa_Rica : ('Costa_Rica', 'Forecast'),
+    ForecasterTypes.Mexico : ('Mexico', 'Forecast')
+}
+
+# local coverage bitmaps of the Historic collections, kept up by the uploader
+coverage_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'coverage')
+
+coverage_indexes = {
+    adapter: CoverageIndex.load(
+        adapter.name,
+        os.path.join(coverage_dir, adapter.name + '.npz'))
+    for adapter in AdapterTypes
 }
 
 tz_switcher = {
@@ -53,24 +161,77 @@ tz_switcher = {
     ForecasterTypes.Mexico : pytz.timezone('Mexico/General')
 }
 
+request_registry = RequestRegistry.load(gap_fill_registry_path)
+for adapter, ranges in known_bad_ranges.items():
+    for first, last in ranges:
+        request_registry.quarantine(adapter.name, units(FillRequest(adapter, first, last)), 'known bad')
+
+rate_limit.configure(scrape_limits)
+
+# None when this is the only node
+lease_keeper = get_lease_keeper(lease_ttl)
+
 main_jobs = []
 
+# set on shutdown, threads sleep on it instead of time.sleep
+stopping = Event()
+
 def main():
+    if metrics_port:
+        metrics.serve(metrics_port)
+    if manager_runtime == 'asyncio':
+        asyncio.run(async_main())
+    else:
+        threaded_main()
+
+def threaded_main():
+    if isinstance(storage, MongoStorage):
+        # first round trip includes SRV lookup, TLS and server selection
+        with startup_timer.phase('db connect'):
+            ping()
+        print("DB client:", connection_stats())
     # set up queue and cron jobs
-    upload_queue = list()
-    jobs = cron(upload_queue, main_jobs)
+    with startup_timer.phase('upload queue'):
+        spool = UploadSpool(upload_spool_dir) if upload_spool_dir else None
+        upload_queue = UploadQueue(upload_queue_size, spill_dir=upload_spill_dir, spool=spool)
+        metrics.upload_queue_depth.set_function(upload_queue.__len__)
+    processes = None
+    if adapter_execution == 'processes':
+        with startup_timer.phase('adapter processes'):
+            processes = ProcessPool(adapter_processes, limits=scrape_limits)
+            processes.warm_up()
+    with startup_timer.phase('cron'):
+        jobs = cron(upload_queue, main_jobs, source_workers, max_queued_backfills, publish_schedules,
+                    leases=lease_keeper, processes=processes)
     # Start uploader job
     Thread(target=uploader, kwargs={"cron_obj":jobs, "upload_queue":upload_queue}).start()
-    Thread(target=check_db, kwargs={"cron_obj":jobs, "upload_queue":upload_queue}).start()
+    if spool:
+        # whatever didn't make it to the DB last run goes first
+        with startup_timer.phase('spool replay'):
+            replayed = spool.replay()
+            print("Replaying", len(replayed), "spooled uploads")
+            for seq, data in replayed:
+                upload_queue.put(data, seq=seq)
+    gap_filler = GapFiller(upload_queue, registry=request_registry, scheduler=jobs.scheduler,
+                           leases=lease_keeper, rejected_days=rejected_days,
+                           adapter_factory=processes.adapter if processes else new_adapter)
+    Thread(target=check_db, kwargs={"cron_obj":jobs, "upload_queue":upload_queue, "gap_filler":gap_filler}).start()
+    startup_timer.report()
 
     # some jobs don't work unless on main thread???
-    while True:
-        if main_jobs:
-            main_jobs.pop(0)()
-        time.sleep(1)
+    try:
+        while True:
+            if main_jobs:
+                main_jobs.pop(0)()
+            time.sleep(1)
+    finally:
+        # wakes check_db and every cron thread instead of waiting out their sleeps
+        stopping.set()
+        jobs.stop()
+        gap_filler.shutdown(wait=False)
 
-def check_db(cron_obj: cron, upload_queue: list):
-     while True:
+def check_db(cron_obj: cron, upload_queue: UploadQueue, gap_filler: GapFiller):
+     while cron_obj.cron_alive and not stopping.is_set():
         # look for missing entries and add them to queue
         # PROBLEM: Nicaragua still has broken data on
         # TODO manually sort out the week 27/8/2019
@@ -79,52 +240,267 @@ def check_db(cron_obj: cron, upload_queue: list):
         # 17/07/2018, 24/07/2018, 
         # for WHATEVER REASON, 29th and the 30th in 8/2019 have extra columns
         # this means Nic will continue to fail this week/days until we fix it
-        print("checking DB...")
-        for adapter in AdapterTypes:
-            db = db_switcher[adapter]
-            now = datetime.datetime.now() - datetime.timedelta(days=1)
-            start = datetime.datetime(2019, 1, 1)
-            delta = datetime.timedelta(days=6)
-            while start < now:
-                end = start + delta
-                # check doc
-                # 169 entries per doc (includes ID)
-                query = db.find_one({'_id': start.strftime(doc_format)})
-                if (not query) or (len(query) != 169):
-                    # This will get pushed into the queue
-                    print("Requesting data from ", adapter, ":")
-                    print("\tfor week:", start.strftime(doc_format))
-                    cron_obj.request_historical(adapter, start, end)
-                # iterate
-                start = end + datetime.timedelta(days=1)
-        print("Done checking db. Sleeping now...")
-        time.sleep(60 * 60 * db_checking_frequency)
-
-def uploader(cron_obj: cron, upload_queue: list):
+        # (they're quarantined through known_bad_ranges so they aren't re-requested)
+        check_gaps(cron_obj, gap_filler)
+        stopping.wait(60 * 60 * db_checking_frequency)
+
+def check_gaps(cron_obj, gap_filler: GapFiller):
+    '''
+    One pass of check_db: requests the missing hours and prints how the
+    sources are doing (cron_obj is a cron or an AsyncCron)
+    '''
+    print("checking DB...")
+    for request in find_gaps():
+        # This will get pushed into the queue
+        print_request(request)
+        gap_filler.submit(request)
+    print("Gap fill ranges:", request_registry.stats())
+    print("Restarts:", cron_obj.get_restarts())
+    print("Queue waits:", cron_obj.scheduler.wait_times())
+    print("Scrape limit waits:", rate_limit.wait_times())
+    print("Done checking db. Sleeping now...")
+
+def find_gaps() -> list:
+    '''
+    FillRequests covering every missing Historic hour (see pipeline.gap_fill)
+    '''
+    requests = []
+    for adapter in AdapterTypes:
+        country, collection = db_switcher[adapter]
+        now = datetime.datetime.now() - datetime.timedelta(days=1)
+        start = datetime.datetime(2019, 1, 1)
+        index = coverage_indexes[adapter]
+        if index.is_empty() or lease_keeper:
+            # first run (or other nodes write too): build the index from the stored keys
+            if HISTORIC_MODE == 'timeseries':
+                index.rebuild_from_keys(get_timeseries().hour_keys(country))
+            else:
+                index.rebuild_from_keys(storage.hour_keys(country, collection))
+            index.save()
+        requests.extend(plan(adapter, index.missing_ranges(start, now), registry=request_registry))
+    return requests
+
+def print_request(request):
+    print("Requesting data from ", request.adapter_type, ":")
+    print("\tfrom", request.start.strftime(doc_format), "to", request.end.strftime(doc_format))
+
+def uploader(cron_obj: cron, upload_queue: UploadQueue):
     '''
-    This will run in a loop and check the queue for data to load
+    This will run in a loop and wait on the queue for data to load
+
+    Payloads are merged for up to coalesce_window seconds so each
+    hour gets written once per window. Failed uploads are retried after
+    the supervisor's backoff
     '''
     print("Uploader started")
+    coalescer = UploadCoalescer(coalesce_max_entries, coalesce_window)
+    # spool seqs of the payloads merged into the coalescer
+    pending_seqs = []
+    failures = 0
     while cron_obj.cron_alive:
-        if len(upload_queue) > 0:
-            data = upload_queue.pop(0)
+        try:
+            # wakes up as soon as something is queued
+            seq, data = upload_queue.get_with_seq(timeout=coalescer.time_until_flush())
             print("Now sorting data from", data[0])
             print(len(upload_queue), "uploads in queue")
-            collection = db_switcher[data[0]]
-            entries = data[1]
-            marked_entries = [
-                {
-                    '_id': get_doc(str2datetime(entry, tz_switcher[data[0]])),
-                    entry: entries[entry]
-                }
-                for entry in entries.keys()
-            ]
-            print("uploading data for", data[0])
             # Forecasted data will constantly be updated, therefore needs to be overwritten
-            upload_sorter(collection, marked_entries, overwrite=isinstance(data[0], ForecasterTypes))
-        time.sleep(1)
+            coalescer.add(data[0], data[1], overwrite=isinstance(data[0], ForecasterTypes))
+            if seq is not None:
+                pending_seqs.append(seq)
+        except Empty:
+            pass
+        if coalescer.ready():
+            if flush_uploads(coalescer, upload_queue, pending_seqs):
+                failures = 0
+            else:
+                failures += 1
+                delay = cron_obj.supervisor.backoff(failures)
+                print("Retrying uploads in", delay, "s")
+                stopping.wait(delay)
+    flush_uploads(coalescer, upload_queue, pending_seqs)
     print("cron died! Death on:", datetime.datetime.now())
 
+def flush_uploads(coalescer: UploadCoalescer, upload_queue: UploadQueue, pending_seqs: list) -> bool:
+    '''
+    Uploads everything in the coalescer, then acks the spooled payloads
+
+    returns False if an upload failed: what wasn't uploaded goes back in
+    the coalescer and nothing is acked, so it's retried (or replayed on
+    the next start)
+    '''
+    batch = coalescer.flush()
+    for i, (data_type, entries) in enumerate(batch):
+        try:
+            entries = validate(data_type, entries)
+            with metrics.upload_batch_seconds.time(**upload_labels(data_type)):
+                upload(data_type, entries)
+        except Exception as e:
+            print("Upload for", data_type, "failed:", e)
+            for data_type, entries in batch[i:]:
+                coalescer.add(data_type, entries, overwrite=isinstance(data_type, ForecasterTypes))
+            return False
+    if upload_queue.spool:
+        for seq in pending_seqs:
+            upload_queue.spool.ack(seq)
+    pending_seqs.clear()
+    return True
+
+def validate(data_type, entries: dict) -> dict:
+    '''
+    Drops scraped values that fail validation, forecasts pass through
+    '''
+    if not validate_uploads or not isinstance(data_type, AdapterTypes):
+        return entries
+    # spooled payloads from older runs can still have legacy keys
+    entries = epoch_keys(entries, tz_switcher[data_type])
+    clean, report = validator.validate(data_type.name, entries)
+    metrics.record_validation(data_type.name, report)
+    rejected = {check: report[check] for check in CHECKS if report[check]}
+    if rejected:
+        print("Rejected from", data_type, ":", rejected)
+    return clean
+
+def rejected_days(adapter_type: AdapterTypes, entries: dict) -> list:
+    '''
+    Local days of a backfill whose every hour validation would drop
+
+    Checked without learning from it, the uploader validates it for real
+    '''
+    if not validate_uploads:
+        return []
+    tz = tz_switcher[adapter_type]
+    entries = epoch_keys(entries, tz)
+    clean, _ = validator.validate(adapter_type.name, entries, learn=False)
+    days = {key[3:] for key in legacy_keys(list(entries), tz)}
+    kept = {key[3:] for key in legacy_keys(list(clean), tz)}
+    return sorted(datetime.datetime.strptime(day, doc_format).date() for day in days - kept)
+
+def upload(data_type, entries: dict):
+    '''
+    Sorts entries into their week docs and uploads them
+    '''
+    country, collection = db_switcher[data_type]
+    # epoch hours -> legacy keys, the only place they're converted back
+    entries = storage_keys(entries, tz_switcher[data_type])
+    marked_entries = mark_entries(data_type, entries)
+    print("uploading data for", data_type)
+    historic = isinstance(data_type, AdapterTypes)
+    if historic and HISTORIC_MODE != 'weekly':
+        # time series can't upsert, so only hours we don't have yet
+        index = coverage_indexes[data_type]
+        get_timeseries().insert(
+            country,
+            {key: value for key, value in entries.items() if not index.has(key)})
+    if not historic or HISTORIC_MODE != 'timeseries':
+        metrics.record_upload(country, collection, *storage.upsert(
+            country,
+            collection,
+            marked_entries,
+            overwrite=isinstance(data_type, ForecasterTypes)))
+    if data_type in coverage_indexes:
+        coverage_indexes[data_type].mark(entries.keys())
+        coverage_indexes[data_type].save()
+
+def upload_labels(data_type) -> dict:
+    country, collection = db_switcher[data_type]
+    return {'country': country, 'collection': collection}
+
+def mark_entries(data_type, entries: dict) -> list:
+    '''
+    [{'_id': week doc, hour key: value}, ...] for every entry
+    '''
+    keys = list(entries)
+    return [{'_id': doc_id, key: entries[key]} for key, doc_id in zip(keys, week_ids(keys))]
+
+async def async_main():
+    '''
+    main, but scheduling and queueing are coroutines on one event loop,
+    blocking work (scrapes, uploads, DB checks) goes to threads
+    '''
+    loop = asyncio.get_running_loop()
+    if isinstance(storage, MongoStorage):
+        # first round trip includes SRV lookup, TLS and server selection
+        with startup_timer.phase('db connect'):
+            await loop.run_in_executor(None, ping)
+        print("DB client:", connection_stats())
+    with startup_timer.phase('upload queue'):
+        spool = UploadSpool(upload_spool_dir) if upload_spool_dir else None
+        upload_queue = AsyncUploadQueue(upload_queue_size, spool=spool).bind()
+        metrics.upload_queue_depth.set_function(upload_queue.__len__)
+    processes = None
+    if adapter_execution == 'processes':
+        with startup_timer.phase('adapter processes'):
+            processes = ProcessPool(adapter_processes, limits=scrape_limits)
+            await loop.run_in_executor(None, processes.warm_up)
+    jobs = AsyncCron(upload_queue, main_jobs, workers_per_source=source_workers,
+                     max_queued_backfills=max_queued_backfills, schedules=publish_schedules,
+                     leases=lease_keeper, processes=processes)
+    with startup_timer.phase('cron'):
+        await jobs.start()
+    tasks = [asyncio.create_task(async_uploader(jobs, upload_queue))]
+    if spool:
+        # whatever didn't make it to the DB last run goes first
+        with startup_timer.phase('spool replay'):
+            replayed = await loop.run_in_executor(None, spool.replay)
+            print("Replaying", len(replayed), "spooled uploads")
+            for seq, data in replayed:
+                await upload_queue.put_async(data, seq=seq)
+    gap_filler = GapFiller(upload_queue, registry=request_registry, scheduler=jobs.scheduler,
+                           leases=lease_keeper, rejected_days=rejected_days,
+                           adapter_factory=processes.adapter if processes else new_adapter)
+    tasks.append(asyncio.create_task(async_check_db(jobs, gap_filler)))
+    startup_timer.report()
+    try:
+        # the loop runs on the main thread, so main jobs still do too
+        while jobs.cron_alive:
+            if main_jobs:
+                main_jobs.pop(0)()
+            await asyncio.sleep(1)
+    finally:
+        await jobs.stop()
+        gap_filler.shutdown(wait=False)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def async_check_db(cron_obj: AsyncCron, gap_filler: GapFiller):
+    while cron_obj.cron_alive:
+        # index rebuilds read the whole collection, keep them off the loop
+        await asyncio.get_running_loop().run_in_executor(None, check_gaps, cron_obj, gap_filler)
+        await asyncio.sleep(60 * 60 * db_checking_frequency)
+
+async def async_uploader(cron_obj: AsyncCron, upload_queue: AsyncUploadQueue):
+    '''
+    uploader as a coroutine, the flushes run on a thread
+    '''
+    print("Uploader started")
+    loop = asyncio.get_running_loop()
+    coalescer = UploadCoalescer(coalesce_max_entries, coalesce_window)
+    pending_seqs = []
+    failures = 0
+    try:
+        while cron_obj.cron_alive:
+            try:
+                seq, data = await upload_queue.get_with_seq(timeout=coalescer.time_until_flush())
+                print("Now sorting data from", data[0])
+                print(len(upload_queue), "uploads in queue")
+                coalescer.add(data[0], data[1], overwrite=isinstance(data[0], ForecasterTypes))
+                if seq is not None:
+                    pending_seqs.append(seq)
+            except Empty:
+                pass
+            if coalescer.ready():
+                if await loop.run_in_executor(None, flush_uploads, coalescer, upload_queue, pending_seqs):
+                    failures = 0
+                else:
+                    failures += 1
+                    delay = cron_obj.supervisor.backoff(failures)
+                    print("Retrying uploads in", delay, "s")
+                    await asyncio.sleep(delay)
+    finally:
+        flush_uploads(coalescer, upload_queue, pending_seqs)
+        print("cron died! Death on:", datetime.datetime.now())
+
 def upload_sorter(db_collection, marked_entries, overwrite=False):
     '''
     Helper function that uploads data one at a time:
@@ -163,7 +539,7 @@ def upload_sorter(db_collection, marked_entries, overwrite=False):
 # how we pushed historical data to our DB
 
 def es_adapter_demo():
-    db = client.get_database('El_Salvador')['Historic']
+    from adapters.el_salvador_adapter import ElSalvadorAdapter
     el_salvador = ElSalvadorAdapter()
     start = datetime.date(year=2016, month=12, day=27)
     delta = datetime.timedelta(days=6)
@@ -175,15 +551,16 @@ def es_adapter_demo():
         print("Current week", week, ":")
         print("\t", doc_id)
         data = el_salvador.scrape_history(start.year, start.month, start.day, end.year, end.month, end.day)
+        data = storage_keys(data, COUNTRY_TZ['El_Salvador'])
         data['_id'] = doc_id
-        db.insert_one(data)
+        storage.insert_doc('El_Salvador', 'Historic', data)
         start = end + datetime.timedelta(days=1)
         
     print("Completed to:")
     print("\t", start.strftime("%d/%m/%Y"))
     
 def mexico_adapter_demo():
-    db = client.get_database('Mexico')['Historic']
+    from adapters.mexico_adapter import MexicoAdapter
     ma = MexicoAdapter()
     start = datetime.date(year=2016, month=12, day=27)
     delta = datetime.timedelta(days=6)
@@ -194,9 +571,10 @@ def mexico_adapter_demo():
         print("Current week", week, ":")
         print("\t", doc_id)
         data = ma.scrape_history(start.year, start.month, start.day, end.year, end.month, end.day)
+        data = storage_keys(data, COUNTRY_TZ['Mexico'])
         data['_id'] = doc_id
         print_data(data)
-        db.insert_one(data)
+        storage.insert_doc('Mexico', 'Historic', data)
         start = end + datetime.timedelta(days=1)
 
     print("Completed to:")
@@ -208,7 +586,7 @@ def nic_adapter_demo():
     # 06/06/2017, 13/06/2017, 20/06/2017, 27/06/2017
     # 17/07/2018, 24/07/2018, 
     # for WHATEVER REASON, 29th and the 30th in 8/2019 have extra columns
-    db = client.get_database('Nicaragua')['Historic']
+    from adapters.nicaragua_adapter import NicaraguaAdapter
     na = NicaraguaAdapter()
     start = datetime.date(year=2018, month=12, day=18)
     delta = datetime.timedelta(days=6)
@@ -219,16 +597,17 @@ def nic_adapter_demo():
         print("Current week", week, ":")
         print("\t", doc_id)
         data = na.scrape_history(start.year, start.month, start.day, end.year, end.month, end.day)
+        data = storage_keys(data, COUNTRY_TZ['Nicaragua'])
         data['_id'] = doc_id
         print_data(data)
-        db.insert_one(data)
+        storage.insert_doc('Nicaragua', 'Historic', data)
         start = end + datetime.timedelta(days=1)
 
     print("Completed to:")
     print("\t", start.strftime("%d/%m/%Y"))
 
 def cr_adapter_demo():
-    db = client.get_database('Costa_Rica')['Historic']
+    from adapters.costa_rica_adapter import CostaRicaAdapter
     cr = CostaRicaAdapter()
     start = datetime.date(year=2016, month=12, day=27)
     delta = datetime.timedelta(days=6)
@@ -244,9 +623,10 @@ def cr_adapter_demo():
                 print("Current week", week, ":")
                 print("\t", doc_id)
                 data = cr.scrape_history(start.year, start.month, start.day, end.year, end.month, end.day)
+                data = storage_keys(data, COUNTRY_TZ['Costa_Rica'])
                 data['_id'] = doc_id
                 print_data(data)
-                db.insert_one(data)
+                storage.insert_doc('Costa_Rica', 'Historic', data)
                 break
             except Exception as e:
                 print(e)
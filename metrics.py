@@ -0,0 +1,318 @@
+'''
+Pipeline metrics, served in Prometheus text format
+
+A small built-in registry (no client library needed) plus the metrics
+the scrape -> queue -> upload -> forecast pipeline reports:
+    cfv_scrape_duration_seconds         per adapter and kind (latest/history)
+    cfv_scrapes_total                   per adapter, kind and result (success/skipped/failure)
+    cfv_last_good_scrape_timestamp_seconds / cfv_seconds_since_good_scrape
+    cfv_upload_queue_depth
+    cfv_upload_batch_duration_seconds   per country and collection
+    cfv_upload_writes_total             hours written/skipped, per country and collection
+    cfv_forecast_duration_seconds       fit/predict per country
+    cfv_validation_rejected_total       values dropped by pipeline.validation, per check
+    cfv_worker_restarts_total           adapters/forecasters rebuilt by the supervisor
+    cfv_schedule_wait_seconds           time jobs waited for a worker, per source and class
+    cfv_scrape_wait_seconds             time scrapers waited on their source's rate/session limits
+
+Start the endpoint with serve(port), then:
+    curl localhost:9108/metrics
+'''
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+class Metric:
+    '''
+    A named family of samples, one per combination of label values
+    '''
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "%s takes labels %s, got %s" % (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list:
+        '''
+        [(suffix, label values, extra labels, value), ...]
+        '''
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+    def render(self) -> list:
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace('\n', ' ')),
+            '# TYPE %s %s' % (self.name, self.kind)
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (
+                self.name, suffix, format_labels(self.labelnames, key, extra), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    '''
+    A value that goes up and down. set_function makes it computed
+    when scraped instead (e.g. a queue's length)
+    '''
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        self.set(function, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            value = self._values.get(self._key(labels), 0)
+        return value() if callable(value) else value
+
+    def samples(self) -> list:
+        samples = []
+        for suffix, key, extra, value in super().samples():
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue
+            samples.append((suffix, key, extra, value))
+        return samples
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - began, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.__metrics = dict()
+        self.__lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError("%s is already registered" % metric.name)
+            self.__metrics[metric.name] = metric
+
+    def get(self, name: str) -> Metric:
+        with self.__lock:
+            return self.__metrics[name]
+
+    def render(self) -> str:
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+scrape_seconds = Histogram(
+    'cfv_scrape_duration_seconds', 'Time spent scraping', ['adapter', 'kind'])
+scrapes_total = Counter(
+    'cfv_scrapes_total', 'Scrapes by outcome', ['adapter', 'kind', 'result'])
+last_good_scrape = Gauge(
+    'cfv_last_good_scrape_timestamp_seconds', 'Unix time of the last successful scrape', ['adapter'])
+seconds_since_good_scrape = Gauge(
+    'cfv_seconds_since_good_scrape', 'Seconds since the last successful scrape', ['adapter'])
+upload_queue_depth = Gauge(
+    'cfv_upload_queue_depth', 'Payloads waiting to be uploaded')
+upload_batch_seconds = Histogram(
+    'cfv_upload_batch_duration_seconds', 'Time to upload one batch of entries', ['country', 'collection'])
+upload_writes_total = Counter(
+    'cfv_upload_writes_total',
+    'Hours written or skipped (already stored) by upserts',
+    ['country', 'collection', 'result'])
+forecast_seconds = Histogram(
+    'cfv_forecast_duration_seconds', 'Time spent fitting/predicting', ['country', 'stage'])
+validation_rejected_total = Counter(
+    'cfv_validation_rejected_total', 'Scraped values rejected before upload', ['adapter', 'check'])
+worker_restarts_total = Counter(
+    'cfv_worker_restarts_total', 'Adapters/forecasters rebuilt, after a failure or a refresh', ['source', 'reason'])
+schedule_wait_seconds = Histogram(
+    'cfv_schedule_wait_seconds', 'Time jobs waited for a worker of their source', ['source', 'priority'])
+scrape_wait_seconds = Histogram(
+    'cfv_scrape_wait_seconds', 'Time scrapers waited on the rate limits of their source', ['source', 'limit'])
+
+
+class ScrapeOutcome:
+    '''
+    What track_scrape yields, hand it the scrape's result
+    '''
+
+    def __init__(self):
+        self.data = None
+
+    def returned(self, data):
+        self.data = data
+        return data
+
+
+@contextmanager
+def track_scrape(adapter: str, kind='latest'):
+    '''
+    Times a scrape and counts it as a failure if it raises, a success if
+    it returned data (see ScrapeOutcome) and skipped otherwise, e.g. a
+    source that isn't due yet. Only successes count as good scrapes
+    '''
+    began = time.perf_counter()
+    outcome = ScrapeOutcome()
+    try:
+        yield outcome
+    except BaseException:
+        scrape_seconds.observe(time.perf_counter() - began, adapter=adapter, kind=kind)
+        scrapes_total.inc(adapter=adapter, kind=kind, result='failure')
+        raise
+    scrape_seconds.observe(time.perf_counter() - began, adapter=adapter, kind=kind)
+    if not outcome.data:
+        scrapes_total.inc(adapter=adapter, kind=kind, result='skipped')
+        return
+    scrapes_total.inc(adapter=adapter, kind=kind, result='success')
+    now = time.time()
+    last_good_scrape.set(now, adapter=adapter)
+    seconds_since_good_scrape.set_function(lambda: time.time() - now, adapter=adapter)
+
+
+def record_upload(country: str, collection: str, written: int, skipped: int):
+    upload_writes_total.inc(written, country=country, collection=collection, result='written')
+    upload_writes_total.inc(skipped, country=country, collection=collection, result='skipped')
+
+
+def record_validation(adapter: str, report: dict):
+    from pipeline.validation import CHECKS
+    for check in CHECKS:
+        if report.get(check):
+            validation_rejected_total.inc(report[check], adapter=adapter, check=check)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scraped every few seconds, don't spam stdout
+        pass
+
+
+def serve(port=9108, host='127.0.0.1', registry=None) -> ThreadingHTTPServer:
+    '''
+    Serves /metrics on a daemon thread, returns the server (shutdown() to stop)
+
+    port 0 picks a free port, see server.server_address
+    '''
+    handler = MetricsHandler
+    if registry is not None:
+        handler = type('MetricsHandler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print("Metrics on http://%s:%d/metrics" % server.server_address[:2])
+    return server
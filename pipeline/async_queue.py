@@ -0,0 +1,118 @@
+'''
+asyncio version of the upload queue, for the asyncio manager runtime
+
+Producers are scrapes/forecasts running in executor threads, so put
+is thread safe and blocks the calling thread while the queue is full.
+Coroutines use put_async, the uploader awaits get_with_seq.
+'''
+from queue import Empty, Full
+import concurrent.futures
+import asyncio
+import time
+
+
+class AsyncUploadQueue:
+    '''
+    FIFO queue of (type, data) payloads waiting to be uploaded
+
+    Holds at most maxsize payloads, same as pipeline.upload_queue.UploadQueue.
+    With a spool every payload is journaled (on a worker thread) before
+    it's queued, and acked by the uploader once it's in the DB
+    '''
+
+    def __init__(self, maxsize=50, spool=None, loop=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.spool = spool
+        self.__loop = loop
+        self.__queue = None
+        self.__stats = {
+            'put': 0,
+            'got': 0,
+            'max_depth': 0,
+            # seconds producers spent waiting on a full queue
+            'put_wait': 0.0,
+            # seconds payloads spent in the queue before upload
+            'queue_wait': 0.0,
+            'max_queue_wait': 0.0
+        }
+
+    def bind(self, loop=None):
+        '''
+        Attaches the queue to an event loop (the running one by default)
+
+        Called from the loop before any producer thread uses put
+        '''
+        self.__loop = loop or asyncio.get_running_loop()
+        self.__queue = asyncio.Queue(self.maxsize)
+        return self
+
+    async def put_async(self, item, seq=None):
+        '''
+        Adds a payload from a coroutine, waits while the queue is full
+
+        seq is only given for payloads replayed from the spool
+        '''
+        if self.__queue is None:
+            self.bind()
+        if self.spool and seq is None:
+            seq = await asyncio.get_running_loop().run_in_executor(None, self.spool.append, item)
+        waited = time.monotonic()
+        await self.__queue.put((time.monotonic(), seq, item))
+        self.__stats['put_wait'] += time.monotonic() - waited
+        self.__stats['put'] += 1
+        self.__stats['max_depth'] = max(self.__stats['max_depth'], self.__queue.qsize())
+
+    def put(self, item, timeout=None, seq=None):
+        '''
+        Adds a payload from a worker thread, blocks it while the queue is full
+
+        Raises queue.Full if it couldn't be added in time
+        (a journaled payload will still be replayed on the next start)
+        '''
+        if self.__loop is None:
+            raise RuntimeError("bind the queue to a loop first")
+        future = asyncio.run_coroutine_threadsafe(self.put_async(item, seq), self.__loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise Full
+
+    # producers used to append to a plain list
+    append = put
+
+    async def get_with_seq(self, timeout=None) -> tuple:
+        '''
+        Waits for the payload at the front of the queue, returns (spool seq, payload)
+
+        Raises queue.Empty if nothing came in time
+        '''
+        if self.__queue is None:
+            self.bind()
+        try:
+            queued_at, seq, item = await asyncio.wait_for(self.__queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise Empty
+        wait = time.monotonic() - queued_at
+        self.__stats['got'] += 1
+        self.__stats['queue_wait'] += wait
+        self.__stats['max_queue_wait'] = max(self.__stats['max_queue_wait'], wait)
+        return (seq, item)
+
+    async def get(self, timeout=None):
+        return (await self.get_with_seq(timeout))[1]
+
+    def stats(self) -> dict:
+        '''
+        Depth and wait time statistics, times in seconds
+        '''
+        stats = dict(self.__stats)
+        stats['depth'] = len(self)
+        stats['avg_queue_wait'] = (
+            stats['queue_wait'] / stats['got'] if stats['got'] else 0.0)
+        return stats
+
+    def __len__(self):
+        return self.__queue.qsize() if self.__queue is not None else 0
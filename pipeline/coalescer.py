@@ -0,0 +1,94 @@
+'''
+Write coalescing between the upload queue and upload_sorter
+'''
+import threading
+import time
+
+
+class UploadCoalescer:
+    '''
+    Merges queued payloads so each hour key is written once per window
+
+    Pending entries are keyed by (type, hour key). Since the week doc
+    comes from the hour key, that's one slot per (collection, doc, hour).
+        - overwrite (forecasts): last writer wins
+        - otherwise (historic): first writer wins, like the DB
+
+    A flush is due once max_entries are pending or the oldest pending
+    entry has waited max_wait seconds
+    '''
+
+    def __init__(self, max_entries=2000, max_wait=30):
+        self.max_entries = max_entries
+        self.max_wait = max_wait
+        self.__pending = dict()
+        self.__count = 0
+        self.__oldest = None
+        self.__lock = threading.Lock()
+        self.__stats = {'added': 0, 'merged': 0, 'flushed': 0}
+
+    def add(self, data_type, entries: dict, overwrite=False):
+        '''
+        Adds the entries of one payload to the pending batch
+        '''
+        with self.__lock:
+            if not entries:
+                return
+            pending = self.__pending.setdefault(data_type, dict())
+            for key, value in entries.items():
+                if key in pending:
+                    self.__stats['merged'] += 1
+                    if not overwrite:
+                        continue
+                else:
+                    self.__count += 1
+                pending[key] = value
+            self.__stats['added'] += len(entries)
+            if self.__oldest is None:
+                self.__oldest = time.monotonic()
+
+    def ready(self) -> bool:
+        '''
+        True if the pending batch should be flushed now
+        '''
+        with self.__lock:
+            return self.__count > 0 and (
+                self.__count >= self.max_entries or
+                time.monotonic() - self.__oldest >= self.max_wait)
+
+    def time_until_flush(self, idle=1.0) -> float:
+        '''
+        Seconds until the window closes, at most idle
+        '''
+        with self.__lock:
+            if self.__oldest is None:
+                return idle
+            left = self.max_wait - (time.monotonic() - self.__oldest)
+            return min(max(left, 0.0), idle)
+
+    def flush(self) -> list:
+        '''
+        Takes everything that's pending
+
+        returns [(type, {hour key: value, ...}), ...]
+        '''
+        with self.__lock:
+            batch = list(self.__pending.items())
+            self.__stats['flushed'] += self.__count
+            self.__pending = dict()
+            self.__count = 0
+            self.__oldest = None
+            return batch
+
+    def stats(self) -> dict:
+        '''
+        Entries added, merged away and flushed so far
+        '''
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['pending'] = self.__count
+            return stats
+
+    def __len__(self):
+        with self.__lock:
+            return self.__count
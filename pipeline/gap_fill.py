@@ -0,0 +1,302 @@
+'''
+Plans and runs the historical scrapes that fill holes in the Historic data
+
+check_db used to ask for every missing week on its own, and each request
+started a thread with a brand new adapter (and browser). Here the missing
+hours are merged into as few requests as the source allows:
+    - Mexico publishes whole months, so one request per month
+    - the others are scraped a day at a time, so one request per run of
+      consecutive days (capped at max_days so a failure doesn't lose too much)
+and the requests go through one small thread pool. Every source has one
+backfill adapter, kept between requests and used by one of them at a
+time, so whichever threads run them a site never has more than that
+browser open next to its realtime one. With a PriorityScheduler they run
+as backfills on the pools of their sources instead, behind realtime
+scrapes and forecasts.
+
+With a LeaseKeeper (see database.leases) several nodes share the work:
+a request only runs on the node that leases all of its units, so no two
+nodes scrape the same days, and the others move on to the next request.
+
+With a RequestRegistry (see pipeline.request_registry) ranges already in
+flight, backing off or quarantined are left out of the plan, and runs of
+days that failed before are planned shorter each attempt (31, 15, 7, ...
+days) until the broken days are isolated and quarantined on their own.
+Days the site serves but validation would reject entirely fail too.
+'''
+from adapters.adapter_tasks import AdapterTypes, new_adapter
+from metrics import track_scrape
+from scheduler import BACKFILL
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import calendar
+import datetime
+import threading
+
+FillRequest = namedtuple('FillRequest', ['adapter_type', 'start', 'end'])
+FillRequest.__doc__ = '''
+Historical scrape of adapter_type from start to end (dates, both included)
+'''
+
+# 'month' sources get whole calendar months, 'day' sources runs of days
+GRANULARITY = {
+    AdapterTypes.Mexico: 'month',
+    AdapterTypes.Nicaragua: 'day',
+    AdapterTypes.Costa_Rica: 'day',
+    AdapterTypes.El_Salvador: 'day'
+}
+
+# longest run of days in one request
+MAX_DAYS = 31
+
+
+def missing_days(missing_ranges: list) -> list:
+    '''
+    Sorted dates touched by [(first missing datetime, last missing datetime), ...]
+    '''
+    days = set()
+    for first, last in missing_ranges:
+        day = first.date()
+        while day <= last.date():
+            days.add(day)
+            day += datetime.timedelta(days=1)
+    return sorted(days)
+
+
+def day_runs(days: list, max_days=MAX_DAYS, attempts=None) -> list:
+    '''
+    Sorted dates -> [(first, last), ...] runs of consecutive days,
+    none longer than max_days
+
+    attempts ({day: failed attempts}) halves the length of runs
+    holding that day for every failure
+    '''
+    attempts = attempts or dict()
+    runs = []
+    for day in days:
+        cap = max(1, max_days >> attempts.get(day, 0))
+        if runs:
+            first, last, run_cap = runs[-1]
+            if day == last + datetime.timedelta(days=1) and (day - first).days < min(cap, run_cap):
+                runs[-1] = (first, day, min(cap, run_cap))
+                continue
+        runs.append((day, day, cap))
+    return [(first, last) for first, last, _ in runs]
+
+
+def month_runs(days: list) -> list:
+    '''
+    Sorted dates -> [(first of month, last of month), ...] for each month they touch
+    '''
+    months = []
+    for day in days:
+        first = day.replace(day=1)
+        if not months or months[-1][0] != first:
+            last = day.replace(day=calendar.monthrange(day.year, day.month)[1])
+            months.append((first, last))
+    return months
+
+
+def units(request: FillRequest) -> list:
+    '''
+    What a request covers in RequestRegistry terms: its days, or its
+    months (as their first day) for month sources
+    '''
+    adapter_type, start, end = request
+    days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+    if GRANULARITY.get(adapter_type, 'day') == 'month':
+        return [first for first, _ in month_runs(days)]
+    return days
+
+
+def lease_keys(request: FillRequest) -> list:
+    '''
+    Keys leased while a request runs, one per unit
+    '''
+    return ['fill/%s/%s' % (request.adapter_type.name, unit.isoformat()) for unit in units(request)]
+
+
+def plan(adapter_type: AdapterTypes, missing_ranges: list, max_days=MAX_DAYS, registry=None) -> list:
+    '''
+    Fewest FillRequests that cover the missing hour ranges of a source
+    (see CoverageIndex.missing_ranges)
+
+    With a registry, only ranges that can be requested right now are planned
+    '''
+    days = missing_days(missing_ranges)
+    if GRANULARITY.get(adapter_type, 'day') == 'month':
+        runs = month_runs(days)
+        if registry:
+            allowed = set(registry.available(adapter_type.name, [first for first, _ in runs]))
+            runs = [run for run in runs if run[0] in allowed]
+    else:
+        attempts = None
+        if registry:
+            days = registry.available(adapter_type.name, days)
+            attempts = {day: registry.attempts(adapter_type.name, day) for day in days}
+        runs = day_runs(days, max_days, attempts)
+    return [FillRequest(adapter_type, first, last) for first, last in runs]
+
+
+class GapFiller:
+    '''
+    Runs FillRequests on a bounded pool and queues what they scrape
+
+    queue is anything with a thread safe put((type, data)),
+    e.g. UploadQueue or AsyncUploadQueue
+
+    With a registry, requests overlapping one in flight (or backing off,
+    quarantined) are dropped, and outcomes are recorded there. A scrape
+    that returns nothing counts as a failure, and so do the units holding
+    a day rejected_days(type, data) returns (days whose every hour
+    validation would drop)
+
+    With a scheduler (see scheduler.PriorityScheduler) requests are
+    backfills on their source's pool, and `workers` is unused
+
+    With leases, a request whose units another node holds is skipped
+    (resolves to None), and what's scraped is only queued if the leases
+    are still ours. Finished units stay leased for linger seconds so
+    other nodes don't redo them before their coverage catches up
+    '''
+
+    def __init__(self, queue, workers=2, adapter_factory=new_adapter, registry=None, scheduler=None,
+                 leases=None, linger=60 * 60, rejected_days=None):
+        self.queue = queue
+        self.registry = registry
+        self.rejected_days = rejected_days
+        self.scheduler = scheduler
+        self.leases = leases
+        self.linger = linger
+        self.__adapter_factory = adapter_factory
+        self.__executor = None
+        # requests on the executor that haven't finished
+        self.__pending = set()
+        self.__pending_lock = threading.Lock()
+        if scheduler is None:
+            self.__executor = ThreadPoolExecutor(workers, thread_name_prefix='gap-fill')
+        # the backfill adapter of each type, and a lock per type to use it
+        self.__adapters = dict()
+        self.__adapter_locks = dict()
+        self.__adapters_lock = threading.Lock()
+
+    def submit(self, request: FillRequest):
+        '''
+        Schedules a request, returns its Future (resolves to the hours
+        queued, None if another node had it leased)
+
+        returns None if the registry or the scheduler turned it down
+        '''
+        if self.registry and not self.registry.claim(request.adapter_type.name, units(request)):
+            return None
+        if self.scheduler is None:
+            future = self.__executor.submit(self.__fill, request)
+            with self.__pending_lock:
+                self.__pending.add(future)
+            future.add_done_callback(self.__done)
+            return future
+        future = self.scheduler.submit(request.adapter_type, BACKFILL, self.__fill, request)
+        if future is None and self.registry:
+            self.registry.unclaim(request.adapter_type.name, units(request))
+        return future
+
+    def submit_all(self, requests: list) -> list:
+        futures = [self.submit(request) for request in requests]
+        return [future for future in futures if future is not None]
+
+    def shutdown(self, wait=True):
+        # a scheduler is shut down by its owner
+        if self.__executor:
+            # requests that haven't started are dropped (cancel_futures is 3.9+)
+            with self.__pending_lock:
+                pending = list(self.__pending)
+            for future in pending:
+                future.cancel()
+            self.__executor.shutdown(wait=wait)
+
+    def __done(self, future):
+        with self.__pending_lock:
+            self.__pending.discard(future)
+
+    def __adapter_lock(self, adapter_type: AdapterTypes) -> threading.Lock:
+        with self.__adapters_lock:
+            return self.__adapter_locks.setdefault(adapter_type, threading.Lock())
+
+    def __adapter(self, adapter_type: AdapterTypes):
+        '''
+        The type's backfill adapter, only call it holding its __adapter_lock
+        '''
+        if adapter_type not in self.__adapters:
+            self.__adapters[adapter_type] = self.__adapter_factory(adapter_type)
+        return self.__adapters[adapter_type]
+
+    def __fill(self, request: FillRequest) -> int:
+        leased = None
+        if self.leases:
+            leased = self.leases.acquire(lease_keys(request))
+            if leased is None:
+                if self.registry:
+                    self.registry.unclaim(request.adapter_type.name, units(request))
+                return None
+        try:
+            filled = self.__scrape(request, leased)
+        except BaseException:
+            if leased:
+                self.leases.release(leased)
+            raise
+        if leased:
+            self.leases.release(leased, self.linger if filled else 0)
+        return filled
+
+    def __scrape(self, request: FillRequest, leased: list) -> int:
+        adapter_type, start, end = request
+        with self.__adapter_lock(adapter_type):
+            try:
+                adapter = self.__adapter(adapter_type)
+                with track_scrape(adapter_type.name, 'history') as scrape:
+                    data = scrape.returned(adapter.scrape_history(
+                        start_day=start.day, start_month=start.month,
+                        start_year=start.year, end_day=end.day,
+                        end_month=end.month, end_year=end.year))
+            except Exception as e:
+                # the adapter (or its browser) may be broken, start over next time
+                self.__adapters.pop(adapter_type, None)
+                print("FAILED", start, "to", end, "ADAPTER:", adapter_type, e)
+                self.__record(request, repr(e))
+                return 0
+        if not data:
+            self.__record(request, 'no data')
+            return 0
+        if leased and not self.leases.valid(leased):
+            # stalled past the ttl, another node may be on it by now
+            print("Lost the lease on", start, "to", end, "ADAPTER:", adapter_type, "dropping it")
+            if self.registry:
+                self.registry.unclaim(adapter_type.name, units(request))
+            return 0
+        self.queue.put((adapter_type, data))
+        if self.registry and self.rejected_days:
+            rejected = set()
+            for day in self.rejected_days(adapter_type, data):
+                rejected.update(units(FillRequest(adapter_type, day, day)))
+            self.__record(request, rejected=rejected)
+        else:
+            self.__record(request)
+        return len(data)
+
+    def __record(self, request: FillRequest, failure=None, rejected=()):
+        '''
+        failure fails all of the request's units, otherwise only the rejected ones
+        '''
+        if not self.registry:
+            return
+        source = request.adapter_type.name
+        failed = units(request)
+        if failure is None:
+            failed = [unit for unit in failed if unit in rejected]
+            self.registry.succeeded(source, [unit for unit in units(request) if unit not in rejected])
+            failure = 'rejected by validation'
+        if failed:
+            quarantined = self.registry.failed(source, failed, failure)
+            if quarantined:
+                print("Quarantined", source, [unit.isoformat() for unit in quarantined])
+        self.registry.save()
@@ -0,0 +1,284 @@
+'''
+Runs adapters in worker processes instead of threads
+
+Parsing (BeautifulSoup), the pandas groupbys and the adapters' filter
+loops are CPU bound, so in threads of one interpreter a multi-country
+backfill takes turns on the GIL. With a ProcessPool every adapter call
+runs in one of `workers` processes, each keeping its own adapters (and
+browsers) by type. Only the filtered {epoch hour: entries} dict comes
+back to this process, never the pages or the frames.
+
+ProcessPool.adapter(type) is a drop in adapter_factory: it returns a
+ProcessAdapter that forwards calls to the pool.
+    - realtime calls (set_last_scraped_date, scrape_new_data) of a type
+      always go to the same process (its home), where its last scrape
+      date lives
+    - scrape_history goes to whichever other process has the fewest
+      calls pending, so a backfill never holds up the realtime scrape
+      (each worker runs one call at a time)
+Realtime and history calls never share an adapter, even in a pool of
+one worker. A call that raises drops that process's adapter, the next
+call builds a new one (like a fresh adapter in thread mode).
+
+Workers are spawned, not forked, since the parent has threads (and
+browsers) running. Spawned workers import the main script again: for
+manager that redoes its module level setup in every worker (storage,
+the coverage indexes, the gap fill registry, the lease keeper and the
+validator), which slows their start up but starts or writes nothing.
+main() and everything it starts is behind __main__.
+
+Compare thread and process mode on a four-country backfill with:
+    python -m pipeline.processes
+'''
+from adapters.scraper_adapter import ScraperAdapter
+from adapters import adapter_tasks
+from adapters.adapter_tasks import AdapterTypes, new_adapter
+from forecast.timekeys import epoch_hour
+from scrapers import rate_limit
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import datetime
+import random
+import time
+
+# adapters of this worker process, by (type, 'realtime'/'history')
+_adapters = dict()
+
+
+def _start_worker(paths, limits):
+    if paths:
+        adapter_tasks.ADAPTER_PATHS.update(paths)
+    if limits:
+        rate_limit.configure(limits)
+
+
+def _call(adapter_type: AdapterTypes, role: str, method: str, args: tuple, kwargs: dict):
+    '''
+    adapter.method(*args, **kwargs) on this process's adapter of the type and role
+    '''
+    key = (adapter_type, role)
+    adapter = _adapters.get(key)
+    if adapter is None:
+        adapter = _adapters[key] = new_adapter(adapter_type)
+    try:
+        if role == 'realtime':
+            with rate_limit.realtime():
+                return getattr(adapter, method)(*args, **kwargs)
+        return getattr(adapter, method)(*args, **kwargs)
+    except Exception:
+        # the adapter (or its browser) may be broken, start over next time
+        _adapters.pop(key, None)
+        raise
+
+
+class ProcessPool:
+
+    def __init__(self, workers=4, paths=None, limits=None):
+        '''
+        paths overrides ADAPTER_PATHS in the workers ({type: (module, class)})
+
+        limits override the sources' default scrape limits (see
+        scrapers.rate_limit), the result is split between the workers
+        '''
+        context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        limits = rate_limit.split(rate_limit.with_defaults(limits), workers)
+        # one single process executor per worker, so calls can be pinned to one
+        self.__executors = [
+            ProcessPoolExecutor(1, mp_context=context, initializer=_start_worker,
+                                initargs=(paths, limits))
+            for _ in range(workers)
+        ]
+        self.__lock = threading.Lock()
+        self.__pending = [0] * workers
+        # calls submitted and not done yet
+        self.__futures = set()
+
+    def adapter(self, adapter_type: AdapterTypes) -> 'ProcessAdapter':
+        return ProcessAdapter(self, adapter_type)
+
+    def home(self, adapter_type: AdapterTypes) -> int:
+        '''
+        The worker that runs a type's realtime calls
+        '''
+        return list(AdapterTypes).index(adapter_type) % self.workers
+
+    def worker_for(self, adapter_type: AdapterTypes, realtime=False) -> int:
+        '''
+        The type's home if realtime, else the least busy other worker
+        (the home too only if it's the only one)
+        '''
+        home = self.home(adapter_type)
+        if realtime:
+            return home
+        others = [worker for worker in range(self.workers) if worker != home] or [home]
+        with self.__lock:
+            return min(others, key=self.__pending.__getitem__)
+
+    def call(self, adapter_type: AdapterTypes, method: str, *args, realtime=False, **kwargs):
+        '''
+        Runs the adapter method on worker_for's worker, blocks until it's
+        done and returns its result
+        '''
+        worker = self.worker_for(adapter_type, realtime)
+        with self.__lock:
+            self.__pending[worker] += 1
+        future = None
+        try:
+            future = self.__executors[worker].submit(
+                _call, adapter_type, 'realtime' if realtime else 'history', method, args, kwargs)
+            with self.__lock:
+                self.__futures.add(future)
+            return future.result()
+        finally:
+            with self.__lock:
+                self.__pending[worker] -= 1
+                self.__futures.discard(future)
+
+    def warm_up(self):
+        '''
+        Starts every worker process (spawning them takes a while)
+        '''
+        for executor in self.__executors:
+            executor.submit(int).result()
+
+    def shutdown(self, wait=True):
+        # calls that haven't started are dropped (cancel_futures is 3.9+)
+        with self.__lock:
+            futures = list(self.__futures)
+        for future in futures:
+            future.cancel()
+        for executor in self.__executors:
+            executor.shutdown(wait=wait)
+
+
+class ProcessAdapter(ScraperAdapter):
+    '''
+    An adapter whose calls run on a ProcessPool
+    '''
+
+    def __init__(self, pool: ProcessPool, adapter_type: AdapterTypes):
+        self.pool = pool
+        self.adapter_type = adapter_type
+        self.__frequency = None
+
+    def set_last_scraped_date(self, date: datetime.datetime):
+        self.pool.call(self.adapter_type, 'set_last_scraped_date', date, realtime=True)
+
+    def scrape_history(self, **dates) -> dict:
+        return self.pool.call(self.adapter_type, 'scrape_history', **dates)
+
+    def scrape_new_data(self) -> dict:
+        return self.pool.call(self.adapter_type, 'scrape_new_data', realtime=True)
+
+    def frequency(self) -> int:
+        if self.__frequency is None:
+            self.__frequency = self.pool.call(self.adapter_type, 'frequency', realtime=True)
+        return self.__frequency
+
+
+class BenchmarkAdapter(ScraperAdapter):
+    '''
+    Does what the real adapters do with a day of data (parse a page, group
+    it with pandas, filter it hour by hour) without the network
+    '''
+    TYPES = ['Hydro', 'Thermal', 'Wind', 'Solar', 'Geothermal', 'Biomass']
+
+    def __init__(self):
+        self.__random = random.Random(0)
+
+    def set_last_scraped_date(self, date):
+        pass
+
+    def scrape_new_data(self) -> dict:
+        return dict()
+
+    def frequency(self) -> int:
+        return 60 * 60
+
+    def scrape_history(self, start_year, start_month, start_day, end_year, end_month, end_day) -> dict:
+        from bs4 import BeautifulSoup
+        import pandas as pd
+        day = datetime.datetime(start_year, start_month, start_day)
+        end = datetime.datetime(end_year, end_month, end_day)
+        buffer = dict()
+        while day <= end:
+            soup = BeautifulSoup(self.__page(day), 'html.parser')
+            rows = [
+                [cell.get_text() for cell in row.find_all('td')] for row in soup.find_all('tr')
+            ]
+            frame = pd.DataFrame(rows, columns=['ts', 'meta', 'plant', 'value'])
+            frame['ts'] = pd.to_datetime(frame['ts'])
+            frame['value'] = frame['value'].astype(float)
+            frame = frame.groupby(['ts', 'meta'])['value'].agg('sum').reset_index()
+            for i in range(0, len(frame), len(self.TYPES)):
+                entries = [
+                    {'value': frame.iat[i + j, 2], 'type': frame.iat[i + j, 1]}
+                    for j in range(len(self.TYPES))
+                ]
+                buffer[epoch_hour(frame.iat[i, 0].to_pydatetime(), 'America/Managua')] = entries
+            day += datetime.timedelta(days=1)
+        return buffer
+
+    def __page(self, day: datetime.datetime) -> str:
+        # 24 hours x 6 types x 5 plants
+        rows = []
+        for hour in range(24):
+            ts = (day + datetime.timedelta(hours=hour)).isoformat()
+            for kind in self.TYPES:
+                for plant in range(5):
+                    rows.append('<tr><td>%s</td><td>%s</td><td>P%d</td><td>%.2f</td></tr>' % (
+                        ts, kind, plant, self.__random.random() * 100))
+        return '<table>%s</table>' % ''.join(rows)
+
+
+def main():
+    from pipeline.gap_fill import GapFiller, FillRequest
+
+    class Queue:
+        def __init__(self):
+            self.hours = 0
+
+        def put(self, item):
+            self.hours += len(item[1])
+
+    workers = 4
+    days = 10
+    paths = {adapter_type: (__name__, 'BenchmarkAdapter') for adapter_type in AdapterTypes}
+    # four countries, a request per day each
+    requests = [
+        FillRequest(adapter_type, datetime.date(2019, 1, 1) + datetime.timedelta(days=day),
+                    datetime.date(2019, 1, 1) + datetime.timedelta(days=day))
+        for day in range(days) for adapter_type in AdapterTypes
+    ]
+
+    def run(adapter_factory) -> tuple:
+        queue = Queue()
+        filler = GapFiller(queue, workers, adapter_factory=adapter_factory)
+        began = time.perf_counter()
+        for future in filler.submit_all(requests):
+            future.result()
+        elapsed = time.perf_counter() - began
+        filler.shutdown()
+        return elapsed, queue.hours
+
+    thread_time, thread_hours = run(lambda adapter_type: BenchmarkAdapter())
+
+    began = time.perf_counter()
+    pool = ProcessPool(workers, paths)
+    pool.warm_up()
+    spawn_time = time.perf_counter() - began
+    process_time, process_hours = run(pool.adapter)
+    pool.shutdown()
+
+    assert thread_hours == process_hours == 24 * days * len(AdapterTypes)
+    print(len(requests), 'day requests over', len(AdapterTypes), 'countries,', workers, 'workers,',
+          multiprocessing.cpu_count(), 'cpus')
+    print('threads:  ', round(thread_time, 2), 's')
+    print('processes:', round(process_time, 2), 's (plus', round(spawn_time, 2), 's spawning them)')
+    print(round(thread_time / process_time, 2), 'times faster')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+'''
+Remembers which historical ranges are being scraped or keep failing
+
+Ranges are tracked per unit of a source (a day, or a month for sources
+that publish months, see pipeline.gap_fill.units). A unit is either:
+    - in flight: a request covering it is running, nobody else asks for it
+    - backing off: its last request failed, it waits base * 2^(attempts-1)
+      seconds (up to max_backoff) before it's asked for again
+    - quarantined: failed max_attempts times (or known to be broken),
+      never asked for again until released
+Failures and quarantines are saved to a JSON file so they survive restarts.
+'''
+import datetime
+import json
+import os
+import threading
+import time
+
+
+class RequestRegistry:
+
+    def __init__(self, path=None, base_backoff=60 * 60, max_backoff=7 * 24 * 60 * 60,
+                 max_attempts=6, clock=time.time):
+        self.path = path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # {(source, unit)}
+        self.__in_flight = set()
+        # {(source, unit): {'attempts', 'next', 'quarantined', 'reason'}}
+        self.__failures = dict()
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        '''
+        Registry saved at path, or an empty one that will save there
+        '''
+        registry = cls(path, **kwargs)
+        if os.path.isfile(path):
+            with open(path) as file:
+                saved = json.load(file)
+            for source, units in saved.items():
+                for unit, record in units.items():
+                    registry.__failures[(source, datetime.date.fromisoformat(unit))] = record
+        return registry
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self.__lock:
+            saved = dict()
+            for (source, unit), record in self.__failures.items():
+                saved.setdefault(source, dict())[unit.isoformat()] = record
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp = path + '.tmp'
+        with open(temp, 'w') as file:
+            json.dump(saved, file, indent=1, sort_keys=True)
+        os.replace(temp, path)
+
+    def state(self, source: str, unit: datetime.date) -> str:
+        '''
+        'in flight', 'backoff', 'quarantined' or None if it can be requested
+        '''
+        with self.__lock:
+            return self.__state((source, unit), self.__clock())
+
+    def attempts(self, source: str, unit: datetime.date) -> int:
+        with self.__lock:
+            return self.__failures.get((source, unit), {}).get('attempts', 0)
+
+    def available(self, source: str, units) -> list:
+        '''
+        The units that can be requested right now
+        '''
+        with self.__lock:
+            now = self.__clock()
+            return [unit for unit in units if self.__state((source, unit), now) is None]
+
+    def claim(self, source: str, units) -> bool:
+        '''
+        Marks units in flight, if all of them can be requested
+        '''
+        units = list(units)
+        with self.__lock:
+            now = self.__clock()
+            if any(self.__state((source, unit), now) for unit in units):
+                return False
+            self.__in_flight.update((source, unit) for unit in units)
+            return True
+
+    def unclaim(self, source: str, units):
+        '''
+        Takes units out of flight without recording an outcome
+        '''
+        with self.__lock:
+            for unit in units:
+                self.__in_flight.discard((source, unit))
+
+    def succeeded(self, source: str, units):
+        with self.__lock:
+            for unit in units:
+                self.__in_flight.discard((source, unit))
+                self.__failures.pop((source, unit), None)
+
+    def failed(self, source: str, units, reason=None):
+        '''
+        Backs the units off, quarantines those out of attempts
+
+        returns the units that got quarantined
+        '''
+        quarantined = []
+        with self.__lock:
+            now = self.__clock()
+            for unit in units:
+                self.__in_flight.discard((source, unit))
+                record = self.__failures.setdefault(
+                    (source, unit), {'attempts': 0, 'next': 0, 'quarantined': False, 'reason': None})
+                record['attempts'] += 1
+                record['reason'] = reason
+                if record['attempts'] >= self.max_attempts:
+                    record['quarantined'] = True
+                    quarantined.append(unit)
+                else:
+                    delay = self.base_backoff * 2 ** (record['attempts'] - 1)
+                    record['next'] = now + min(delay, self.max_backoff)
+        return quarantined
+
+    def quarantine(self, source: str, units, reason=None):
+        '''
+        Stops units from being requested, e.g. ranges known to be broken at the source
+        '''
+        with self.__lock:
+            for unit in units:
+                record = self.__failures.setdefault(
+                    (source, unit), {'attempts': 0, 'next': 0, 'quarantined': False, 'reason': None})
+                record['quarantined'] = True
+                record['reason'] = reason
+
+    def release(self, source: str, units):
+        '''
+        Forgets failures/quarantine so the units are requested again
+        '''
+        with self.__lock:
+            for unit in units:
+                self.__failures.pop((source, unit), None)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            now = self.__clock()
+            stats = {'in flight': 0, 'backoff': 0, 'quarantined': 0}
+            for key in self.__in_flight | set(self.__failures):
+                state = self.__state(key, now)
+                if state:
+                    stats[state] += 1
+            return stats
+
+    def __state(self, key: tuple, now: float) -> str:
+        if key in self.__in_flight:
+            return 'in flight'
+        record = self.__failures.get(key)
+        if record is None:
+            return None
+        if record['quarantined']:
+            return 'quarantined'
+        if now < record['next']:
+            return 'backoff'
+        return None
@@ -0,0 +1,171 @@
+'''
+Write-ahead journal for payloads waiting to be uploaded
+
+Every payload is written to disk before the producer moves on and
+only dropped once the uploader acks it, so a crash or a DB outage
+never loses a scrape. Anything not acked is replayed on the next start
+'''
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# kind, sequence number, data length, crc32 of data
+RECORD_HEADER = struct.Struct('<BQII')
+PAYLOAD = 0
+ACK = 1
+
+SEGMENT_FORMAT = 'segment_%08d.log'
+
+
+class UploadSpool:
+    '''
+    Append-only journal split into segment files
+
+    Records are either a pickled payload or an ack of one. Once the
+    active segment grows past segment_size and is more than twice the
+    size of the payloads still unacked, it's rotated: those payloads get
+    copied into the new segment and the old segments are deleted. A big
+    backlog is then only copied again after as much has been written.
+    '''
+
+    def __init__(self, directory: str, segment_size=16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__next_seq = 0
+        # seq -> bytes of its payload record
+        self.__unacked = dict()
+        self.__live_bytes = 0
+        self.__segment = None
+        self.__segment_number = 0
+        self.__replay = []
+        with self.__lock:
+            survivors = self.__recover()
+            self.__replay = sorted(survivors.items())
+            self.__rotate(survivors)
+
+    def append(self, item) -> int:
+        '''
+        Durably records a payload
+
+        returns its sequence number, needed to ack it later
+        '''
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            seq = self.__next_seq
+            self.__next_seq += 1
+            self.__write(PAYLOAD, seq, data)
+            os.fsync(self.__segment.fileno())
+            self.__unacked[seq] = RECORD_HEADER.size + len(data)
+            self.__live_bytes += self.__unacked[seq]
+            self.__maybe_rotate()
+        return seq
+
+    def ack(self, seq: int):
+        '''
+        Marks a payload as uploaded so it won't be replayed
+        '''
+        with self.__lock:
+            if seq not in self.__unacked:
+                return
+            self.__write(ACK, seq, b'')
+            self.__live_bytes -= self.__unacked.pop(seq)
+            self.__maybe_rotate()
+
+    def replay(self) -> list:
+        '''
+        Payloads left unacked by the last run, oldest first
+
+        returns [(seq, item), ...] once, then an empty list
+        '''
+        with self.__lock:
+            replay, self.__replay = self.__replay, []
+        return [(seq, pickle.loads(data)) for seq, data in replay]
+
+    def pending(self) -> int:
+        with self.__lock:
+            return len(self.__unacked)
+
+    def close(self):
+        with self.__lock:
+            if self.__segment:
+                self.__segment.flush()
+                os.fsync(self.__segment.fileno())
+                self.__segment.close()
+                self.__segment = None
+
+    def __segment_paths(self) -> list:
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith('segment_') and name.endswith('.log'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def __recover(self) -> dict:
+        '''
+        Reads every segment and returns the unacked payloads {seq: data}
+        '''
+        payloads = dict()
+        acked = set()
+        for path in self.__segment_paths():
+            number = int(os.path.basename(path)[8:-4])
+            self.__segment_number = max(self.__segment_number, number)
+            for kind, seq, data in self.__read_segment(path):
+                self.__next_seq = max(self.__next_seq, seq + 1)
+                if kind == PAYLOAD:
+                    payloads[seq] = data
+                else:
+                    acked.add(seq)
+        for seq in acked:
+            payloads.pop(seq, None)
+        self.__unacked = {seq: RECORD_HEADER.size + len(data) for seq, data in payloads.items()}
+        self.__live_bytes = sum(self.__unacked.values())
+        return payloads
+
+    def __read_segment(self, path: str):
+        with open(path, 'rb') as file:
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                kind, seq, length, crc = RECORD_HEADER.unpack(header)
+                data = file.read(length)
+                # a crash mid write leaves a torn record at the tail
+                if len(data) < length or zlib.crc32(data) != crc:
+                    return
+                yield kind, seq, data
+
+    def __write(self, kind: int, seq: int, data: bytes):
+        self.__segment.write(RECORD_HEADER.pack(kind, seq, len(data), zlib.crc32(data)))
+        self.__segment.write(data)
+        self.__segment.flush()
+
+    def __maybe_rotate(self):
+        size = self.__segment.tell()
+        if size >= self.segment_size and size > 2 * self.__live_bytes:
+            survivors = dict()
+            for path in self.__segment_paths():
+                for kind, seq, data in self.__read_segment(path):
+                    if kind == PAYLOAD and seq in self.__unacked:
+                        survivors[seq] = data
+            self.__rotate(survivors)
+
+    def __rotate(self, survivors: dict):
+        '''
+        Starts a new segment holding only the survivors and deletes the old ones
+        '''
+        old_paths = self.__segment_paths()
+        if self.__segment:
+            self.__segment.close()
+        self.__segment_number += 1
+        path = os.path.join(self.directory, SEGMENT_FORMAT % self.__segment_number)
+        self.__segment = open(path, 'ab')
+        for seq in sorted(survivors):
+            self.__write(PAYLOAD, seq, survivors[seq])
+        os.fsync(self.__segment.fileno())
+        # survivors are safe in the new segment before anything is removed
+        for old_path in old_paths:
+            if old_path != path:
+                os.remove(old_path)
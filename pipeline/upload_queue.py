@@ -0,0 +1,152 @@
+'''
+Bounded queue between the adapters/forecasters and the uploader
+'''
+from queue import Empty, Full
+import collections
+import itertools
+import os
+import pickle
+import threading
+import time
+
+
+class UploadQueue:
+    '''
+    FIFO queue of (type, data) payloads waiting to be uploaded
+
+    Holds at most maxsize payloads in memory. When it's full,
+    put either blocks the producer (default) or, if a spill_dir is
+    given, pickles the payload to disk until the uploader catches up.
+    Order is kept either way.
+
+    get blocks until there is something to upload, so the uploader
+    never has to poll
+
+    With a spool (see pipeline.spool) every payload is journaled before
+    put returns. The uploader gets its sequence number with get_with_seq
+    and acks it on the spool once it's written to the DB
+    '''
+
+    def __init__(self, maxsize=50, spill_dir=None, spool=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir
+        self.spool = spool
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.__items = collections.deque()
+        self.__spilled = collections.deque()
+        self.__spill_ids = itertools.count()
+        self.__cond = threading.Condition()
+        self.__stats = {
+            'put': 0,
+            'got': 0,
+            'spilled': 0,
+            'max_depth': 0,
+            # seconds producers spent blocked on a full queue
+            'put_wait': 0.0,
+            # seconds payloads spent in the queue before upload
+            'queue_wait': 0.0,
+            'max_queue_wait': 0.0
+        }
+
+    def put(self, item, block=True, timeout=None, seq=None):
+        '''
+        Adds a payload to the back of the queue
+
+        seq is only given for payloads replayed from the spool,
+        which are already journaled
+
+        Raises queue.Full if it couldn't be added in time
+        (a journaled payload will still be replayed on the next start)
+        '''
+        if self.spool and seq is None:
+            seq = self.spool.append(item)
+        with self.__cond:
+            if self.__is_full() and self.spill_dir:
+                self.__spill(seq, item)
+            else:
+                if self.__is_full():
+                    if not block:
+                        raise Full
+                    waited = time.monotonic()
+                    ready = self.__cond.wait_for(
+                        lambda: not self.__is_full(), timeout)
+                    self.__stats['put_wait'] += time.monotonic() - waited
+                    if not ready:
+                        raise Full
+                self.__items.append((time.monotonic(), seq, item))
+            self.__stats['put'] += 1
+            self.__stats['max_depth'] = max(self.__stats['max_depth'], self.__depth())
+            self.__cond.notify_all()
+
+    # producers used to append to a plain list
+    append = put
+
+    def get(self, block=True, timeout=None):
+        '''
+        Takes the payload at the front of the queue
+
+        Raises queue.Empty if nothing came in time
+        '''
+        return self.get_with_seq(block, timeout)[1]
+
+    def get_with_seq(self, block=True, timeout=None) -> tuple:
+        '''
+        Same as get, but returns (spool seq, payload)
+
+        seq is None when there's no spool
+        '''
+        with self.__cond:
+            if not self.__items:
+                if not block:
+                    raise Empty
+                if not self.__cond.wait_for(lambda: self.__items, timeout):
+                    raise Empty
+            queued_at, seq, item = self.__items.popleft()
+            self.__unspill()
+            wait = time.monotonic() - queued_at
+            self.__stats['got'] += 1
+            self.__stats['queue_wait'] += wait
+            self.__stats['max_queue_wait'] = max(self.__stats['max_queue_wait'], wait)
+            self.__cond.notify_all()
+            return (seq, item)
+
+    def stats(self) -> dict:
+        '''
+        Depth and wait time statistics, times in seconds
+        '''
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats['depth'] = self.__depth()
+            stats['spilled_depth'] = len(self.__spilled)
+            stats['avg_queue_wait'] = (
+                stats['queue_wait'] / stats['got'] if stats['got'] else 0.0)
+            return stats
+
+    def __len__(self):
+        with self.__cond:
+            return self.__depth()
+
+    def __depth(self) -> int:
+        return len(self.__items) + len(self.__spilled)
+
+    def __is_full(self) -> bool:
+        # anything on disk has to go out first to keep the order
+        return len(self.__items) >= self.maxsize or bool(self.__spilled)
+
+    def __spill(self, seq, item):
+        path = os.path.join(
+            self.spill_dir, 'upload_%d_%d.pickle' % (os.getpid(), next(self.__spill_ids)))
+        with open(path, 'wb') as file:
+            pickle.dump((time.monotonic(), seq, item), file)
+        self.__spilled.append(path)
+        self.__stats['spilled'] += 1
+
+    def __unspill(self):
+        while self.__spilled and len(self.__items) < self.maxsize:
+            path = self.__spilled.popleft()
+            with open(path, 'rb') as file:
+                self.__items.append(pickle.load(file))
+            os.remove(path)
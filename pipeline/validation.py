@@ -0,0 +1,215 @@
+'''
+Checks scraped batches before they're written
+
+Runs on whole coalesced batches ({epoch hour or hour key: [{'value', 'type'}, ...]})
+with NumPy, one pass per check:
+    - duplicate: the same type twice in one hour, the last one is kept
+      (Mexico repeats hour 0 and the first copy is usually an outlier)
+    - invalid: values that aren't finite numbers
+    - negative: below zero for anything but interchange/interconnection
+    - scale: a value scale_factor times the type's rolling baseline, or a
+      whole batch of a type that far off from its history (wrong units,
+      the README's "1000 times smaller" plants)
+    - jump: jump_factor between consecutive hours of a type where the
+      step is also big next to the baseline (small values at dawn pass)
+Rejected entries are dropped. An hour left with nothing is dropped too
+(an empty hour would be stored for good), so it stays missing: gap
+filling asks for it again, and with a RequestRegistry days whose hours
+are all rejected count as failed (backed off, then quarantined).
+
+The baseline of a type is the median of its last `window` accepted
+non-zero values plus the batch's own.
+
+Measure the cost per hour with:
+    python -m pipeline.validation
+'''
+from database.coverage_index import parse_hour_keys
+from forecast.timekeys import is_epoch
+import numpy as np
+import threading
+import time
+
+CHECKS = ('duplicate', 'invalid', 'negative', 'scale', 'jump')
+
+# types that can legitimately go negative (power flowing out of the country)
+SIGNED_TYPES = ('interchange', 'interconnection')
+
+
+def is_signed(type_name: str) -> bool:
+    name = str(type_name).lower()
+    return any(signed in name for signed in SIGNED_TYPES)
+
+
+class BatchValidator:
+    '''
+    Validates batches per source, keeping a rolling baseline per (source, type)
+    '''
+
+    def __init__(self, window=24 * 28, scale_factor=100.0, jump_factor=50.0, min_history=24):
+        self.window = window
+        self.scale_factor = scale_factor
+        self.jump_factor = jump_factor
+        # values needed before a whole batch is compared against history
+        self.min_history = min_history
+        self.__history = dict()
+        self.__lock = threading.Lock()
+
+    def baseline(self, source: str, type_name: str) -> float:
+        '''
+        Median of the accepted history of a type, NaN if there's none
+        '''
+        with self.__lock:
+            history = self.__history.get((source, type_name))
+        return float(np.median(history)) if history is not None and len(history) else float('nan')
+
+    def validate(self, source: str, entries: dict, learn=True) -> tuple:
+        '''
+        returns (entries without rejected values, {'hours', 'entries', check: rejected, ...})
+
+        Accepted values join the baselines only if learn
+
+        An hour whose values were all rejected is left out, an empty hour
+        would be stored for good and never asked for again
+        '''
+        keys = list(entries)
+        counts = np.fromiter((len(entries[key] or ()) for key in keys), dtype=np.int64, count=len(keys))
+        report = {'hours': len(keys), 'entries': int(counts.sum())}
+        report.update((check, 0) for check in CHECKS)
+        if not report['entries']:
+            return dict(entries), report
+        items = [item for key in keys for item in entries[key] or ()]
+        values = np.array([self.__number(item.get('value')) for item in items], dtype=float)
+        type_names, types = np.unique([str(item.get('type')) for item in items], return_inverse=True)
+        hours = np.repeat(self.__hours(keys), counts)
+        slots = np.repeat(np.arange(len(keys)), counts)
+
+        rejected = np.zeros(len(items), dtype=np.int8)
+
+        def reject(mask, check):
+            fresh = mask & (rejected == 0)
+            rejected[fresh] = CHECKS.index(check) + 1
+            report[check] += int(fresh.sum())
+
+        # keep the last copy of every (hour, type)
+        combined = slots * len(type_names) + types
+        _, last_reversed = np.unique(combined[::-1], return_index=True)
+        duplicate = np.ones(len(items), dtype=bool)
+        duplicate[len(items) - 1 - last_reversed] = False
+        reject(duplicate, 'duplicate')
+        reject(~np.isfinite(values), 'invalid')
+        signed = np.array([is_signed(name) for name in type_names])
+        reject((values < 0) & ~signed[types], 'negative')
+
+        magnitude = np.abs(np.nan_to_num(values))
+        accepted_by_type = dict()
+        for code, name in enumerate(type_names):
+            rows = np.flatnonzero((types == code) & (rejected == 0))
+            if not len(rows):
+                continue
+            batch = magnitude[rows]
+            batch = batch[batch > 0]
+            with self.__lock:
+                history = self.__history.get((source, name), np.zeros(0))
+            pool = np.concatenate((history, batch))
+            if not len(pool):
+                continue
+            baseline = np.median(pool)
+            # whole type off by a unit factor from what it used to be
+            if len(history) >= self.min_history and len(batch) >= min(self.min_history, 6):
+                ratio = np.median(batch) / np.median(history)
+                if ratio >= self.scale_factor or ratio <= 1 / self.scale_factor:
+                    mask = np.zeros(len(items), dtype=bool)
+                    mask[rows] = True
+                    reject(mask, 'scale')
+                    continue
+            mask = np.zeros(len(items), dtype=bool)
+            mask[rows] = magnitude[rows] >= self.scale_factor * baseline
+            reject(mask, 'scale')
+            rows = rows[rejected[rows] == 0]
+            self.__reject_jumps(rows, hours, magnitude, baseline, reject, len(items))
+            rows = rows[rejected[rows] == 0]
+            accepted_by_type[name] = magnitude[rows][magnitude[rows] > 0]
+
+        with self.__lock:
+            for name, accepted in (accepted_by_type.items() if learn else ()):
+                history = self.__history.get((source, name), np.zeros(0))
+                self.__history[(source, name)] = np.concatenate((history, accepted))[-self.window:]
+
+        keep = rejected == 0
+        clean = dict()
+        offset = 0
+        for key, count in zip(keys, counts):
+            kept = [items[i] for i in range(offset, offset + count) if keep[i]]
+            if kept or not count:
+                clean[key] = kept
+            offset += count
+        return clean, report
+
+    def __reject_jumps(self, rows, hours, magnitude, baseline, reject, size):
+        if len(rows) < 2:
+            return
+        rows = rows[np.argsort(hours[rows], kind='stable')]
+        first, second = rows[:-1], rows[1:]
+        a, b = magnitude[first], magnitude[second]
+        consecutive = (hours[second] - hours[first] == 1) & (a > 0) & (b > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.maximum(a, b) / np.minimum(a, b)
+            big = consecutive & (ratio >= self.jump_factor) & (np.abs(a - b) >= 0.5 * baseline)
+            # blame whichever side is further from the baseline
+            off_a = np.abs(np.log(a / baseline))
+            off_b = np.abs(np.log(b / baseline))
+        mask = np.zeros(size, dtype=bool)
+        mask[first[big & (off_a >= off_b)]] = True
+        mask[second[big & (off_a < off_b)]] = True
+        reject(mask, 'jump')
+
+    @staticmethod
+    def __hours(keys: list) -> np.ndarray:
+        if all(is_epoch(key) for key in keys):
+            return np.array(keys, dtype=np.int64)
+        return parse_hour_keys(keys)
+
+    @staticmethod
+    def __number(value) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float('nan')
+
+
+def synthetic_history(days: int, types=7, seed=0) -> dict:
+    '''
+    days of hourly {hour key: [{'value', 'type'}, ...]} with a daily cycle
+    '''
+    import datetime
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2019, 1, 1)
+    entries = dict()
+    for hour in range(days * 24):
+        date = start + datetime.timedelta(hours=hour)
+        cycle = 1 + 0.5 * np.sin(2 * np.pi * (hour % 24) / 24)
+        entries[date.strftime("%H-%d/%m/%Y")] = [
+            {'value': float(100 * (kind + 1) * cycle * rng.uniform(0.9, 1.1)), 'type': 'Type%d' % kind}
+            for kind in range(types)
+        ]
+    return entries
+
+
+def main():
+    # two years of hourly data, validated in week sized batches like a backfill
+    entries = synthetic_history(730)
+    keys = list(entries)
+    validator = BatchValidator()
+    started = time.perf_counter()
+    rejected = 0
+    for first in range(0, len(keys), 168):
+        week = {key: entries[key] for key in keys[first:first + 168]}
+        _, report = validator.validate('Synthetic', week)
+        rejected += sum(report[check] for check in CHECKS)
+    elapsed = time.perf_counter() - started
+    print('validated', len(keys), 'hours in', round(elapsed, 3), 's')
+    print(round(elapsed / len(keys) * 1e6, 1), 'us per hour,', rejected, 'rejected')
+
+
+if __name__ == "__main__":
+    main()
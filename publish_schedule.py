@@ -0,0 +1,91 @@
+'''
+When to scrape a source, lined up with when it publishes
+
+Counting frequency() seconds from whenever the manager started scrapes
+at arbitrary times: started at :58, El Salvador gets scraped at :58,
+just before the new hour is out. A PublishSchedule fires instead at
+    slot = start of each period (local time) + offset, plus up to jitter
+and after a scrape that didn't bring anything new, it tries again every
+retry_every seconds until retry_window after the slot, so data that's
+published late is still picked up within that period.
+
+"New" is a newer epoch hour than any seen before (adapters key their
+data by epoch hour, see forecast.timekeys).
+
+Periods are at most a day and divide it evenly (hourly, every 6 hours,
+daily, ...).
+'''
+from forecast.timekeys import is_epoch, zone, localize
+import datetime
+import random
+import threading
+
+DAY = 24 * 60 * 60
+
+
+class PublishSchedule:
+
+    def __init__(self, period: int, offset=0, jitter=0, retry_every=None, retry_window=0,
+                 tz='UTC', random=random.random):
+        if period <= 0 or DAY % period:
+            raise ValueError("period has to divide a day, got %s" % period)
+        self.period = period
+        self.offset = offset
+        self.jitter = jitter
+        self.retry_every = retry_every
+        self.retry_window = retry_window
+        self.tz = tz
+        self.__random = random
+        self.__lock = threading.Lock()
+        # newest epoch hour scraped so far
+        self.__newest = None
+        # slot fresh data was last found in
+        self.__captured = None
+
+    def slot(self, now: datetime.datetime) -> datetime.datetime:
+        '''
+        The latest publication time at or before now (aware)
+        '''
+        local = now.astimezone(zone(self.tz)).replace(tzinfo=None)
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (local - midnight).total_seconds() - self.offset
+        return localize(
+            midnight + datetime.timedelta(seconds=elapsed // self.period * self.period + self.offset),
+            self.tz)
+
+    def next_slot(self, now: datetime.datetime) -> datetime.datetime:
+        return localize(self.slot(now).replace(tzinfo=None) + datetime.timedelta(seconds=self.period), self.tz)
+
+    def seen(self, data) -> bool:
+        '''
+        Takes note of what a scrape returned, True if it had a newer hour than before
+        '''
+        hours = [key for key in data or () if is_epoch(key)]
+        if not hours:
+            return False
+        newest = max(hours)
+        with self.__lock:
+            fresh = self.__newest is None or newest > self.__newest
+            if fresh:
+                self.__newest = newest
+        return fresh
+
+    def delay(self, now: datetime.datetime, fresh: bool) -> float:
+        '''
+        Seconds from now until the next scrape, after one that was (not) fresh
+        '''
+        slot = self.slot(now)
+        until_next = (self.next_slot(now) - now).total_seconds()
+        with self.__lock:
+            if fresh:
+                self.__captured = slot
+            captured = self.__captured == slot
+        if not captured and self.retry_every and now < slot + datetime.timedelta(seconds=self.retry_window):
+            return min(self.retry_every, until_next)
+        return until_next + self.jitter * self.__random()
+
+    def wait(self, data) -> float:
+        '''
+        seen() then delay() from the current time
+        '''
+        return self.delay(datetime.datetime.now(datetime.timezone.utc), self.seen(data))
@@ -0,0 +1,194 @@
+'''
+Priority scheduling of scrapes, forecasts and backfills per source
+
+Every source (country) gets a fixed pool of worker threads, which caps
+how many browsers that source can have open at once. Jobs wait in the
+source's queue by priority class, then in order of submission:
+    REALTIME  latest data, AdapterThread's scheduled scrapes
+    FORECAST  forecaster runs
+    BACKFILL  historical requests and gap fills
+so a long check_db pass never holds up the hourly scrape of a source,
+it only gets the workers nothing more urgent needs. Priority only picks
+the next job though, so reserved_realtime workers of each pool never
+take forecasts or backfills: a realtime scrape doesn't wait for a slow
+backfill to finish (pools of one worker can't reserve it).
+
+Admission control: max_queued caps the jobs of a class waiting per
+source, submit() turns the rest down (returns None).
+
+Time spent queued is reported per class in cfv_schedule_wait_seconds
+and wait_times().
+'''
+from metrics import schedule_wait_seconds
+from concurrent.futures import Future
+import heapq
+import itertools
+import threading
+import time
+
+REALTIME = 0
+FORECAST = 1
+BACKFILL = 2
+
+CLASS_NAMES = {REALTIME: 'realtime', FORECAST: 'forecast', BACKFILL: 'backfill'}
+
+
+def source_of(kind) -> str:
+    '''
+    AdapterTypes/ForecasterTypes (or a plain name) -> the source it belongs to
+
+    An adapter and a forecaster of the same country share a source
+    '''
+    return getattr(kind, 'name', str(kind))
+
+
+class PriorityScheduler:
+
+    def __init__(self, workers=2, max_queued=None, clock=time.monotonic, reserved_realtime=1):
+        self.workers = workers
+        # forecasts and backfills running at once per source
+        self.background_workers = max(1, workers - reserved_realtime)
+        # {class: jobs allowed to wait per source}, None is no limit
+        self.max_queued = dict(max_queued or {})
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # source -> its pool
+        self.__pools = dict()
+        self.__order = itertools.count()
+        # class -> [jobs started, total wait, longest wait]
+        self.__waits = {kind: [0, 0.0, 0.0] for kind in CLASS_NAMES}
+        self.__alive = True
+
+    def submit(self, source, priority: int, function, *args, **kwargs) -> Future:
+        '''
+        Queues function(*args, **kwargs) on the source's pool
+
+        returns its Future, or None if the class is full for that source
+        (or the scheduler is shut down)
+        '''
+        source = source_of(source)
+        with self.__lock:
+            if not self.__alive:
+                return None
+            pool = self.__pools.get(source)
+            if pool is None:
+                pool = self.__pools[source] = self.__start_pool(source)
+        future = Future()
+        with pool['condition']:
+            cap = self.max_queued.get(priority)
+            if cap is not None and pool['queued'][priority] >= cap:
+                return None
+            pool['queued'][priority] += 1
+            heapq.heappush(pool['jobs'], (
+                priority, next(self.__order), self.__clock(), future, function, args, kwargs))
+            pool['condition'].notify()
+        return future
+
+    def shutdown(self, timeout=None):
+        '''
+        Cancels the queued jobs and waits up to timeout for the running ones
+        '''
+        with self.__lock:
+            self.__alive = False
+            pools = list(self.__pools.values())
+        for pool in pools:
+            with pool['condition']:
+                for job in pool['jobs']:
+                    job[3].cancel()
+                pool['jobs'].clear()
+                pool['condition'].notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for pool in pools:
+            for thread in pool['threads']:
+                thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def wait_times(self) -> dict:
+        '''
+        {class name: {'jobs', 'mean', 'max'}} of the time jobs spent queued
+        '''
+        with self.__lock:
+            return {
+                CLASS_NAMES[kind]: {
+                    'jobs': jobs,
+                    'mean': total / jobs if jobs else 0.0,
+                    'max': longest
+                }
+                for kind, (jobs, total, longest) in self.__waits.items()
+            }
+
+    def stats(self) -> dict:
+        '''
+        {source: {'running', class name: queued, ...}}
+        '''
+        with self.__lock:
+            pools = dict(self.__pools)
+        stats = dict()
+        for source, pool in pools.items():
+            with pool['condition']:
+                stats[source] = {'running': pool['running']}
+                stats[source].update(
+                    (CLASS_NAMES[kind], count) for kind, count in pool['queued'].items())
+        return stats
+
+    def __start_pool(self, source: str) -> dict:
+        pool = {
+            'condition': threading.Condition(),
+            'jobs': [],
+            'queued': {kind: 0 for kind in CLASS_NAMES},
+            'running': 0,
+            # running jobs that aren't realtime
+            'background': 0,
+            'threads': []
+        }
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self.__work, args=(source, pool),
+                name='%s-%d' % (source, number), daemon=True)
+            pool['threads'].append(thread)
+            thread.start()
+        return pool
+
+    def __work(self, source: str, pool: dict):
+        condition = pool['condition']
+        while True:
+            with condition:
+                while self.__alive and not self.__can_start(pool):
+                    condition.wait()
+                if not pool['jobs']:
+                    return
+                priority, _, queued_at, future, function, args, kwargs = heapq.heappop(pool['jobs'])
+                pool['queued'][priority] -= 1
+                pool['running'] += 1
+                if priority != REALTIME:
+                    pool['background'] += 1
+            self.__record_wait(source, priority, self.__clock() - queued_at)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(function(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with condition:
+                    pool['running'] -= 1
+                    if priority != REALTIME:
+                        pool['background'] -= 1
+                        # a worker may be waiting for a background slot
+                        condition.notify()
+
+    def __can_start(self, pool: dict) -> bool:
+        '''
+        True if the pool's next job can run now (called with its condition held)
+        '''
+        if not pool['jobs']:
+            return False
+        # the most urgent job is first: if it isn't realtime none is queued
+        return pool['jobs'][0][0] == REALTIME or pool['background'] < self.background_workers
+
+    def __record_wait(self, source: str, priority: int, waited: float):
+        with self.__lock:
+            record = self.__waits[priority]
+            record[0] += 1
+            record[1] += waited
+            record[2] = max(record[2], waited)
+        schedule_wait_seconds.observe(waited, source=source, priority=CLASS_NAMES[priority])
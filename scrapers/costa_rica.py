@@ -27,10 +27,13 @@ import selenium
 from bs4 import BeautifulSoup
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
+from scrapers.rate_limit import limiter
 
 
 class CostaRica:
     URL = 'https://apps.grupoice.com/CenceWeb/CencePosdespachoNacional.jsf'
+    # rate limits shared with the other Costa Rica scrapers (scrapers.rate_limit)
+    SOURCE = 'Costa_Rica'
     driver = None
 
     def __init__(self):
@@ -64,16 +67,20 @@ class CostaRica:
         start_date = datetime.date(start_year, start_month, start_day)
         end_date = datetime.date(end_year, end_month, end_day)
         all_data_points = []
+        limits = limiter(self.SOURCE)
+        # a session per day, so realtime scrapes aren't kept waiting a backfill
         while start_date <= end_date:
-            # Reformat date to match costa rica's search field
-            date = (str(start_date.day).zfill(2) + "/" +
-                    str(start_date.month).zfill(2) + "/" +
-                    str(start_date.year).zfill(4))
-            search_date_field = self.driver.find_element_by_name(
-                "formPosdespacho:txtFechaInicio_input")
-            search_date_field.clear()
-            search_date_field.send_keys(date + Keys.RETURN)
-            all_data_points.extend(self.__scrape_data(date))
+            with limits.session():
+                # Reformat date to match costa rica's search field
+                date = (str(start_date.day).zfill(2) + "/" +
+                        str(start_date.month).zfill(2) + "/" +
+                        str(start_date.year).zfill(4))
+                search_date_field = self.driver.find_element_by_name(
+                    "formPosdespacho:txtFechaInicio_input")
+                search_date_field.clear()
+                limits.acquire()
+                search_date_field.send_keys(date + Keys.RETURN)
+                all_data_points.extend(self.__scrape_data(date))
             start_date += datetime.timedelta(days=1)
         return all_data_points
 
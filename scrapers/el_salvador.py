@@ -44,10 +44,13 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
+from scrapers.rate_limit import limiter
 
 
 class ElSalvador:
     URL = 'http://estadistico.ut.com.sv/OperacionDiaria.aspx'
+    # rate limits shared with the other El Salvador scrapers (scrapers.rate_limit)
+    SOURCE = 'El_Salvador'
     driver = None
     TRANSLATION_DICT = {
         'Biomasa': 'Biomass',
@@ -228,12 +231,17 @@ class ElSalvador:
             raise Exception("Start date should come before end date.")
 
         data = []
+        limits = limiter(self.SOURCE)
+        # a session per day, so realtime scrapes aren't kept waiting a backfill
         while start_date <= end_date:
-            data.extend(self.date(
-                start_date.year,
-                start_date.month,
-                start_date.day
-            ))
+            with limits.session():
+                # every day reloads the whole dashboard
+                limits.acquire()
+                data.extend(self.date(
+                    start_date.year,
+                    start_date.month,
+                    start_date.day
+                ))
             start_date += delta
         return data
 
@@ -5,6 +5,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
+from scrapers.rate_limit import limiter
 import zipfile
 import pandas as pd
 import os
@@ -26,6 +27,8 @@ class Mexico:
     """
     URL = ('https://www.cenace.gob.mx/Paginas/'
            'SIM/Reportes/EnergiaGeneradaTipoTec.aspx')
+    # rate limits shared with the other Mexico scrapers (scrapers.rate_limit)
+    SOURCE = 'Mexico'
     TRANSLATION_DICT = {
         'Eolica': 'Wind',
         'Fotovoltaica': 'Photovoltaic',
@@ -170,8 +173,12 @@ class Mexico:
         provides data across the input month range.
         The data only dates back to April of 2016.
         """
-        self.__retrieve_files(initial_month, initial_year,
-                              final_month, final_year)
+        limits = limiter(self.SOURCE)
+        with limits.session():
+            # one zip download for the whole range
+            limits.acquire()
+            self.__retrieve_files(initial_month, initial_year,
+                                  final_month, final_year)
 
         data = []
         for filename in os.listdir(self.downloads_dir):
@@ -38,12 +38,15 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
+from scrapers.rate_limit import limiter
 
 
 class Nicaragua:
     URL = ('http://www.cndc.org.ni/consultas/reportesDiarios/'
            'postDespachoEnergia.php?fecha=')
 
+    # rate limits shared with the other Nicaragua scrapers (scrapers.rate_limit)
+    SOURCE = 'Nicaragua'
     driver = None
 
     def __init__(self):
@@ -76,24 +79,28 @@ class Nicaragua:
         start_date = datetime.date(start_year, start_month, start_day)
         end_date = datetime.date(end_year, end_month, end_day)
         all_data_points = []
+        limits = limiter(self.SOURCE)
+        # a session per day, so realtime scrapes aren't kept waiting a backfill
         while start_date <= end_date:
-            # Reformat date to match nicaragua's search field
-            date = (str(start_date.day).zfill(2) + "/" +
-                    str(start_date.month).zfill(2) + "/" +
-                    str(start_date.year).zfill(4))
-
-            self.driver.get(self.URL + date)
-            WebDriverWait(self.driver, 30).until(
-                ec.presence_of_element_located((
-                    By.XPATH, ('//div[@id="Postdespacho"]/'
-                               '/table[@id="GeneracionXAgente"]'))))
-            table_date = self.driver.find_element_by_id(
-                'dtpFechaConsulta').get_attribute('value')
-            tabs = self.driver.find_element_by_class_name(
-                'tabs').find_elements_by_tag_name('table')
-            tabs[1].click()
-
-            all_data_points.extend(self.__scrape_data(table_date))
+            with limits.session():
+                # Reformat date to match nicaragua's search field
+                date = (str(start_date.day).zfill(2) + "/" +
+                        str(start_date.month).zfill(2) + "/" +
+                        str(start_date.year).zfill(4))
+
+                limits.acquire()
+                self.driver.get(self.URL + date)
+                WebDriverWait(self.driver, 30).until(
+                    ec.presence_of_element_located((
+                        By.XPATH, ('//div[@id="Postdespacho"]/'
+                                   '/table[@id="GeneracionXAgente"]'))))
+                table_date = self.driver.find_element_by_id(
+                    'dtpFechaConsulta').get_attribute('value')
+                tabs = self.driver.find_element_by_class_name(
+                    'tabs').find_elements_by_tag_name('table')
+                tabs[1].click()
+
+                all_data_points.extend(self.__scrape_data(table_date))
             start_date += datetime.timedelta(days=1)
         return all_data_points
 
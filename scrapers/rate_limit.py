@@ -0,0 +1,200 @@
+'''
+Request rate and session limits per source, shared by all its scrapers
+
+The sites slow down or fail when hit in bursts (a backfill and a
+realtime scrape at once, retries on top). Every scraper of a source
+goes through the same RateLimiter:
+    - session(): held for each page or download (a day of date_range, the
+      zip of scrape_month_range), at most `sessions` at once against the
+      site. Realtime scrapes (made inside realtime()) have one more of
+      their own, so they never wait for a backfill's download to finish
+    - acquire(): before each page load or form submit, a token bucket
+      allowing `rate` requests per second with bursts of up to `burst`
+Time spent waiting on either is counted per source (wait_times()) and
+in cfv_scrape_wait_seconds.
+
+Limits live per process: with a ProcessPool (pipeline.processes) each
+worker gets its share, see split(). manager.scrape_limits overrides
+DEFAULT_LIMITS per source.
+'''
+from metrics import scrape_wait_seconds
+from contextlib import contextmanager
+import threading
+import time
+
+# {source: limits}, sources named like AdapterTypes
+DEFAULT_LIMITS = {
+    'El_Salvador': {'rate': 0.2, 'burst': 1, 'sessions': 1},
+    'Costa_Rica': {'rate': 0.5, 'burst': 2, 'sessions': 1},
+    'Nicaragua': {'rate': 0.5, 'burst': 2, 'sessions': 2},
+    'Mexico': {'rate': 0.1, 'burst': 1, 'sessions': 1}
+}
+
+_lock = threading.Lock()
+_limiters = dict()
+_limits = {source: dict(limits) for source, limits in DEFAULT_LIMITS.items()}
+# whether this thread is making a realtime scrape
+_realtime = threading.local()
+
+
+class RateLimiter:
+
+    def __init__(self, source: str, rate=1.0, burst=1, sessions=1,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.source = source
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__condition = threading.Condition()
+        self.__active = 0
+        self.__realtime_active = 0
+        self.update(rate, burst, sessions)
+        self.__tokens = float(self.burst)
+        self.__refilled = clock()
+        # limit -> [waits, total seconds, longest]
+        self.__waits = {'rate': [0, 0.0, 0.0], 'session': [0, 0.0, 0.0]}
+
+    def update(self, rate=None, burst=None, sessions=None):
+        '''
+        Changes the limits, sessions already open stay open
+        '''
+        with self.__condition:
+            if rate is not None:
+                self.rate = float(rate)
+            if burst is not None:
+                self.burst = max(1, burst)
+            if sessions is not None:
+                self.sessions = max(1, sessions)
+            self.__condition.notify_all()
+
+    def acquire(self) -> float:
+        '''
+        Takes a token for one request, sleeping until there is one
+
+        returns the seconds waited
+        '''
+        with self.__condition:
+            now = self.__clock()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__refilled) * self.rate)
+            self.__refilled = now
+            # below zero is a reservation: callers wait their turn in order
+            self.__tokens -= 1
+            wait = max(0.0, -self.__tokens / self.rate)
+        if wait:
+            self.__sleep(wait)
+        self.__record('rate', wait)
+        return wait
+
+    @contextmanager
+    def session(self):
+        '''
+        Holds one of the source's sessions, waiting for one to free up
+
+        Inside realtime() it's the realtime session instead
+        '''
+        realtime = getattr(_realtime, 'active', False)
+        began = self.__clock()
+        with self.__condition:
+            if realtime:
+                while self.__realtime_active:
+                    self.__condition.wait()
+                self.__realtime_active += 1
+            else:
+                while self.__active >= self.sessions:
+                    self.__condition.wait()
+                self.__active += 1
+        self.__record('session', self.__clock() - began)
+        try:
+            yield self
+        finally:
+            with self.__condition:
+                if realtime:
+                    self.__realtime_active -= 1
+                else:
+                    self.__active -= 1
+                # both kinds wait on the condition
+                self.__condition.notify_all()
+
+    def wait_times(self) -> dict:
+        '''
+        {'rate'/'session': {'waits', 'mean', 'max'}} seconds spent waiting
+        '''
+        with self.__condition:
+            return {
+                limit: {'waits': waits, 'mean': total / waits if waits else 0.0, 'max': longest}
+                for limit, (waits, total, longest) in self.__waits.items()
+            }
+
+    def __record(self, limit: str, waited: float):
+        with self.__condition:
+            record = self.__waits[limit]
+            record[0] += 1
+            record[1] += waited
+            record[2] = max(record[2], waited)
+        scrape_wait_seconds.observe(waited, source=self.source, limit=limit)
+
+
+@contextmanager
+def realtime():
+    '''
+    Marks the scrapes this thread makes inside as realtime ones
+    '''
+    previous = getattr(_realtime, 'active', False)
+    _realtime.active = True
+    try:
+        yield
+    finally:
+        _realtime.active = previous
+
+
+def limiter(source: str) -> RateLimiter:
+    '''
+    The RateLimiter every scraper of source shares
+    '''
+    with _lock:
+        if source not in _limiters:
+            _limiters[source] = RateLimiter(source, **_limits.get(source, {}))
+        return _limiters[source]
+
+
+def configure(limits: dict):
+    '''
+    Sets {source: {'rate', 'burst', 'sessions'}}, for limiters in use too
+    '''
+    with _lock:
+        for source, settings in (limits or {}).items():
+            _limits.setdefault(source, dict()).update(settings)
+            if source in _limiters:
+                _limiters[source].update(**settings)
+
+
+def with_defaults(overrides: dict) -> dict:
+    '''
+    DEFAULT_LIMITS with overrides ({source: {'rate', ...}}) applied
+    '''
+    limits = {source: dict(settings) for source, settings in DEFAULT_LIMITS.items()}
+    for source, settings in (overrides or {}).items():
+        limits.setdefault(source, dict()).update(settings)
+    return limits
+
+
+def split(limits: dict, parts: int) -> dict:
+    '''
+    Each of parts processes' share of limits, so together they stay within them
+    '''
+    return {
+        source: {
+            'rate': settings.get('rate', 1.0) / parts,
+            'burst': max(1, settings.get('burst', 1) // parts),
+            'sessions': max(1, settings.get('sessions', 1) // parts)
+        }
+        for source, settings in limits.items()
+    }
+
+
+def wait_times() -> dict:
+    '''
+    {source: RateLimiter.wait_times()} of the limiters in use
+    '''
+    with _lock:
+        limiters = dict(_limiters)
+    return {source: limiter.wait_times() for source, limiter in limiters.items()}
@@ -0,0 +1,55 @@
+'''
+Startup timing for the manager
+
+Every phase of a (re)start is timed so it's clear where the seconds go:
+    with startup_timer.phase('adapters'):
+        ...
+    startup_timer.report()
+'''
+from contextlib import contextmanager
+import threading
+import time
+
+# roughly process start: manager imports this first
+STARTED = time.perf_counter()
+
+
+class PhaseTimer:
+    '''
+    Records how long named phases take, phases may overlap (threads)
+    '''
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.__phases = []
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, began, time.perf_counter())
+
+    def record(self, name: str, began: float, ended: float):
+        with self.__lock:
+            self.__phases.append((name, began - self.started, ended - began))
+
+    def phases(self) -> list:
+        '''
+        [(name, seconds after start it began, seconds it took), ...]
+        '''
+        with self.__lock:
+            return sorted(self.__phases, key=lambda phase: phase[1])
+
+    def report(self) -> str:
+        lines = ["Startup took %.2fs:" % (time.perf_counter() - self.started)]
+        for name, offset, seconds in self.phases():
+            lines.append("\t%-32s %7.2fs (at +%.2fs)" % (name, seconds, offset))
+        report = '\n'.join(lines)
+        print(report)
+        return report
+
+
+startup_timer = PhaseTimer(STARTED)
@@ -0,0 +1,144 @@
+'''
+Restarts cron's adapters and forecasters when they report trouble
+
+Workers report to the supervisor instead of being polled:
+    - failed(key): restart it after base_backoff * 2^(failures-1)
+      seconds (up to max_backoff), growing while it keeps failing
+    - succeeded(key): clears its failures, and with refresh=True
+      restarts it right away (forecasters rebuild after every run)
+The supervisor thread sleeps on a condition until a restart is due or
+a report comes in, so it costs nothing while everything is healthy.
+Restarts are counted per worker and in cfv_worker_restarts_total.
+'''
+from metrics import worker_restarts_total
+import heapq
+import itertools
+import threading
+import time
+
+
+class Supervisor:
+
+    def __init__(self, base_backoff=5.0, max_backoff=10 * 60.0, clock=time.monotonic):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.__clock = clock
+        self.__condition = threading.Condition()
+        # key -> function that restarts it
+        self.__workers = dict()
+        # key -> consecutive failures
+        self.__failures = dict()
+        self.__restarts = dict()
+        # [(due, order, key, reason), ...] restarts waiting for their time
+        self.__due = []
+        self.__order = itertools.count()
+        self.__alive = False
+        self.__thread = None
+
+    def watch(self, key, restart):
+        '''
+        Supervises a worker, restart() rebuilds it
+        '''
+        with self.__condition:
+            self.__workers[key] = restart
+            self.__failures.setdefault(key, 0)
+            self.__restarts.setdefault(key, 0)
+
+    def failed(self, key, error=None):
+        with self.__condition:
+            self.__failures[key] = self.__failures.get(key, 0) + 1
+            delay = self.backoff(self.__failures[key])
+            if error is not None:
+                print(key, "failed:", error, "- restarting in", delay, "s")
+            self.__schedule(key, delay, 'failure')
+
+    def succeeded(self, key, refresh=False):
+        with self.__condition:
+            self.__failures[key] = 0
+            if refresh:
+                self.__schedule(key, 0, 'refresh')
+
+    def record_restart(self, key, reason: str):
+        '''
+        Counts a restart, for runtimes that rebuild their workers themselves
+        '''
+        with self.__condition:
+            self.__restarts[key] = self.__restarts.get(key, 0) + 1
+        worker_restarts_total.inc(source=str(key), reason=reason)
+
+    def backoff(self, failures: int) -> float:
+        return min(self.base_backoff * 2 ** (max(failures, 1) - 1), self.max_backoff)
+
+    def restarts(self, key=None):
+        '''
+        Restarts done for key, or {key: restarts} for every worker
+        '''
+        with self.__condition:
+            if key is not None:
+                return self.__restarts.get(key, 0)
+            return dict(self.__restarts)
+
+    def stats(self) -> dict:
+        with self.__condition:
+            return {
+                'restarts': sum(self.__restarts.values()),
+                'pending': len(self.__due),
+                'failing': sorted(str(key) for key, count in self.__failures.items() if count)
+            }
+
+    def start(self):
+        with self.__condition:
+            self.__alive = True
+        self.__thread = threading.Thread(target=self.__run, name='supervisor', daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        with self.__condition:
+            self.__alive = False
+            self.__condition.notify_all()
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def __schedule(self, key, delay: float, reason: str):
+        # one pending restart per worker is enough, keep the earliest
+        for due, _, pending, _ in self.__due:
+            if pending == key and due <= self.__clock() + delay:
+                return
+        self.__due = [entry for entry in self.__due if entry[2] != key]
+        heapq.heapify(self.__due)
+        heapq.heappush(self.__due, (self.__clock() + delay, next(self.__order), key, reason))
+        self.__condition.notify_all()
+
+    def __next_restart(self):
+        '''
+        Sleeps until a restart is due, returns (key, reason) or None when stopped
+        '''
+        with self.__condition:
+            while self.__alive:
+                if self.__due:
+                    wait = self.__due[0][0] - self.__clock()
+                    if wait <= 0:
+                        _, _, key, reason = heapq.heappop(self.__due)
+                        return key, reason
+                    self.__condition.wait(wait)
+                else:
+                    self.__condition.wait()
+            return None
+
+    def __run(self):
+        while True:
+            due = self.__next_restart()
+            if due is None:
+                return
+            key, reason = due
+            with self.__condition:
+                restart = self.__workers.get(key)
+            if restart is None:
+                continue
+            try:
+                restart()
+            except Exception as e:
+                # the rebuild itself failed, back off further
+                self.failed(key, e)
+                continue
+            self.record_restart(key, reason)
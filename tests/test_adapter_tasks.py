@@ -0,0 +1,98 @@
+from adapters.adapter_tasks import AdapterThread, AdapterTypes, ADAPTER_PATHS
+from adapters.scraper_adapter import ScraperAdapter
+from pipeline.upload_queue import UploadQueue
+import threading
+import time
+
+
+class FakeAdapter(ScraperAdapter):
+    def __init__(self, frequency=60 * 60, scrape_time=0):
+        self.scrape_time = scrape_time
+        self.scrapes = 0
+        self.scraped = threading.Event()
+        self.__frequency = frequency
+
+    def set_last_scraped_date(self, date):
+        pass
+
+    def scrape_history(self, **dates):
+        return dict()
+
+    def scrape_new_data(self):
+        time.sleep(self.scrape_time)
+        self.scrapes += 1
+        self.scraped.set()
+        return {self.scrapes: [{'value': 1, 'type': 'Solar'}]}
+
+    def frequency(self):
+        return self.__frequency
+
+
+def start(monkeypatch, adapter) -> AdapterThread:
+    monkeypatch.setitem(ADAPTER_PATHS, AdapterTypes.Mexico, (__name__, 'FakeAdapter'))
+    thread = AdapterThread(adapter, UploadQueue())
+    thread.start()
+    assert adapter.scraped.wait(1)
+    adapter.scraped.clear()
+    return thread
+
+
+# T1
+def test_scrape_now_wakes_the_thread(monkeypatch):
+    adapter = FakeAdapter()
+    thread = start(monkeypatch, adapter)
+    began = time.perf_counter()
+    thread.schedule_todays_data_now()
+    assert adapter.scraped.wait(1)
+    assert time.perf_counter() - began < 0.5
+    assert adapter.scrapes == 2
+    assert len(thread.upload_queue) == 2
+    thread.join()
+
+
+# T2
+def test_stop_latency_while_sleeping(monkeypatch):
+    thread = start(monkeypatch, FakeAdapter())
+    began = time.perf_counter()
+    thread.join()
+    assert time.perf_counter() - began < 0.5
+    assert not thread.is_alive()
+
+
+# T3
+def test_stop_waits_only_for_the_scrape_in_progress(monkeypatch):
+    adapter = FakeAdapter(scrape_time=0.3)
+    thread = start(monkeypatch, adapter)
+    thread.schedule_todays_data_now()
+    time.sleep(0.05)
+    began = time.perf_counter()
+    thread.join()
+    assert time.perf_counter() - began < 0.3 + 0.2
+    assert adapter.scrapes == 2
+
+
+class BrokenAdapter(FakeAdapter):
+    def scrape_new_data(self):
+        self.scraped.set()
+        raise RuntimeError("driver died")
+
+
+# T4
+def test_failures_go_to_the_supervisor(monkeypatch):
+    from supervisor import Supervisor
+    monkeypatch.setitem(ADAPTER_PATHS, AdapterTypes.Mexico, (__name__, 'FakeAdapter'))
+    supervisor = Supervisor(base_backoff=0.01)
+    thread = AdapterThread(BrokenAdapter(), UploadQueue())
+    thread.supervisor = supervisor
+    supervisor.watch(AdapterTypes.Mexico, thread.recover)
+    supervisor.start()
+    thread.start()
+    # recovered with a fresh adapter, which scrapes right away
+    deadline = time.monotonic() + 1
+    while not len(thread.upload_queue) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    thread.join()
+    supervisor.stop()
+    assert isinstance(thread.adapter, FakeAdapter) and thread.adapter.scrapes == 1
+    assert supervisor.restarts(AdapterTypes.Mexico) == 1
+    assert not thread.bad_adapter
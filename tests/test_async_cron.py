@@ -0,0 +1,106 @@
+from async_cron import AsyncCron
+from adapters.adapter_tasks import AdapterTypes
+from forecast.forecast_tasks import ForecasterTypes
+from pipeline.async_queue import AsyncUploadQueue
+from supervisor import Supervisor
+import asyncio
+import datetime
+import threading
+
+
+class FakeAdapter:
+    built = 0
+
+    def __init__(self, fail=False):
+        FakeAdapter.built += 1
+        self.fail = fail
+        self.threads = set()
+
+    def frequency(self):
+        return 60
+
+    def scrape_new_data(self):
+        self.threads.add(threading.get_ident())
+        if self.fail:
+            raise RuntimeError("driver died")
+        return {'01-01/01/2021': [{'value': 1, 'type': 'solar'}]}
+
+    def scrape_history(self, **dates):
+        return dates
+
+
+class FakeForecaster:
+    def frequency(self):
+        return 60
+
+    def get_exported_data(self, worker=False):
+        return {'01-01/01/2021': [{'value': 2, 'type': 'solar'}]}
+
+
+async def drain(queue, count):
+    return [await queue.get(timeout=1) for _ in range(count)]
+
+
+# T1
+def test_sources_run_on_the_pool():
+    async def run():
+        queue = AsyncUploadQueue().bind()
+        adapter = FakeAdapter()
+        jobs = AsyncCron(queue, [], builders={
+            AdapterTypes.Mexico: lambda: adapter,
+            ForecasterTypes.Nicaragua: FakeForecaster
+        }, workers_per_source=2)
+        await jobs.start()
+        got = await drain(queue, 2)
+        await jobs.stop()
+        assert threading.get_ident() not in adapter.threads
+        return sorted(kind.name for kind, _ in got)
+    assert asyncio.run(run()) == ['Mexico', 'Nicaragua']
+
+
+# T2
+def test_wakeup_runs_a_source_again():
+    async def run():
+        queue = AsyncUploadQueue().bind()
+        jobs = AsyncCron(queue, [], builders={AdapterTypes.Mexico: FakeAdapter})
+        await jobs.start()
+        await drain(queue, 1)
+        jobs.scrape_todays_data_now(AdapterTypes.Mexico)
+        await drain(queue, 1)
+        await jobs.stop()
+        return jobs.cron_alive, jobs.get_tasks()
+    assert asyncio.run(run()) == (False, [])
+
+
+# T3
+def test_failed_adapter_is_rebuilt():
+    async def run():
+        FakeAdapter.built = 0
+        queue = AsyncUploadQueue().bind()
+        adapters = iter([FakeAdapter(fail=True), FakeAdapter()])
+        jobs = AsyncCron(queue, [], builders={AdapterTypes.Mexico: lambda: next(adapters)},
+                         supervisor=Supervisor(base_backoff=0))
+        await jobs.start()
+        # the first run fails and the adapter gets replaced
+        while FakeAdapter.built < 2 or jobs.sources[AdapterTypes.Mexico].fail:
+            await asyncio.sleep(0.01)
+        jobs.scrape_todays_data_now(AdapterTypes.Mexico)
+        got = await drain(queue, 1)
+        await jobs.stop()
+        return got[0][0], jobs.get_restarts()
+    assert asyncio.run(run()) == (AdapterTypes.Mexico, {AdapterTypes.Mexico: 1})
+
+
+# T4
+def test_request_historical():
+    async def run():
+        queue = AsyncUploadQueue().bind()
+        jobs = AsyncCron(queue, [], builders={AdapterTypes.Mexico: FakeAdapter})
+        await jobs.start()
+        await drain(queue, 1)
+        await jobs.request_historical(
+            AdapterTypes.Mexico, datetime.date(2021, 1, 1), datetime.date(2021, 1, 7))
+        kind, dates = await queue.get(timeout=1)
+        await jobs.stop()
+        return kind, dates['start_day'], dates['end_day']
+    assert asyncio.run(run()) == (AdapterTypes.Mexico, 1, 7)
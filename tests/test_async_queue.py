@@ -0,0 +1,56 @@
+from pipeline.async_queue import AsyncUploadQueue
+from pipeline.spool import UploadSpool
+from queue import Empty, Full
+import asyncio
+import functools
+import pytest
+
+
+# T1
+def test_fifo_order():
+    async def run():
+        queue = AsyncUploadQueue(maxsize=5).bind()
+        for i in range(5):
+            await queue.put_async(i)
+        return [await queue.get() for _ in range(5)], queue.stats()['depth']
+    assert asyncio.run(run()) == (list(range(5)), 0)
+
+
+# T2
+def test_get_times_out():
+    async def run():
+        queue = AsyncUploadQueue().bind()
+        with pytest.raises(Empty):
+            await queue.get_with_seq(timeout=0.01)
+    asyncio.run(run())
+
+
+# T3
+def test_thread_producers_block_when_full():
+    async def run():
+        queue = AsyncUploadQueue(maxsize=1).bind()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, queue.put, 'a')
+        with pytest.raises(Full):
+            await loop.run_in_executor(None, functools.partial(queue.put, 'b', timeout=0.05))
+        # a blocked producer resumes once the uploader takes something
+        producer = loop.run_in_executor(None, queue.put, 'c')
+        assert await queue.get() == 'a'
+        await producer
+        return await queue.get()
+    assert asyncio.run(run()) == 'c'
+
+
+# T4
+def test_spooled_payloads_carry_seq(tmp_path):
+    async def run():
+        spool = UploadSpool(str(tmp_path))
+        queue = AsyncUploadQueue(spool=spool).bind()
+        await queue.put_async('acked')
+        await queue.put_async('lost')
+        seq, item = await queue.get_with_seq()
+        assert spool.pending() == 2
+        spool.ack(seq)
+        spool.close()
+    asyncio.run(run())
+    assert UploadSpool(str(tmp_path)).replay() == [(1, 'lost')]
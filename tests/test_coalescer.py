@@ -0,0 +1,41 @@
+from pipeline.coalescer import UploadCoalescer
+import time
+
+
+# T1
+def test_first_writer_wins():
+    coalescer = UploadCoalescer()
+    coalescer.add('historic', {'01-01/01/2021': 1, '02-01/01/2021': 2})
+    coalescer.add('historic', {'01-01/01/2021': 10, '03-01/01/2021': 3})
+    assert coalescer.flush() == [
+        ('historic', {'01-01/01/2021': 1, '02-01/01/2021': 2, '03-01/01/2021': 3})
+    ]
+    assert coalescer.stats()['merged'] == 1
+
+
+# T2
+def test_last_writer_wins():
+    coalescer = UploadCoalescer()
+    coalescer.add('forecast', {'01-01/01/2021': 1}, overwrite=True)
+    coalescer.add('forecast', {'01-01/01/2021': 10}, overwrite=True)
+    assert coalescer.flush() == [('forecast', {'01-01/01/2021': 10})]
+    assert len(coalescer) == 0
+
+
+# T3
+def test_flush_on_size():
+    coalescer = UploadCoalescer(max_entries=2, max_wait=60)
+    coalescer.add('historic', {'01-01/01/2021': 1})
+    assert not coalescer.ready()
+    coalescer.add('historic', {'02-01/01/2021': 1})
+    assert coalescer.ready()
+
+
+# T4
+def test_flush_on_time():
+    coalescer = UploadCoalescer(max_entries=100, max_wait=0.01)
+    assert coalescer.time_until_flush() == 1.0
+    coalescer.add('historic', {'01-01/01/2021': 1})
+    time.sleep(0.02)
+    assert coalescer.ready()
+    assert coalescer.time_until_flush() == 0.0
@@ -0,0 +1,82 @@
+from database.columnar import (
+    encode, decode, read_frame, hour_keys, doc_types, migrate_collection, is_columnar)
+import datetime
+import bson
+import numpy as np
+
+TYPES = ['Biomass', 'Geothermal', 'HydroElectric', 'Solar']
+
+
+def legacy_doc(doc_id='01/01/2019', hours=168):
+    start = datetime.datetime.strptime(doc_id, "%d/%m/%Y")
+    doc = {'_id': doc_id}
+    for hour in range(hours):
+        key = (start + datetime.timedelta(hours=hour)).strftime("%H-%d/%m/%Y")
+        doc[key] = [{'value': hour + i / 10, 'type': meta} for i, meta in enumerate(TYPES)]
+    return doc
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.writes = []
+
+    def find(self, query, batch_size=None):
+        return iter(self.docs)
+
+    def bulk_write(self, requests, ordered=True):
+        self.writes.extend(requests)
+
+
+# T1
+def test_round_trip():
+    doc = legacy_doc(hours=30)
+    columnar = encode(doc)
+    assert is_columnar(columnar)
+    assert columnar['hours'] == 30
+    types, values, mask = decode(columnar)
+    assert types == TYPES
+    assert mask.sum() == 30
+    assert values[29, 3] == 29.3
+    assert np.isnan(values[30, 0])
+    assert sorted(hour_keys(columnar)) == sorted(key for key in doc if key != '_id')
+    assert doc_types(columnar) == TYPES
+
+
+# T2
+def test_legacy_keys_win_in_mixed_docs():
+    columnar = encode(legacy_doc(hours=2))
+    columnar['01-01/01/2019'] = [{'value': 99.0, 'type': 'Wind'}]
+    types, values, mask = decode(columnar)
+    assert types == TYPES + ['Wind']
+    assert np.isnan(values[1, 0])
+    assert values[1, 4] == 99.0
+    assert values[0, 0] == 0.0
+
+
+# T3
+def test_read_frame_matches_both_layouts():
+    legacy = legacy_doc(hours=50)
+    frame = read_frame([legacy], TYPES)
+    assert list(frame.columns) == ['ds'] + TYPES
+    assert len(frame) == 50
+    assert frame['ds'][49] == datetime.datetime(2019, 1, 3, 1)
+    assert frame.equals(read_frame([encode(legacy)], TYPES))
+    assert list(read_frame([legacy], ['Solar', 'Wind']).columns) == ['ds', 'Solar', 'Wind']
+
+
+# T4
+def test_columnar_is_smaller():
+    doc = legacy_doc()
+    assert len(bson.encode(doc)) > 4 * len(bson.encode(encode(doc)))
+
+
+# T5
+def test_migrate_collection():
+    done = encode(legacy_doc('08/01/2019'))
+    collection = FakeCollection([legacy_doc(), done, legacy_doc('15/01/2019')])
+    stats = migrate_collection(collection, before=datetime.datetime(2019, 1, 15))
+    assert stats['migrated'] == 1
+    assert stats['skipped'] == 2
+    assert stats['bytes_after'] < stats['bytes_before']
+    assert len(collection.writes) == 1
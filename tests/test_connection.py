@@ -0,0 +1,31 @@
+from database import connection
+from database.storage import MongoStorage
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def local_client(monkeypatch):
+    # a plain localhost URI, MongoClient doesn't connect until the first query
+    monkeypatch.setenv("MONGO_SRV", "mongodb://localhost:27017")
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "5")
+    connection.close()
+    yield
+    connection.close()
+
+
+# T1
+def test_client_is_shared_and_lazy():
+    created = connection.connection_stats()['created']
+    storage = MongoStorage()
+    assert connection.connection_stats()['created'] == created
+    client = storage.client
+    assert connection.get_client() is client
+    assert connection.connection_stats()['created'] == created + 1
+    assert connection.connection_stats()['create_seconds'] is not None
+
+
+# T2
+def test_central_options():
+    options = connection.client_options()
+    assert options['maxPoolSize'] == 5
+    assert connection.get_client().options.pool_options.max_pool_size == 5
@@ -0,0 +1,54 @@
+from database.coverage_index import CoverageIndex, key_to_hour, hour_to_datetime, parse_hour_keys
+from database.coverage import HOURS_PER_DOC
+import datetime
+
+
+def week_keys(day: datetime.datetime) -> list:
+    return [
+        (day + datetime.timedelta(hours=hour)).strftime("%H-%d/%m/%Y")
+        for hour in range(HOURS_PER_DOC)
+    ]
+
+
+# T1
+def test_key_round_trip():
+    assert key_to_hour("00-27/12/2016") == 0
+    assert key_to_hour("13-28/12/2016") == 37
+    assert hour_to_datetime(37) == datetime.datetime(2016, 12, 28, 13)
+
+
+# T2
+def test_missing_ranges():
+    index = CoverageIndex('test')
+    index.mark(week_keys(datetime.datetime(2019, 1, 1)))
+    index.mark(["05-08/01/2019", "06-08/01/2019"])
+    gaps = index.missing_ranges(
+        datetime.datetime(2019, 1, 1),
+        datetime.datetime(2019, 1, 9))
+    assert gaps == [
+        (datetime.datetime(2019, 1, 8, 0), datetime.datetime(2019, 1, 8, 4)),
+        (datetime.datetime(2019, 1, 8, 7), datetime.datetime(2019, 1, 8, 23))
+    ]
+    assert index.has("06-08/01/2019")
+    assert not index.has("07-08/01/2019")
+
+
+# T3
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    index = CoverageIndex('test', path)
+    assert index.is_empty()
+    index.mark(week_keys(datetime.datetime(2020, 3, 3)))
+    index.save()
+    loaded = CoverageIndex.load('test', path)
+    start, end = datetime.datetime(2020, 3, 1), datetime.datetime(2020, 3, 12)
+    assert list(loaded.missing_hours(start, end)) == list(index.missing_hours(start, end))
+    assert loaded.has("00-03/03/2020")
+
+
+# T4
+def test_parse_hour_keys_matches_key_to_hour():
+    keys = ['00-27/12/2016', '23-29/02/2020', '05-01/01/2021', '7-01/01/2021']
+    assert list(parse_hour_keys(keys)) == [key_to_hour(key) for key in keys]
+    assert list(parse_hour_keys(keys[:3])) == [key_to_hour(key) for key in keys[:3]]
+    assert len(parse_hour_keys([])) == 0
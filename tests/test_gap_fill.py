@@ -0,0 +1,163 @@
+from pipeline.gap_fill import GapFiller, FillRequest, plan, day_runs, month_runs, missing_days
+from adapters.adapter_tasks import AdapterTypes
+from database.coverage_index import CoverageIndex
+import datetime
+import threading
+
+d = datetime.date
+dt = datetime.datetime
+
+
+# T1
+def test_day_runs_merge_and_cap():
+    days = [d(2021, 1, 1), d(2021, 1, 2), d(2021, 1, 3), d(2021, 1, 5)]
+    assert day_runs(days) == [(d(2021, 1, 1), d(2021, 1, 3)), (d(2021, 1, 5), d(2021, 1, 5))]
+    assert day_runs(days[:3], max_days=2) == [
+        (d(2021, 1, 1), d(2021, 1, 2)), (d(2021, 1, 3), d(2021, 1, 3))
+    ]
+
+
+# T2
+def test_month_runs():
+    days = [d(2020, 2, 3), d(2020, 2, 27), d(2020, 3, 1)]
+    assert month_runs(days) == [(d(2020, 2, 1), d(2020, 2, 29)), (d(2020, 3, 1), d(2020, 3, 31))]
+
+
+# T3
+def test_two_year_hole_is_a_few_requests():
+    index = CoverageIndex('Test')
+    start, end = dt(2019, 1, 1), dt(2021, 1, 1)
+    ranges = index.missing_ranges(start, end)
+    assert len(missing_days(ranges)) == 731
+    mexico = plan(AdapterTypes.Mexico, ranges)
+    assert len(mexico) == 24
+    assert mexico[0] == FillRequest(AdapterTypes.Mexico, d(2019, 1, 1), d(2019, 1, 31))
+    nicaragua = plan(AdapterTypes.Nicaragua, ranges)
+    assert len(nicaragua) == 24
+    assert sum((last - first).days + 1 for _, first, last in nicaragua) == 731
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+class FakeAdapter:
+    created = 0
+    lock = threading.Lock()
+    active = 0
+    most_active = 0
+
+    def __init__(self):
+        FakeAdapter.created += 1
+
+    def scrape_history(self, **dates):
+        with FakeAdapter.lock:
+            FakeAdapter.active += 1
+            FakeAdapter.most_active = max(FakeAdapter.most_active, FakeAdapter.active)
+        threading.Event().wait(0.01)
+        with FakeAdapter.lock:
+            FakeAdapter.active -= 1
+        if dates['start_day'] == 13:
+            raise RuntimeError("page didn't load")
+        return {'00-%02d/01/2021' % dates['start_day']: []}
+
+
+# T4
+def test_filler_shares_one_adapter_per_source():
+    queue = FakeQueue()
+    filler = GapFiller(queue, workers=2, adapter_factory=lambda adapter_type: FakeAdapter())
+    requests = [
+        FillRequest(AdapterTypes.Nicaragua, d(2021, 1, day), d(2021, 1, day)) for day in range(1, 21)
+    ]
+    results = [future.result() for future in filler.submit_all(requests)]
+    filler.shutdown()
+    assert results.count(0) == 1
+    assert len(queue.items) == 19
+    # both pool threads take turns on the source's one adapter
+    assert FakeAdapter.most_active == 1
+    # plus the one replaced after the failure
+    assert FakeAdapter.created == 2
+
+
+class BrokenDayAdapter:
+    def scrape_history(self, **dates):
+        start = d(dates['start_year'], dates['start_month'], dates['start_day'])
+        end = d(dates['end_year'], dates['end_month'], dates['end_day'])
+        if start <= d(2019, 8, 29) <= end:
+            raise RuntimeError("extra columns")
+        return {'00-%02d/08/2019' % day: [] for day in range(start.day, end.day + 1)}
+
+
+# T5
+def test_registry_isolates_a_broken_day():
+    from pipeline.request_registry import RequestRegistry
+    registry = RequestRegistry(base_backoff=0, max_attempts=6)
+    queue = FakeQueue()
+    filler = GapFiller(queue, workers=1,
+                       adapter_factory=lambda adapter_type: BrokenDayAdapter(), registry=registry)
+    rounds = 0
+    while True:
+        filled = {key for _, data in queue.items for key in data}
+        ranges = [
+            (dt(2019, 8, day), dt(2019, 8, day, 23))
+            for day in range(1, 32) if '00-%02d/08/2019' % day not in filled
+        ]
+        requests = plan(AdapterTypes.Nicaragua, ranges, registry=registry)
+        if not requests:
+            break
+        for future in filler.submit_all(requests):
+            future.result()
+        rounds += 1
+    filler.shutdown()
+    assert registry.state('Nicaragua', d(2019, 8, 29)) == 'quarantined'
+    assert registry.state('Nicaragua', d(2019, 8, 28)) is None
+    assert len({key for _, data in queue.items for key in data}) == 30
+    # 31 -> 15 -> 7 -> 3 -> 1 day runs, then the day alone until quarantined
+    assert rounds == 6
+
+
+# T6
+def test_scheduled_fills_are_backfills_and_release_refused_claims():
+    from pipeline.request_registry import RequestRegistry
+    from scheduler import PriorityScheduler, BACKFILL, REALTIME
+    scheduler = PriorityScheduler(workers=1, max_queued={BACKFILL: 1})
+    registry = RequestRegistry()
+    queue = FakeQueue()
+    filler = GapFiller(queue, adapter_factory=lambda adapter_type: FakeAdapter(),
+                       registry=registry, scheduler=scheduler)
+    gate = threading.Event()
+    scheduler.submit(AdapterTypes.Nicaragua, REALTIME, gate.wait)
+    threading.Event().wait(0.05)
+    first = filler.submit(FillRequest(AdapterTypes.Nicaragua, d(2021, 1, 1), d(2021, 1, 1)))
+    refused = filler.submit(FillRequest(AdapterTypes.Nicaragua, d(2021, 1, 2), d(2021, 1, 2)))
+    assert first is not None and refused is None
+    assert registry.state('Nicaragua', d(2021, 1, 2)) is None
+    gate.set()
+    assert first.result(timeout=1) == 1
+    assert scheduler.wait_times()['backfill']['jobs'] == 1
+    filler.shutdown()
+    scheduler.shutdown()
+
+
+# T7
+def test_days_validation_rejects_fail_like_broken_ones():
+    from pipeline.request_registry import RequestRegistry
+    registry = RequestRegistry(base_backoff=0, max_attempts=2)
+    queue = FakeQueue()
+
+    def rejected_days(adapter_type, data):
+        # the site always serves the 3rd out of range
+        return [d(2019, 8, 3)] if '00-03/08/2019' in data else []
+
+    filler = GapFiller(queue, workers=1, registry=registry, rejected_days=rejected_days,
+                       adapter_factory=lambda adapter_type: BrokenDayAdapter())
+    request = FillRequest(AdapterTypes.Nicaragua, d(2019, 8, 2), d(2019, 8, 3))
+    for attempt in range(2):
+        filler.submit(request).result()
+    filler.shutdown()
+    assert registry.state('Nicaragua', d(2019, 8, 3)) == 'quarantined'
+    assert registry.state('Nicaragua', d(2019, 8, 2)) is None
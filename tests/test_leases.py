@@ -0,0 +1,96 @@
+from database.leases import FileLeaseBackend, LeaseKeeper, run_leased
+from pipeline.gap_fill import GapFiller, FillRequest, lease_keys
+from adapters.adapter_tasks import AdapterTypes
+import datetime
+import threading
+
+d = datetime.date
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# T1
+def test_a_key_has_one_holder_until_it_expires(tmp_path):
+    clock = FakeClock()
+    backend = FileLeaseBackend(str(tmp_path), clock=clock)
+    first = backend.acquire('forecast/Mexico', 'node-a', 10)
+    assert first is not None
+    assert backend.acquire('forecast/Mexico', 'node-b', 10) is None
+    clock.now += 11
+    second = backend.acquire('forecast/Mexico', 'node-b', 10)
+    assert second.owner == 'node-b' and second.token == first.token + 1
+    # node-a stalled past its ttl: its lease is no longer valid
+    assert not backend.check(first)
+    assert backend.renew(first, 10) is None
+    assert backend.check(second)
+
+
+# T2
+def test_keeper_is_all_or_nothing_and_lingers(tmp_path):
+    clock = FakeClock()
+    a = LeaseKeeper(FileLeaseBackend(str(tmp_path), clock=clock), owner='node-a', ttl=10)
+    b = LeaseKeeper(FileLeaseBackend(str(tmp_path), clock=clock), owner='node-b', ttl=10)
+    held = a.acquire(['fill/Nicaragua/2021-01-02'], heartbeat=False)
+    assert b.acquire(['fill/Nicaragua/2021-01-01', 'fill/Nicaragua/2021-01-02'], heartbeat=False) is None
+    # the key b got before being refused was handed back
+    assert a.backend.current('fill/Nicaragua/2021-01-01') is None
+    a.release(held, linger=60)
+    assert b.acquire(['fill/Nicaragua/2021-01-02'], heartbeat=False) is None
+    clock.now += 61
+    assert b.acquire(['fill/Nicaragua/2021-01-02'], heartbeat=False) is not None
+
+
+# T3
+def test_run_leased_runs_once_per_ttl(tmp_path):
+    clock = FakeClock()
+    a = LeaseKeeper(FileLeaseBackend(str(tmp_path), clock=clock), owner='node-a')
+    b = LeaseKeeper(FileLeaseBackend(str(tmp_path), clock=clock), owner='node-b')
+    assert run_leased(a, 'forecast/Mexico', 3600, lambda: 'a') == 'a'
+    assert run_leased(b, 'forecast/Mexico', 3600, lambda: 'b') is None
+    clock.now += 3601
+    assert run_leased(b, 'forecast/Mexico', 3600, lambda: 'b') == 'b'
+
+
+class FakeQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = []
+
+    def put(self, item):
+        with self.lock:
+            self.items.append(item)
+
+
+class FakeAdapter:
+    def scrape_history(self, **dates):
+        threading.Event().wait(0.01)
+        return {'00-%02d/01/2021' % dates['start_day']: []}
+
+
+# T4
+def test_two_nodes_split_the_backfill(tmp_path):
+    queue = FakeQueue()
+    fillers = [
+        GapFiller(queue, workers=2, adapter_factory=lambda adapter_type: FakeAdapter(),
+                  leases=LeaseKeeper(FileLeaseBackend(str(tmp_path)), owner=owner))
+        for owner in ('node-a', 'node-b')
+    ]
+    requests = [
+        FillRequest(AdapterTypes.Nicaragua, d(2021, 1, day), d(2021, 1, day)) for day in range(1, 11)
+    ]
+    # both nodes found the same gaps
+    futures = [future for filler in fillers for future in filler.submit_all(requests)]
+    results = [future.result() for future in futures]
+    for filler in fillers:
+        filler.shutdown()
+        filler.leases.stop()
+    assert results.count(1) == 10 and results.count(None) == 10
+    keys = [key for _, data in queue.items for key in data]
+    assert sorted(keys) == sorted(set(keys)) and len(keys) == 10
+    assert lease_keys(requests[0]) == ['fill/Nicaragua/2021-01-01']
@@ -0,0 +1,72 @@
+from metrics import Registry, Counter, Gauge, Histogram, serve, track_scrape
+import metrics
+import urllib.request
+import pytest
+
+
+# T1
+def test_counter_and_gauge_text():
+    registry = Registry()
+    counter = Counter('test_total', 'Things', ['source'], registry=registry)
+    gauge = Gauge('test_depth', 'Depth', registry=registry)
+    counter.inc(source='Mexico')
+    counter.inc(2, source='Mexico')
+    gauge.set_function(lambda: 7)
+    text = registry.render()
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{source="Mexico"} 3.0' in text
+    assert 'test_depth 7.0' in text
+    with pytest.raises(ValueError):
+        counter.inc(source='Mexico', kind='x')
+
+
+# T2
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram('test_seconds', 'Time', buckets=(1, 5), registry=registry)
+    for value in (0.5, 2, 10):
+        histogram.observe(value)
+    text = registry.render()
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="5.0"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_seconds_sum 12.5' in text
+    assert 'test_seconds_count 3' in text
+
+
+# T3
+def test_track_scrape():
+    before = metrics.scrapes_total.value(adapter='Test', kind='latest', result='failure')
+    with pytest.raises(RuntimeError):
+        with track_scrape('Test'):
+            raise RuntimeError
+    with track_scrape('Test') as scrape:
+        scrape.returned([{'value': 1}])
+    assert metrics.scrapes_total.value(adapter='Test', kind='latest', result='failure') == before + 1
+    assert metrics.scrapes_total.value(adapter='Test', kind='latest', result='success') >= 1
+    assert metrics.scrape_seconds.count(adapter='Test', kind='latest') >= 2
+    assert 0 <= metrics.seconds_since_good_scrape.value(adapter='Test') < 5
+    # a source that had nothing to scrape yet isn't a good scrape
+    good = metrics.last_good_scrape.value(adapter='Skipped')
+    skipped = metrics.scrapes_total.value(adapter='Skipped', kind='latest', result='skipped')
+    for data in ({}, None):
+        with track_scrape('Skipped') as scrape:
+            scrape.returned(data)
+    assert metrics.scrapes_total.value(adapter='Skipped', kind='latest', result='skipped') == skipped + 2
+    assert metrics.scrapes_total.value(adapter='Skipped', kind='latest', result='success') == 0
+    assert metrics.last_good_scrape.value(adapter='Skipped') == good
+
+
+# T4
+def test_endpoint():
+    registry = Registry()
+    Counter('test_served_total', 'Served', registry=registry).inc()
+    server = serve(0, registry=registry)
+    try:
+        url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'test_served_total 1.0' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,73 @@
+from pipeline.processes import ProcessPool, BenchmarkAdapter, _call, _adapters
+from pipeline.gap_fill import GapFiller, FillRequest
+from adapters.adapter_tasks import AdapterTypes, adapter_type_of, ADAPTER_PATHS
+import datetime
+import pytest
+
+d = datetime.date
+
+PATHS = {adapter_type: ('pipeline.processes', 'BenchmarkAdapter') for adapter_type in AdapterTypes}
+
+
+class FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ProcessPool(2, PATHS)
+    yield pool
+    pool.shutdown()
+
+
+# T1
+def test_process_mode_queues_what_thread_mode_does(pool):
+    requests = [
+        FillRequest(adapter_type, d(2019, 1, 1), d(2019, 1, 2)) for adapter_type in AdapterTypes
+    ]
+    queued = []
+    for factory in (lambda adapter_type: BenchmarkAdapter(), pool.adapter):
+        queue = FakeQueue()
+        filler = GapFiller(queue, workers=2, adapter_factory=factory)
+        assert [future.result() for future in filler.submit_all(requests)] == [48] * 4
+        filler.shutdown()
+        queued.append(sorted((adapter_type.name, data) for adapter_type, data in queue.items))
+    assert queued[0] == queued[1]
+
+
+# T2
+def test_process_adapter_acts_like_an_adapter(pool):
+    adapter = pool.adapter(AdapterTypes.Nicaragua)
+    assert adapter_type_of(adapter) == AdapterTypes.Nicaragua
+    assert adapter.frequency() == 60 * 60
+    assert adapter.scrape_new_data() == dict()
+    assert pool.home(AdapterTypes.Nicaragua) == pool.home(AdapterTypes.El_Salvador)
+    # errors come back from the worker
+    with pytest.raises(ValueError):
+        adapter.scrape_history(start_year=2019, start_month=2, start_day=30,
+                               end_year=2019, end_month=3, end_day=1)
+
+
+# T3
+def test_history_stays_off_the_realtime_adapter(pool, monkeypatch):
+    home = pool.home(AdapterTypes.Mexico)
+    assert pool.worker_for(AdapterTypes.Mexico, realtime=True) == home
+    assert pool.worker_for(AdapterTypes.Mexico) != home
+    single = ProcessPool(1)
+    assert single.worker_for(AdapterTypes.Mexico) == 0
+    single.shutdown()
+    # so a single worker runs both on separate adapters
+    monkeypatch.setitem(ADAPTER_PATHS, AdapterTypes.Mexico, PATHS[AdapterTypes.Mexico])
+    try:
+        _call(AdapterTypes.Mexico, 'realtime', 'frequency', (), {})
+        realtime = _adapters[(AdapterTypes.Mexico, 'realtime')]
+        with pytest.raises(ValueError):
+            _call(AdapterTypes.Mexico, 'history', 'scrape_history', (), dict(
+                start_year=2019, start_month=2, start_day=30, end_year=2019, end_month=3, end_day=1))
+        assert _adapters[(AdapterTypes.Mexico, 'realtime')] is realtime
+    finally:
+        _adapters.clear()
@@ -0,0 +1,56 @@
+from publish_schedule import PublishSchedule
+import datetime
+import pytest
+
+utc = datetime.timezone.utc
+
+
+def at(hour, minute=0, day=1):
+    return datetime.datetime(2021, 3, day, hour, minute, tzinfo=utc)
+
+
+def hourly():
+    return PublishSchedule(60 * 60, offset=5 * 60, retry_every=5 * 60, retry_window=45 * 60,
+                           random=lambda: 0)
+
+
+# T1
+def test_slots_line_up_with_publication():
+    schedule = hourly()
+    assert schedule.slot(at(13, 58)) == at(13, 5)
+    assert schedule.slot(at(14, 2)) == at(13, 5)
+    assert schedule.next_slot(at(13, 58)) == at(14, 5)
+    daily = PublishSchedule(24 * 60 * 60, offset=60 * 60, tz='America/Costa_Rica')
+    # 01:00 in Costa Rica (UTC-6)
+    assert daily.slot(at(12)) == at(7)
+    assert daily.slot(at(6)) == at(7) - datetime.timedelta(days=1)
+    with pytest.raises(ValueError):
+        PublishSchedule(7 * 60 * 60)
+
+
+# T2
+def test_started_at_58_waits_for_the_new_hour():
+    schedule = hourly()
+    # first scrape on start up gets the data out so far
+    assert schedule.seen({100: [], 101: []})
+    assert schedule.delay(at(13, 58), True) == 7 * 60
+
+
+# T3
+def test_retries_until_fresh_then_waits_for_the_next_slot():
+    schedule = hourly()
+    schedule.seen({100: []})
+    # scrape at the slot but the hour isn't out yet
+    assert not schedule.seen({100: []})
+    assert schedule.delay(at(14, 5), False) == 5 * 60
+    assert schedule.seen({100: [], 101: []})
+    assert schedule.delay(at(14, 10), True) == 55 * 60
+    # nothing new all the way past the window, give up until the next slot
+    assert schedule.delay(at(15, 55), False) == 10 * 60
+    assert not schedule.seen(None)
+
+
+# T4
+def test_jitter():
+    schedule = PublishSchedule(60 * 60, jitter=60, random=lambda: 0.5)
+    assert schedule.delay(at(13, 30), True) == 30 * 60 + 30
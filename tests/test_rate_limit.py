@@ -0,0 +1,119 @@
+from scrapers.rate_limit import RateLimiter, limiter, configure, split, realtime, with_defaults, DEFAULT_LIMITS
+import threading
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+# T1
+def test_bucket_allows_a_burst_then_the_rate():
+    clock = FakeClock()
+    limits = RateLimiter('Test', rate=2, burst=3, clock=clock, sleep=clock.sleep)
+    waits = [limits.acquire() for _ in range(5)]
+    assert waits == [0, 0, 0, 0.5, 0.5]
+    assert clock.now == 1.0
+    # idle time refills it, up to burst
+    clock.now += 10
+    assert [limits.acquire() for _ in range(4)] == [0, 0, 0, 0.5]
+    stats = limits.wait_times()['rate']
+    assert stats['waits'] == 9 and stats['max'] == 0.5
+
+
+# T2
+def test_concurrent_callers_queue_for_their_turn():
+    limits = RateLimiter('Test', rate=1, burst=1, clock=lambda: 0.0, sleep=lambda seconds: None)
+    waits = []
+    lock = threading.Lock()
+
+    def request():
+        wait = limits.acquire()
+        with lock:
+            waits.append(wait)
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # reservations: each caller waits one more second than the one before
+    assert sorted(waits) == [0, 1, 2, 3]
+
+
+# T3
+def test_sessions_are_capped():
+    limits = RateLimiter('Test', rate=100, sessions=2)
+    lock = threading.Lock()
+    active = [0, 0]
+    gate = threading.Event()
+
+    def scrape():
+        with limits.session():
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            gate.wait(1)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=scrape) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    threading.Event().wait(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert active[1] == 2
+    assert limits.wait_times()['session']['waits'] == 5
+
+
+# T4
+def test_scrapers_of_a_source_share_one_limiter():
+    assert limiter('Nicaragua') is limiter('Nicaragua')
+    configure({'Nicaragua': {'rate': 3, 'sessions': 4}})
+    assert limiter('Nicaragua').rate == 3 and limiter('Nicaragua').sessions == 4
+    shares = split({'Nicaragua': {'rate': 3, 'burst': 4, 'sessions': 4}}, 4)
+    assert shares['Nicaragua'] == {'rate': 0.75, 'burst': 1, 'sessions': 1}
+
+
+# T5
+def test_realtime_scrapes_have_their_own_session():
+    limits = RateLimiter('Test', rate=100, sessions=1)
+    backfill_started = threading.Event()
+    backfill_done = threading.Event()
+    finished = []
+
+    def backfill():
+        with limits.session():
+            backfill_started.set()
+            backfill_done.wait(1)
+        finished.append('backfill')
+
+    def scrape_new_data():
+        with realtime(), limits.session():
+            finished.append('realtime')
+
+    thread = threading.Thread(target=backfill)
+    thread.start()
+    backfill_started.wait(1)
+    scrape_new_data()
+    # got in while the backfill held the only regular session
+    assert finished == ['realtime']
+    backfill_done.set()
+    thread.join()
+    assert finished == ['realtime', 'backfill']
+
+
+# T6
+def test_overrides_apply_on_top_of_the_defaults():
+    limits = with_defaults({'Mexico': {'rate': 0.2}})
+    assert limits['Mexico'] == dict(DEFAULT_LIMITS['Mexico'], rate=0.2)
+    assert limits['Costa_Rica'] == DEFAULT_LIMITS['Costa_Rica']
+    assert DEFAULT_LIMITS['Mexico']['rate'] != 0.2
@@ -0,0 +1,61 @@
+from pipeline.request_registry import RequestRegistry
+import datetime
+
+d = datetime.date
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# T1
+def test_in_flight_is_not_claimed_twice():
+    registry = RequestRegistry()
+    assert registry.claim('Mexico', [d(2021, 1, 1), d(2021, 1, 2)])
+    assert not registry.claim('Mexico', [d(2021, 1, 2), d(2021, 1, 3)])
+    assert registry.available('Mexico', [d(2021, 1, 2), d(2021, 1, 3)]) == [d(2021, 1, 3)]
+    assert registry.claim('Nicaragua', [d(2021, 1, 2)])
+    registry.succeeded('Mexico', [d(2021, 1, 1), d(2021, 1, 2)])
+    assert registry.state('Mexico', d(2021, 1, 2)) is None
+
+
+# T2
+def test_exponential_backoff_then_quarantine():
+    clock = Clock()
+    registry = RequestRegistry(base_backoff=10, max_backoff=25, max_attempts=4, clock=clock)
+    day = [d(2019, 8, 29)]
+    waits = []
+    for _ in range(3):
+        assert registry.claim('Nicaragua', day)
+        assert registry.failed('Nicaragua', day, 'boom') == []
+        began = clock.now
+        while registry.state('Nicaragua', day[0]) == 'backoff':
+            clock.now += 1
+        waits.append(clock.now - began)
+    assert waits == [10, 20, 25]
+    registry.claim('Nicaragua', day)
+    assert registry.failed('Nicaragua', day) == day
+    clock.now += 10 ** 6
+    assert registry.state('Nicaragua', day[0]) == 'quarantined'
+    assert not registry.claim('Nicaragua', day)
+    registry.release('Nicaragua', day)
+    assert registry.claim('Nicaragua', day)
+
+
+# T3
+def test_failures_survive_restart(tmp_path):
+    path = str(tmp_path / 'registry.json')
+    registry = RequestRegistry(path)
+    registry.quarantine('Nicaragua', [d(2018, 7, 17)], 'known bad')
+    registry.claim('Mexico', [d(2021, 1, 1)])
+    registry.failed('Mexico', [d(2021, 1, 1)])
+    registry.save()
+    restarted = RequestRegistry.load(path)
+    assert restarted.state('Nicaragua', d(2018, 7, 17)) == 'quarantined'
+    assert restarted.state('Mexico', d(2021, 1, 1)) == 'backoff'
+    assert restarted.attempts('Mexico', d(2021, 1, 1)) == 1
+    assert restarted.stats() == {'in flight': 0, 'backoff': 1, 'quarantined': 1}
@@ -0,0 +1,88 @@
+from scheduler import PriorityScheduler, REALTIME, FORECAST, BACKFILL, source_of
+from adapters.adapter_tasks import AdapterTypes
+from forecast.forecast_tasks import ForecasterTypes
+import threading
+import time
+
+
+# T1
+def test_priority_order_within_a_source():
+    scheduler = PriorityScheduler(workers=1)
+    gate = threading.Event()
+    order = []
+    blocker = scheduler.submit('Mexico', BACKFILL, gate.wait)
+    time.sleep(0.05)
+    futures = [
+        scheduler.submit('Mexico', BACKFILL, order.append, 'backfill'),
+        scheduler.submit('Mexico', FORECAST, order.append, 'forecast'),
+        scheduler.submit('Mexico', REALTIME, order.append, 'realtime'),
+    ]
+    assert scheduler.stats()['Mexico'] == {'running': 1, 'realtime': 1, 'forecast': 1, 'backfill': 1}
+    gate.set()
+    for future in [blocker] + futures:
+        future.result(timeout=1)
+    assert order == ['realtime', 'forecast', 'backfill']
+    waits = scheduler.wait_times()
+    assert waits['realtime']['jobs'] == 1 and waits['backfill']['jobs'] == 2
+    assert waits['backfill']['max'] >= waits['realtime']['max'] > 0
+    scheduler.shutdown()
+
+
+# T2
+def test_pools_are_per_source_and_capped():
+    scheduler = PriorityScheduler(workers=2, reserved_realtime=0)
+    lock = threading.Lock()
+    running = {'now': 0, 'most': 0}
+
+    def scrape():
+        with lock:
+            running['now'] += 1
+            running['most'] = max(running['most'], running['now'])
+        time.sleep(0.05)
+        with lock:
+            running['now'] -= 1
+
+    futures = [scheduler.submit(AdapterTypes.Nicaragua, BACKFILL, scrape) for _ in range(6)]
+    # another source isn't held up by Nicaragua's backlog
+    began = time.perf_counter()
+    scheduler.submit(AdapterTypes.Mexico, REALTIME, time.sleep, 0).result(timeout=1)
+    assert time.perf_counter() - began < 0.05
+    for future in futures:
+        future.result(timeout=1)
+    assert running['most'] == 2
+    assert source_of(ForecasterTypes.Nicaragua) == source_of(AdapterTypes.Nicaragua)
+    scheduler.shutdown()
+
+
+# T3
+def test_admission_control_and_shutdown():
+    scheduler = PriorityScheduler(workers=1, max_queued={BACKFILL: 1})
+    gate = threading.Event()
+    running = scheduler.submit('Costa_Rica', REALTIME, gate.wait)
+    time.sleep(0.05)
+    queued = scheduler.submit('Costa_Rica', BACKFILL, time.sleep, 0)
+    assert queued is not None
+    assert scheduler.submit('Costa_Rica', BACKFILL, time.sleep, 0) is None
+    assert scheduler.submit('Costa_Rica', REALTIME, time.sleep, 0) is not None
+    gate.set()
+    running.result(timeout=1)
+    scheduler.shutdown(timeout=1)
+    assert scheduler.submit('Costa_Rica', REALTIME, time.sleep, 0) is None
+
+
+# T4
+def test_a_worker_is_kept_for_realtime():
+    scheduler = PriorityScheduler(workers=2)
+    gate = threading.Event()
+    forecast = scheduler.submit('Nicaragua', FORECAST, gate.wait)
+    backfills = [scheduler.submit('Nicaragua', BACKFILL, gate.wait) for _ in range(2)]
+    time.sleep(0.05)
+    # the forecast runs, the backfills wait even though a worker is idle
+    assert scheduler.stats()['Nicaragua'] == {'running': 1, 'realtime': 0, 'forecast': 0, 'backfill': 2}
+    began = time.perf_counter()
+    scheduler.submit('Nicaragua', REALTIME, time.sleep, 0).result(timeout=1)
+    assert time.perf_counter() - began < 0.05
+    gate.set()
+    for future in backfills + [forecast]:
+        future.result(timeout=1)
+    scheduler.shutdown()
@@ -0,0 +1,58 @@
+from startup import PhaseTimer
+from adapters.adapter_tasks import AdapterTypes, adapter_class, adapter_type_of
+import subprocess
+import sys
+import threading
+import time
+
+
+# T1
+def test_phases_are_recorded_in_start_order():
+    timer = PhaseTimer()
+    with timer.phase('first'):
+        time.sleep(0.01)
+    with timer.phase('second'):
+        pass
+    phases = timer.phases()
+    assert [name for name, _, _ in phases] == ['first', 'second']
+    assert phases[0][2] >= 0.01
+    assert phases[1][1] >= phases[0][1]
+    assert 'first' in timer.report()
+
+
+# T2
+def test_overlapping_phases_from_threads():
+    timer = PhaseTimer()
+
+    def work(name):
+        with timer.phase(name):
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=work, args=(str(i),)) for i in range(4)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(timer.phases()) == 4
+    # ran side by side, not one after another
+    assert time.perf_counter() - began < 0.2
+
+
+# T3
+def test_manager_import_skips_heavy_modules():
+    heavy = ['pandas', 'selenium', 'matplotlib', 'forecast.forecast', 'adapters.mexico_adapter']
+    out = subprocess.run(
+        [sys.executable, '-c',
+         "import sys, manager; print([m for m in %r if m in sys.modules])" % heavy],
+        capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == '[]'
+
+
+# T4
+def test_adapter_type_of():
+    cls = adapter_class(AdapterTypes.Mexico)
+    assert cls.__name__ == 'MexicoAdapter'
+    adapter = cls.__new__(cls)
+    assert adapter_type_of(adapter) == AdapterTypes.Mexico
+    assert adapter_type_of(object()) is None
@@ -0,0 +1,154 @@
+from database.storage import (
+    SQLiteStorage, group_by_doc, week_ids, bulk_upsert, bulk_requests
+)
+from database.columnar import encode
+import datetime
+import pytest
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'test.sqlite3'))
+    yield storage
+    storage.close()
+
+
+def entry(doc_id, key, value):
+    return {'_id': doc_id, key: [{'value': value, 'type': 'Solar'}]}
+
+
+# T1
+def test_group_by_doc():
+    docs = group_by_doc([
+        entry('01/01/2019', '00-01/01/2019', 1),
+        entry('01/01/2019', '01-01/01/2019', 2),
+        entry('08/01/2019', '00-08/01/2019', 3)
+    ])
+    assert list(docs) == ['01/01/2019', '08/01/2019']
+    assert len(docs['01/01/2019']) == 2
+
+
+# T2
+def test_week_ids():
+    assert week_ids(
+        datetime.datetime(2019, 1, 3),
+        datetime.datetime(2019, 1, 16)) == ['01/01/2019', '08/01/2019', '15/01/2019']
+
+
+# T3
+def test_upsert_keeps_existing(storage):
+    assert storage.upsert('Test', 'Historic', [entry('01/01/2019', '00-01/01/2019', 1)]) == (1, 0)
+    assert storage.upsert('Test', 'Historic', [
+        entry('01/01/2019', '00-01/01/2019', 5),
+        entry('01/01/2019', '01-01/01/2019', 2)
+    ]) == (1, 1)
+    doc = next(storage.find_docs('Test', 'Historic', {'_id': '01/01/2019'}))
+    assert doc['00-01/01/2019'][0]['value'] == 1
+    assert doc['01-01/01/2019'][0]['value'] == 2
+
+
+# T4
+def test_upsert_overwrite(storage):
+    storage.upsert('Test', 'Forecast', [entry('01/01/2019', '00-01/01/2019', 1)])
+    storage.upsert('Test', 'Forecast', [entry('01/01/2019', '00-01/01/2019', 5)], overwrite=True)
+    docs = list(storage.find_docs('Test', 'Forecast'))
+    assert docs == [{'_id': '01/01/2019', '00-01/01/2019': [{'value': 5, 'type': 'Solar'}]}]
+
+
+# T5
+def test_range_and_keys(storage):
+    storage.insert_doc('Test', 'Historic', {
+        '_id': '01/01/2019',
+        '00-01/01/2019': [],
+        '01-01/01/2019': []
+    })
+    storage.upsert('Test', 'Historic', [entry('15/01/2019', '00-15/01/2019', 1)])
+    docs = list(storage.read_range(
+        'Test', 'Historic',
+        datetime.datetime(2019, 1, 2),
+        datetime.datetime(2019, 1, 9)))
+    assert [doc['_id'] for doc in docs] == ['01/01/2019']
+    assert sorted(storage.hour_keys('Test', 'Historic')) == [
+        '00-01/01/2019', '00-15/01/2019', '01-01/01/2019'
+    ]
+    assert list(storage.hour_keys('Other', 'Historic')) == []
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.requests = []
+
+    def aggregate(self, pipeline):
+        ids = pipeline[0]['$match']['_id']['$in']
+        return [
+            {'_id': doc['_id'], 'keys': list(doc), 'mask': doc.get('mask')}
+            for doc in self.docs if doc['_id'] in ids
+        ]
+
+    def bulk_write(self, requests, ordered=True):
+        self.requests.extend(requests)
+
+
+# T6
+def test_bulk_requests_group_by_week():
+    entries = [
+        entry('01/01/2019', '00-01/01/2019', 1),
+        entry('08/01/2019', '00-08/01/2019', 2),
+        entry('01/01/2019', '01-01/01/2019', 3)
+    ]
+    collection = FakeCollection()
+    assert bulk_upsert(collection, entries) == (3, 0)
+    assert [request._filter for request in collection.requests] == [
+        {'_id': '01/01/2019'}, {'_id': '08/01/2019'}
+    ]
+    assert all(request._upsert for request in collection.requests)
+    update = collection.requests[0]._doc
+    assert update['$set']['00-01/01/2019'] == [{'value': 1, 'type': 'Solar'}]
+    assert set(update['$set']) == {'00-01/01/2019', '01-01/01/2019'}
+
+
+# T7
+def test_bulk_requests_set_every_hour():
+    requests = bulk_requests(group_by_doc([
+        entry('01/01/2019', '00-01/01/2019', 1),
+        entry('01/01/2019', '01-01/01/2019', 3)
+    ]))
+    assert len(requests) == 1
+    assert requests[0]._doc == {'$set': {
+        '00-01/01/2019': [{'value': 1, 'type': 'Solar'}],
+        '01-01/01/2019': [{'value': 3, 'type': 'Solar'}]
+    }}
+
+
+# T8
+def test_columnar_hours_arent_added_back():
+    migrated = encode({'_id': '01/01/2019', '00-01/01/2019': [{'value': 1, 'type': 'Solar'}]})
+    collection = FakeCollection([migrated])
+    assert bulk_upsert(collection, [
+        entry('01/01/2019', '00-01/01/2019', 5),
+        entry('01/01/2019', '01-01/01/2019', 3),
+        entry('08/01/2019', '00-08/01/2019', 2)
+    ]) == (2, 1)
+    # the hour in the columns isn't written as a key that would win over it
+    assert set(collection.requests[0]._doc['$set']) == {'01-01/01/2019'}
+    assert collection.requests[1]._filter == {'_id': '08/01/2019'}
+    # nothing new for the doc at all: no write
+    collection.requests.clear()
+    assert bulk_upsert(collection, [entry('01/01/2019', '00-01/01/2019', 5)]) == (0, 1)
+    assert collection.requests == []
+
+
+# T9
+def test_mongo_counts_hours_like_sqlite(storage):
+    collection = FakeCollection([{'_id': '01/01/2019', '00-01/01/2019': []}])
+    entries = [
+        entry('01/01/2019', '00-01/01/2019', 1),
+        entry('01/01/2019', '01-01/01/2019', 2),
+        entry('01/01/2019', '02-01/01/2019', 3)
+    ]
+    storage.upsert('Test', 'Historic', entries[:1])
+    assert bulk_upsert(collection, entries) == storage.upsert('Test', 'Historic', entries) == (2, 1)
+    # the stored hour isn't part of the write, so it stays as it is
+    assert set(collection.requests[0]._doc['$set']) == {'01-01/01/2019', '02-01/01/2019'}
+    assert bulk_upsert(collection, entries, overwrite=True) == (3, 0)
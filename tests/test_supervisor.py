@@ -0,0 +1,64 @@
+from supervisor import Supervisor
+import threading
+import time
+
+
+class FakeWorker:
+    def __init__(self, broken_rebuilds=0):
+        self.rebuilds = []
+        self.broken_rebuilds = broken_rebuilds
+        self.rebuilt = threading.Event()
+
+    def restart(self):
+        self.rebuilds.append(time.monotonic())
+        if len(self.rebuilds) <= self.broken_rebuilds:
+            raise RuntimeError("no driver")
+        self.rebuilt.set()
+
+
+# T1
+def test_failures_restart_with_backoff():
+    supervisor = Supervisor(base_backoff=0.05)
+    worker = FakeWorker(broken_rebuilds=2)
+    supervisor.watch('Mexico', worker.restart)
+    supervisor.start()
+    began = time.monotonic()
+    supervisor.failed('Mexico')
+    assert worker.rebuilt.wait(2)
+    supervisor.stop()
+    # 0.05 after the failure, then 0.1 and 0.2 after each broken rebuild
+    assert len(worker.rebuilds) == 3
+    assert worker.rebuilds[0] - began >= 0.05
+    assert worker.rebuilds[2] - worker.rebuilds[1] >= 0.2
+    assert supervisor.restarts('Mexico') == 1
+    assert supervisor.stats()['failing'] == ['Mexico']
+
+
+# T2
+def test_success_resets_and_refreshes():
+    supervisor = Supervisor(base_backoff=10)
+    worker = FakeWorker()
+    supervisor.watch('Nicaragua', worker.restart)
+    supervisor.start()
+    supervisor.failed('Nicaragua')
+    assert supervisor.backoff(2) == 20
+    supervisor.succeeded('Nicaragua', refresh=True)
+    # the refresh replaces the pending restart and runs right away
+    assert worker.rebuilt.wait(1)
+    supervisor.stop()
+    assert supervisor.restarts() == {'Nicaragua': 1}
+    assert supervisor.stats() == {'restarts': 1, 'pending': 0, 'failing': []}
+
+
+# T3
+def test_idle_costs_no_cpu():
+    supervisor = Supervisor()
+    supervisor.watch('El_Salvador', FakeWorker().restart)
+    supervisor.start()
+    began = time.process_time()
+    time.sleep(0.3)
+    spent = time.process_time() - began
+    stopping = time.perf_counter()
+    supervisor.stop()
+    assert spent < 0.05
+    assert time.perf_counter() - stopping < 0.1
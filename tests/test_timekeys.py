@@ -0,0 +1,78 @@
+from forecast.timekeys import (
+    week_id, get_doc, str2datetime, week_ids, naive_datetimes, aware_datetimes, legacy_week_id,
+    epoch_hour, epoch_datetime, epoch_hours, legacy_keys, epoch_keys, storage_keys)
+import datetime
+import pytz
+
+
+def hourly_keys(start: datetime.datetime, hours: int) -> list:
+    return [(start + datetime.timedelta(hours=hour)).strftime("%H-%d/%m/%Y") for hour in range(hours)]
+
+
+# T1
+def test_week_ids_match_arrow_conversion():
+    keys = hourly_keys(datetime.datetime(2016, 12, 20), 24 * 60)
+    assert week_ids(keys) == [legacy_week_id(key, 'America/Managua') for key in keys]
+    assert week_ids([]) == []
+
+
+# T2
+def test_get_doc():
+    assert week_id(0) == "27/12/2016"
+    assert get_doc(datetime.datetime(2017, 1, 2, 23)) == "27/12/2016"
+    assert get_doc(datetime.datetime(2017, 1, 3)) == "03/01/2017"
+    assert get_doc(datetime.datetime(2016, 12, 26)) == "20/12/2016"
+
+
+# T3
+def test_datetimes():
+    keys = ["00-01/01/2019", "13-02/01/2019"]
+    assert naive_datetimes(keys) == [datetime.datetime(2019, 1, 1), datetime.datetime(2019, 1, 2, 13)]
+    managua = pytz.timezone('America/Managua')
+    aware = aware_datetimes(keys, managua)
+    assert [date.replace(tzinfo=None) for date in aware] == naive_datetimes(keys)
+    assert aware[0] == managua.localize(datetime.datetime(2019, 1, 1))
+    assert aware == aware_datetimes(keys, 'America/Managua')
+    assert str2datetime(keys[1], managua) == aware[1]
+    assert str2datetime(keys[1]).tzinfo is None
+
+
+# T4
+def test_epoch_hours_round_trip():
+    keys = hourly_keys(datetime.datetime(2019, 1, 1), 24 * 365)
+    for tz in ('America/Managua', 'America/El_Salvador', 'Mexico/General'):
+        hours = epoch_hours(keys, tz)
+        assert (hours[1:] >= hours[:-1]).all()
+        # every hour of the year but the one Mexico skipped for DST
+        assert sum(a != b for a, b in zip(legacy_keys(hours, tz), keys)) <= 1
+    assert epoch_hours(["00-27/12/2016"], 'UTC').tolist() == [0]
+    assert epoch_hours(["00-27/12/2016"], 'America/Managua').tolist() == [6]
+
+
+# T5
+def test_epoch_hour_of_datetimes():
+    managua = pytz.timezone('America/Managua')
+    local = managua.localize(datetime.datetime(2019, 1, 1, 5))
+    hour = epoch_hour(local)
+    assert hour == epoch_hour(datetime.datetime(2019, 1, 1, 5), 'America/Managua')
+    assert hour == epoch_hour(datetime.datetime(2019, 1, 1, 11))
+    assert epoch_datetime(hour, 'America/Managua') == local
+
+
+# T6
+def test_storage_keys():
+    tz = 'America/Costa_Rica'
+    entries = {epoch_hour(datetime.datetime(2019, 1, 1, hour), tz): hour for hour in (3, 1, 2)}
+    entries["00-01/01/2019"] = 0
+    assert storage_keys(entries, tz) == {
+        "00-01/01/2019": 0, "01-01/01/2019": 1, "02-01/01/2019": 2, "03-01/01/2019": 3}
+    assert epoch_keys(storage_keys(entries, tz), tz) == epoch_keys(entries, tz)
+
+
+# T7
+def test_storage_keys_keep_the_first_repeated_hour():
+    tz = 'Mexico/General'
+    # 01:00 happens twice on 27/10/2019, at 06:00 and 07:00 UTC
+    first, second = (epoch_hour(datetime.datetime(2019, 10, 27, hour, tzinfo=pytz.utc)) for hour in (6, 7))
+    assert legacy_keys([first, second], tz) == ["01-27/10/2019", "01-27/10/2019"]
+    assert storage_keys({second: 'second', first: 'first'}, tz) == {"01-27/10/2019": 'first'}
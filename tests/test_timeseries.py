@@ -0,0 +1,85 @@
+from database.timeseries import (
+    TimeseriesHistoric, local_to_utc, to_measurements, measurements_to_frame)
+import datetime
+
+
+class FakeCollection:
+    def __init__(self):
+        self.inserted = []
+
+    def insert_many(self, docs, ordered=True):
+        self.inserted.extend(docs)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collection = FakeCollection()
+        self.created = []
+
+    def __getitem__(self, name):
+        return self.collection
+
+    def list_collection_names(self, filter=None):
+        return self.created
+
+    def create_collection(self, name, **kwargs):
+        self.created.append(name)
+        self.options = kwargs
+
+
+class FakeClient:
+    def __init__(self):
+        self.db = FakeDatabase()
+
+    def get_database(self, name):
+        return self.db
+
+
+# T1
+def test_local_to_utc():
+    # El Salvador is UTC-6 all year
+    assert local_to_utc("13-05/02/2021", 'America/El_Salvador') == datetime.datetime(2021, 2, 5, 19)
+    # the repeated hour of a fall back is the first one, like timekeys
+    assert local_to_utc("01-31/10/2021", 'America/Mexico_City') == datetime.datetime(2021, 10, 31, 6)
+
+
+# T2
+def test_to_measurements():
+    measurements = to_measurements('El_Salvador', {
+        "00-01/01/2021": [{'value': 1, 'type': 'Solar'}, {'value': 2, 'type': 'Wind'}]
+    })
+    assert measurements[1] == {
+        'ts': datetime.datetime(2021, 1, 1, 6),
+        'meta': {'country': 'El_Salvador', 'type': 'Wind'},
+        'value': 2.0
+    }
+    # epoch hours are taken as they are
+    assert to_measurements('Mexico', {
+        hour: [{'value': 1, 'type': 'Solar'}] for hour in (42462, 42463)
+    })[1]['ts'] == datetime.datetime(2021, 10, 31, 7)
+
+
+# T3
+def test_frame_is_local_and_hourly():
+    rows = [
+        {'ts': datetime.datetime(2021, 1, 1, 6), 'type': 'Solar', 'value': 1.0},
+        {'ts': datetime.datetime(2021, 1, 1, 6), 'type': 'Wind', 'value': 2.0},
+        {'ts': datetime.datetime(2021, 1, 1, 7), 'type': 'Solar', 'value': 3.0}
+    ]
+    frame = measurements_to_frame(rows, 'El_Salvador', ['Solar', 'Wind', 'Thermal'])
+    assert list(frame.columns) == ['ds', 'Solar', 'Wind', 'Thermal']
+    assert frame['ds'][0] == datetime.datetime(2021, 1, 1, 0)
+    assert frame['Solar'].tolist() == [1.0, 3.0]
+
+
+# T4
+def test_insert_creates_collection_once():
+    client = FakeClient()
+    timeseries = TimeseriesHistoric(client)
+    entries = {"00-01/01/2021": [{'value': 1, 'type': 'Solar'}]}
+    assert timeseries.insert('El_Salvador', entries) == 1
+    assert timeseries.insert('El_Salvador', {}) == 0
+    timeseries.insert('El_Salvador', entries)
+    assert client.db.created == ['Historic']
+    assert client.db.options['timeseries']['metaField'] == 'meta'
+    assert len(client.db.collection.inserted) == 2
@@ -0,0 +1,55 @@
+from pipeline.upload_queue import UploadQueue
+from queue import Empty, Full
+import threading
+import pytest
+
+
+# T1
+def test_fifo_order():
+    queue = UploadQueue(maxsize=5)
+    for i in range(5):
+        queue.put(i)
+    assert [queue.get() for _ in range(5)] == list(range(5))
+    assert queue.stats()['depth'] == 0
+
+
+# T2
+def test_full_queue_blocks():
+    queue = UploadQueue(maxsize=1)
+    queue.put('a')
+    with pytest.raises(Full):
+        queue.put('b', timeout=0.05)
+    with pytest.raises(Full):
+        queue.put('b', block=False)
+    assert queue.stats()['put_wait'] > 0
+
+
+# T3
+def test_blocked_producer_resumes():
+    queue = UploadQueue(maxsize=1)
+    queue.put('a')
+    producer = threading.Thread(target=queue.put, args=('b',))
+    producer.start()
+    assert queue.get(timeout=1) == 'a'
+    assert queue.get(timeout=1) == 'b'
+    producer.join(1)
+    assert not producer.is_alive()
+
+
+# T4
+def test_empty_get_times_out():
+    queue = UploadQueue()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+
+
+# T5
+def test_spill_keeps_order(tmp_path):
+    queue = UploadQueue(maxsize=2, spill_dir=str(tmp_path))
+    for i in range(6):
+        queue.put(i, block=False)
+    stats = queue.stats()
+    assert stats['spilled'] == 4
+    assert stats['depth'] == 6
+    assert [queue.get() for _ in range(6)] == list(range(6))
+    assert not list(tmp_path.iterdir())
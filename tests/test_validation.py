@@ -0,0 +1,75 @@
+from pipeline.validation import BatchValidator, synthetic_history
+
+
+def day(values, kind='Solar', date='01/01/2021'):
+    return {'%02d-%s' % (hour, date): [{'value': value, 'type': kind}] for hour, value in enumerate(values)}
+
+
+# T1
+def test_clean_batch_passes_untouched():
+    entries = synthetic_history(3)
+    clean, report = BatchValidator().validate('Test', entries)
+    assert clean == entries
+    assert report['hours'] == 72 and report['entries'] == 72 * 7
+    assert report['scale'] == report['jump'] == report['negative'] == 0
+
+
+# T2
+def test_duplicates_keep_the_last_copy():
+    entries = {'00-01/01/2021': [
+        {'value': 90000, 'type': 'Wind'},
+        {'value': 5, 'type': 'Solar'},
+        {'value': 120, 'type': 'Wind'}
+    ]}
+    clean, report = BatchValidator().validate('Mexico', entries)
+    assert clean['00-01/01/2021'] == [{'value': 5, 'type': 'Solar'}, {'value': 120, 'type': 'Wind'}]
+    assert report['duplicate'] == 1
+
+
+# T3
+def test_negative_and_invalid_values():
+    entries = {'05-01/01/2021': [
+        {'value': -3, 'type': 'Thermal'},
+        {'value': -40, 'type': 'INTERCHANGE'},
+        {'value': None, 'type': 'Wind'}
+    ]}
+    clean, report = BatchValidator().validate('Nicaragua', entries)
+    assert clean == {'05-01/01/2021': [{'value': -40, 'type': 'INTERCHANGE'}]}
+    assert report['negative'] == 1 and report['invalid'] == 1
+
+
+# T4
+def test_unit_scale_values_and_batches():
+    validator = BatchValidator(min_history=12)
+    values = [100.0 + hour for hour in range(24)]
+    values[10] = 110000.0
+    clean, report = validator.validate('El_Salvador', day(values))
+    assert report['scale'] == 1
+    # its only value was bad, so the hour is left for a later scrape
+    assert '10-01/01/2021' not in clean and len(clean) == 23
+    # a whole day reported 1000x smaller than the history
+    _, report = validator.validate('El_Salvador', day([value / 1000 for value in values], date='02/01/2021'))
+    assert report['scale'] == 24
+
+
+# T5
+def test_jumps_but_not_dawn():
+    validator = BatchValidator()
+    dawn = [0, 0, 0, 0, 0, 0.1, 5, 20, 60, 100, 120, 130, 130, 120, 100, 60, 20, 5, 0.1, 0, 0, 0, 0, 0]
+    _, report = validator.validate('Costa_Rica', day(dawn))
+    assert report['jump'] == 0
+    flat = [500.0] * 24
+    flat[12] = 0.3
+    clean, report = validator.validate('Costa_Rica', day(flat, kind='Hydroelectric'))
+    assert report['jump'] == 1
+    assert '12-01/01/2021' not in clean
+
+
+# T6
+def test_epoch_hour_keys():
+    flat = [500.0] * 24
+    flat[12] = 0.3
+    entries = {1000 + hour: [{'value': value, 'type': 'Hydroelectric'}] for hour, value in enumerate(flat)}
+    clean, report = BatchValidator().validate('Costa_Rica', entries)
+    assert report['jump'] == 1
+    assert 1012 not in clean and len(clean) == 23